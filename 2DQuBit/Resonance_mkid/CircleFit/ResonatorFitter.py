@@ -5,9 +5,19 @@ from scipy.linalg import null_space
 class CircleEstimator:
     """
     Algebraic circle fitting via a generalized eigenvalue approach.
+
+    solver = "eig"    -> autovalori di B^-1 M, eta e autovettore insieme (default)
+    solver = "newton" -> Newton su det(M - eta B) da 0 + null_space
+
+    calibration: CalibrationCache (calibration_cache.py) con tau e baseline della linea,
+    usata da get_delay e remove_baseline; None = delay rifittato su ogni traccia.
     """
 
-    def __init__(self):
+    def __init__(self, solver="eig", calibration=None):
+        if solver not in ("eig", "newton"):
+            raise ValueError(f"Unknown solver '{solver}' (use 'eig' or 'newton')")
+        self.solver = solver
+        self.calibration = calibration
         self.params = None
         self.coefficients = None
         self.eta_value = None
@@ -63,6 +73,32 @@ class CircleEstimator:
         func = lambda e: CircleEstimator._determinant_function(M, B, e)
         return optimize.newton(func, 0.0)
 
+    # Inversa della matrice di vincolo B
+
+    B_inverse = np.array([
+        [0., 0., 0., -0.5],
+        [0., 1., 0., 0.],
+        [0., 0., 1., 0.],
+        [-0.5, 0., 0., 0.]
+    ], dtype=float)
+
+    # Risolve direttamente M a = eta B a come autovalori di B^-1 M: prende il piu' piccolo
+    # eta non negativo e il suo autovettore nello stesso passo (Newton da 0 a volte
+    # converge alla radice sbagliata ed e' molto piu' lento)
+
+    @staticmethod
+    def _find_eta_eigen(M):
+        eigvals, eigvecs = np.linalg.eig(CircleEstimator.B_inverse @ M)
+        eigvals, eigvecs = eigvals.real, eigvecs.real
+        # autovalori non negativi scelti con a^T B a > 0 (a^T M a = eta a^T B a >= 0), non col segno:
+        # senza rumore l'eta giusto e' ~0 e puo' uscire leggermente negativo
+        norms = eigvecs[1]**2 + eigvecs[2]**2 - 4.0*eigvecs[0]*eigvecs[3]
+        candidates = np.where(norms > 0, eigvals, np.inf)
+        k = np.argmin(candidates)
+        if not np.isfinite(candidates[k]):
+            raise RuntimeError("No eigenvector with a^T B a > 0 found")
+        return eigvals[k], eigvecs[:, k]
+
     # Impone a^(T)Ba=1 per soddisfare il vincolo imposto
 
     @staticmethod
@@ -88,15 +124,18 @@ class CircleEstimator:
     def fit(self, x, y):
         moments = self._compute_moments(x, y)
         M, B = self._construct_matrices(moments)
-        eta_val = self._find_eta(M, B)
+        if self.solver == "eig":
+            eta_val, vec = self._find_eta_eigen(M)
+        else:
+            eta_val = self._find_eta(M, B)
+            D_matrix = M - eta_val * B
+            null_vecs = null_space(D_matrix)
+            if null_vecs.size == 0:
+                raise RuntimeError("Null space is empty; no solution found")
+            vec = null_vecs[:, 0]
         self.eta_value = eta_val
 
-        D_matrix = M - eta_val * B
-        null_vecs = null_space(D_matrix)
-        if null_vecs.size == 0:
-            raise RuntimeError("Null space is empty; no solution found")
-
-        vec = self._normalize_vector(null_vecs[:, 0], B)
+        vec = self._normalize_vector(vec, B)
         self.coefficients = vec
         A, Bc, Cc, Dc = vec
 
@@ -133,9 +172,174 @@ class CircleEstimator:
             residual, initial_delay, args=(freq, z), maxfev=10000, ftol=1e-15, xtol=1e-15
         )
         return result[0][0]
+
+    # Delay dalla cache di calibrazione se c'e' per questa banda, altrimenti
+    # estimate_delay + fit_with_delay (e il risultato va in cache per le tracce dopo)
+
+    def get_delay(self, freq, z):
+        if self.calibration is not None:
+            tau = self.calibration.tau(freq)
+            if tau is not None:
+                return tau
+        tau = self.fit_with_delay(freq, z, initial_delay=self.estimate_delay(freq, z))
+        if self.calibration is not None:
+            self.calibration.store(freq, tau)
+        return tau
+
+    # Divide per la baseline (ampiezza e fase di fondo) salvata in cache, se c'e'
+
+    def remove_baseline(self, freq, z):
+        if self.calibration is None:
+            return z
+        baseline = self.calibration.baseline(freq)
+        return z if baseline is None else z / baseline
     
     # Sposta il cerchio a (1,0)
 
     def canonize_data(self, freq, z, scale, rotation, delay):
         return 1/scale * np.exp(-1j * rotation) * self.remove_delay(freq, z, delay)
-    
+
+
+class NotchFitter:
+    """
+    Fit del modello notch (Probst) con jacobiano analitico.
+
+        z = P (1 - C/D),  P = a e^{i alpha} e^{-2 pi i tau f},  C = (Ql/|Qc|) e^{i phi},  D = 1 + 2i Ql (f/f0 - 1)
+
+    Parametri nello stesso ordine di S21_notch_complex in main_fit: (Ql, |Qc|, phi, fr, amp, alpha, tau).
+    Con Q = P C / D (quindi z = P - Q) le derivate sono:
+        dz/dQl = -Q/(Ql D)      dz/d|Qc| = Q/|Qc|      dz/dphi = -i Q
+        dz/df0 = -Q/D * 2i Ql f/f0^2      dz/da = z/a      dz/dalpha = i z      dz/dtau = -2 pi i f z
+
+    I termini complessi vengono calcolati in buffer allocati una volta sola; il jacobiano riusa
+    quelli dell'ultima valutazione dei residui (least_squares lo chiede sempre nello stesso punto).
+    fit() restituisce popt, pcov come curve_fit.
+    """
+
+    def __init__(self, f_data, z_data):
+        self.f = np.asarray(f_data, dtype=float)
+        z_data = np.asarray(z_data, dtype=complex)
+        n = self.f.size
+        self.n = n
+        self.ydata = np.concatenate([z_data.real, z_data.imag])
+        self.n_model = 0
+        self.n_jac = 0
+
+        self._x = None
+        self._P = np.empty(n, dtype=complex)
+        self._D = np.empty(n, dtype=complex)
+        self._Q = np.empty(n, dtype=complex)
+        self._z = np.empty(n, dtype=complex)
+        self._tmp = np.empty(n, dtype=complex)
+        self._jac = np.empty((2*n, 7))
+
+    def _evaluate(self, p):
+        Ql, abs_Qc, phi, f0, a, alpha, tau = p
+        P, D, Q, z = self._P, self._D, self._Q, self._z
+
+        # P = a e^{i(alpha - 2 pi tau f)}
+        self._tmp.real = 0.0
+        np.multiply(self.f, -2*np.pi*tau, out=self._tmp.imag)
+        self._tmp.imag += alpha
+        np.exp(self._tmp, out=P)
+        P *= a
+
+        # D = 1 + 2i Ql (f/f0 - 1)
+        D.real = 1.0
+        np.multiply(self.f, 2*Ql/f0, out=D.imag)
+        D.imag -= 2*Ql
+
+        # Q = P C / D,  z = P - Q
+        np.multiply(P, Ql/abs_Qc*np.exp(1j*phi), out=Q)
+        Q /= D
+        np.subtract(P, Q, out=z)
+
+        self._x = np.array(p, dtype=float)
+        self.n_model += 1
+        return z
+
+    def model(self, p):
+        return self._evaluate(p).copy()
+
+    def residuals(self, p):
+        z = self._evaluate(p)
+        # array nuovo a ogni chiamata: least_squares tiene il residuo precedente per confrontarlo
+        r = np.empty(2*self.n)
+        np.subtract(z.real, self.ydata[:self.n], out=r[:self.n])
+        np.subtract(z.imag, self.ydata[self.n:], out=r[self.n:])
+        return r
+
+    def jacobian(self, p, *args):
+        if self._x is None or not np.array_equal(self._x, p):
+            self._evaluate(p)
+        Ql, abs_Qc, phi, f0, a, alpha, tau = p
+        D, Q, z, tmp, J = self._D, self._Q, self._z, self._tmp, self._jac
+        n = self.n
+
+        def put(k, dz):
+            J[:n, k] = dz.real
+            J[n:, k] = dz.imag
+
+        # Q/D, usato da dQl e df0
+        np.divide(Q, D, out=tmp)
+        put(0, tmp * (-1/Ql))
+        put(3, tmp * (-2j*Ql/f0**2) * self.f)
+        put(1, Q * (1/abs_Qc))
+        put(2, Q * -1j)
+        put(4, z * (1/a))
+        put(5, z * 1j)
+        put(6, z * (-2j*np.pi) * self.f)
+
+        self.n_jac += 1
+        return J
+
+    def fit(self, p0, bounds=(-np.inf, np.inf), max_nfev=10000, fixed=None, **kwargs):
+        """
+        Stesso problema che curve_fit passa a least_squares (metodo 'trf'), ma con jacobiano
+        analitico. pcov e' calcolata come in curve_fit (SVD del jacobiano, scalata con il chi2 ridotto),
+        ma con le colonne del jacobiano normalizzate prima della SVD: con f0 ~ 1e9 e tau ~ 1e-8 la soglia
+        di curve_fit (eps * s_max) taglia i valori singolari piccoli e gli errori escono assurdi.
+        fixed: indici dei parametri da tenere fermi al valore di p0 (es. [6] per tau gia' noto);
+        le loro righe e colonne di pcov sono nulle.
+        Gli argomenti extra vanno a least_squares: con f0 ~ 1e9 e tau ~ 1e-8 conviene x_scale='jac',
+        altrimenti xtol ferma il fit dopo pochi passi (come succede con curve_fit).
+        """
+        p0 = np.asarray(p0, dtype=float)
+        free = np.ones(p0.size, dtype=bool)
+        if fixed is not None:
+            free[list(fixed)] = False
+        lower, upper = (np.broadcast_to(np.asarray(b, dtype=float), p0.shape) for b in bounds)
+
+        def full(q):
+            p = p0.copy()
+            p[free] = q
+            return p
+
+        if free.all():
+            fun, jac = self.residuals, self.jacobian
+        else:
+            fun = lambda q: self.residuals(full(q))
+            jac = lambda q, *args: self.jacobian(full(q))[:, free]
+
+        res = optimize.least_squares(fun, p0[free], jac=jac, bounds=(lower[free], upper[free]),
+                                     method='trf', max_nfev=max_nfev, **kwargs)
+        if not res.success:
+            raise RuntimeError("Optimal parameters not found: " + res.message)
+
+        norm = np.linalg.norm(res.jac, axis=0)
+        norm[norm == 0] = 1
+        _, s, VT = np.linalg.svd(res.jac / norm, full_matrices=False)
+        threshold = np.finfo(float).eps * max(res.jac.shape) * s[0]
+        s = s[s > threshold]
+        VT = VT[:s.size]
+        pcov_free = np.dot(VT.T / s**2, VT) / np.outer(norm, norm)
+
+        dof = self.ydata.size - free.sum()
+        if dof > 0:
+            pcov_free = pcov_free * (2 * res.cost / dof)
+        else:
+            pcov_free = np.full_like(pcov_free, np.inf)
+
+        pcov = np.zeros((p0.size, p0.size))
+        pcov[np.ix_(free, free)] = pcov_free
+        return full(res.x), pcov
@@ -6,62 +6,20 @@ Per runnare:
 import argparse
 import math
 import numpy as np
-from scipy.optimize import least_squares, curve_fit
+from scipy.optimize import least_squares
 import scipy.stats as stats
 import matplotlib.pyplot as plt
 from matplotlib.gridspec import GridSpec
 
-from ResonatorFitter import CircleEstimator 
+from ResonatorFitter import CircleEstimator, NotchFitter
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "common"))
+from calibration_cache import CalibrationCache
+from s21_loader import load_s21
 
 # ----------------------------- Utility helpers -----------------------------
 
-def safe_load_npz(fname, key='0'):
-    """Carica un file .npz e ritorna il record associato a `key`."""
-    arr = np.load(fname, allow_pickle=True)
-    print(f"DEBUG: keys in {fname}: {arr.files}")
-    if key not in arr.files:
-        key = arr.files[0]
-        print(f"WARN: requested key not found, using first key: {key}")
-
-    data = arr[key]
-
-    if isinstance(data, np.ndarray) and data.dtype == object and data.size == 1:
-        candidate = data[0]
-        if isinstance(candidate, dict):
-            return candidate
-        if hasattr(candidate, 'dtype') and getattr(candidate.dtype, 'names', None):
-            data = candidate
-
-    if hasattr(data, 'dtype') and getattr(data.dtype, 'names', None):
-        mapping = {}
-        for name in ['freq', 'frequency', 'f', 'frequencies']:
-            if name in data.dtype.names:
-                mapping['freq'] = name
-                break
-        for name in ['signal', 's21', 'S21', 'mag']:
-            if name in data.dtype.names:
-                mapping['signal'] = name
-                break
-        for name in ['phase', 'arg', 'angle']:
-            if name in data.dtype.names:
-                mapping['phase'] = name
-                break
-        if 'freq' in mapping and 'signal' in mapping and 'phase' in mapping:
-            return {
-                'freq': data[mapping['freq']],
-                'signal': data[mapping['signal']],
-                'phase': data[mapping['phase']]
-            }
-
-    if isinstance(data, dict):
-        return data
-
-    if isinstance(data, np.ndarray) and data.ndim == 2 and data.shape[1] >= 3:
-        return {'freq': data[:, 0], 'signal': data[:, 1], 'phase': data[:, 2]}
-
-    raise ValueError('Formato .npz non riconosciuto; controlla le chiavi e il contenuto')
-
-
 def check_nan_inf(*arrays):
     """Ritorna True se uno degli array contiene NaN o Inf (per debug)."""
     for a in arrays:
@@ -84,34 +42,34 @@ def S21_notch_complex(freqs, Ql, abs_Qc, phase_Qc, fr, amp, alpha, tau):
     coupling = (Ql / abs_Qc) * np.exp(1j * phi)
     return prefactor * (1.0 - coupling / denom)
 
-def S21_notch_real_stacked(freqs, Ql, abs_Qc, phase_Qc, fr, amp, alpha, tau):
-    """Funzione di appoggio per curve_fit che concatena real e imag in un vettore reale."""
-    z = S21_notch_complex(freqs, Ql, abs_Qc, phase_Qc, fr, amp, alpha, tau)
-    return np.concatenate([z.real, z.imag])
-
 # ----------------------------- Main pipeline --------------------------------
 
-def run_pipeline(npz_file, key='0', window_hz=None, show_plots=True, save=False, name=None):
-    """Esegue tutto il workflow: caricamento, calibrazione, fits, e plotting."""
+def run_pipeline(npz_file, key='0', window_hz=None, show_plots=True, save=False, name=None, calibration=None, data=None):
+    """
+    Esegue tutto il workflow: caricamento, calibrazione, fits, e plotting.
+    calibration: CalibrationCache da cui prendere tau (e baseline) invece di rifittare il delay.
+    data: (freqs, S21) gia' in memoria (es. appena acquisiti, vedi campaign.py): npz_file non viene letto.
+    """
 
     # ---------------- Load data -------------------------------------------------
-    raw = safe_load_npz(npz_file, key=key)
-    freqs = np.asarray(raw['freq'], dtype=float)
-    mag = np.asarray(raw['signal'], dtype=float)
-    ph = np.asarray(raw['phase'], dtype=float)
-    S21 = mag * np.exp(1j * ph)
+    # .npz strutturato ('0') o piatto, .txt o .csv: vedi s21_loader.py
+    if data is None:
+        freqs, S21 = load_s21(npz_file, key=key)
+    else:
+        freqs, S21 = np.asarray(data[0], float), np.asarray(data[1], complex)
+    mag = np.abs(S21)
+    ph = np.angle(S21)
     print(f"Loaded {freqs.size} points from {npz_file}")
     
 
     if check_nan_inf(freqs, mag, ph, S21):
         raise ValueError('I dati contengono NaN o Inf — controlla il file')
     
-    fitter = CircleEstimator()
-        # 1. Stima grossolana (lineare)
-    tau_guess = fitter.estimate_delay(freqs, S21)
-    # 2. Raffinamento numerico PARTENDO dai dati originali (S21)
-    # Passiamo tau_guess come initial_delay alla funzione leastsq
-    tau_final = fitter.fit_with_delay(freqs, S21, initial_delay=tau_guess)
+    fitter = CircleEstimator(calibration=calibration)
+    S21 = fitter.remove_baseline(freqs, S21)
+    mag = np.abs(S21)
+    # 1-2. Delay dalla cache di calibrazione, oppure stima lineare + raffinamento con leastsq
+    tau_final = fitter.get_delay(freqs, S21)
     # 3. Applicazione finale dell'unico delay calcolato
     S21_cal = fitter.remove_delay(freqs, S21, tau_final)
 
@@ -168,19 +126,22 @@ def run_pipeline(npz_file, key='0', window_hz=None, show_plots=True, save=False,
         freqs_fit = freqs
         S21_fit_input = S21
 
-    ydata = np.concatenate([S21_fit_input.real, S21_fit_input.imag])
     p0_notch = [Qr_fit, abs(Qc_est), np.angle(Qc_est), fr_fit, amp_scaling, alpha_rot, tau_final]
-    lb = [1.0, 1e-5, -np.pi, freqs_fit.min(), 1e-2, -np.pi, -1e-4]
-    ub = [1e10, 1e10, np.pi, freqs_fit.max(), 1e2, np.pi, 1e-3]
+    # alpha senza limiti: e' periodica e degenere con tau (alpha - 2*pi*f*tau), con i limiti a +-pi
+    # il fit si ferma sul bordo; viene riportata in (-pi, pi] dopo il fit
+    lb = [1.0, 1e-5, -np.pi, freqs_fit.min(), 1e-2, -np.inf, -1e-4]
+    ub = [1e10, 1e10, np.pi, freqs_fit.max(), 1e2, np.inf, 1e-3]
 
+    # Fit notch con jacobiano analitico; x_scale='jac' perche' con f0 ~ 1e9 e tau ~ 1e-8 xtol
+    # fermerebbe il fit prima del minimo
     try:
-        popt, pcov = curve_fit(S21_notch_real_stacked, freqs_fit, ydata, p0=p0_notch, bounds=(lb, ub), maxfev=50000)
+        popt, pcov = NotchFitter(freqs_fit, S21_fit_input).fit(p0_notch, bounds=(lb, ub), max_nfev=50000, x_scale='jac')
     except RuntimeError as e:
-        print('curve_fit failed:', e)
+        print('notch fit failed:', e)
         freqs_fit = freqs
         S21_fit_input = S21
-        ydata = np.concatenate([S21_fit_input.real, S21_fit_input.imag])
-        popt, pcov = curve_fit(S21_notch_real_stacked, freqs_fit, ydata, p0=p0_notch, bounds=(lb, ub), maxfev=50000)
+        popt, pcov = NotchFitter(freqs_fit, S21_fit_input).fit(p0_notch, bounds=(lb, ub), max_nfev=50000, x_scale='jac')
+    popt[5] = np.angle(np.exp(1j * popt[5]))
 
     Ql_fit, abs_Qc_fit, phase_Qc_fit, fr_fit2, amp_fit, alpha_fit, tau_fit = popt
     print('\nNotch fit results:')
@@ -300,6 +261,8 @@ if __name__ == '__main__':
     Q_coupling = []
     Temperature = [13, 100, 200, 300, 400, 500, 600, 700, 750, 820, 850, 900, 950, 1000, 1050] # mK
     H = 1
+    # Il delay del cavo si fitta al primo file e poi si rilegge da calibration/index.json
+    calibration = CalibrationCache("calibration", run="run1", line="feedline")
 
     for i in Temperature: 
         if i == 900:
@@ -319,7 +282,7 @@ if __name__ == '__main__':
         
         # Lanciamo la pipeline direttamente
         try:
-            results = run_pipeline(file_da_analizzare, key=chiave_dati, window_hz=finestra_hz, save = False, show_plots=True, name = file)
+            results = run_pipeline(file_da_analizzare, key=chiave_dati, window_hz=finestra_hz, save = False, show_plots=True, name = file, calibration=calibration)
             print("Analisi completata con successo!")
             list_freqs.append(results['freqs'])
             list_S21.append(results['S21_fit'])
@@ -0,0 +1,310 @@
+"""
+Campagne di misura al VNA con acquisizione e fit in parallelo.
+
+Invece di acquisire tutto (vna_acquisition.py) e fittare dopo (CircleFit/main_fit.py), il
+VNA misura la traccia successiva mentre i worker di un pool di processi fittano quelle gia'
+acquisite: il tempo totale diventa circa max(acquisizione, fit) invece della somma.
+
+    punti di misura  ->  acquisizione (VNA, processo principale)  ->  <cartella>/trace_0000.npz
+                                    |
+                                    v  coda limitata (max_pending tracce in memoria)
+                         worker di fit (ProcessPoolExecutor)  ->  <cartella>/fits.jsonl
+
+Ogni traccia viene salvata subito (stesso formato di save_vna_data2) e ogni fit viene
+aggiunto a fits.jsonl appena finisce, una riga JSON per punto: se la campagna si interrompe
+si riparte con resume=True, che salta le tracce gia' salvate e i fit gia' fatti.
+
+Contropressione: quando ci sono max_pending tracce in memoria che aspettano il fit
+    policy="block"  l'acquisizione aspetta che un fit finisca (il VNA si ferma)
+    policy="spill"  l'acquisizione prosegue e i worker rileggono la traccia dal file .npz
+in entrambi i casi la memoria resta limitata.
+
+    vna = VNA('193.206.156.3')
+    points = grid(T=[13, 100, 200], power=[-5, -15], center=[7.492e9], span=[15e6], points=[10000])
+    campaign = Campaign(vna, "campagna_7GHz", setters={'T': wait_temperature}, file_pattern="{T}mK_{power}dBm.npz")
+    campaign.run(points)
+
+Per runnare (senza VNA, con MockVNA):
+    python campaign.py --mock --T 13 100 200 --power -5 -15 --out campagna_prova
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import itertools
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "CircleFit"))
+
+RESULTS_FILE = "fits.jsonl"
+POLICIES = ("block", "spill")
+
+
+def grid(**axes):
+    """
+    Tutti i punti (dict) della griglia degli assi dati, il primo asse e' quello che cambia
+    piu' lentamente: grid(T=[13, 100], power=[-5, -15]) -> T=13 a -5 e -15 dBm, poi T=100 ...
+    Conviene mettere per primo l'asse piu' lento da cambiare (la temperatura).
+    """
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+
+def acquire_trace(vna, point, Sij="S21"):
+    """Uno sweep e la lettura della traccia: (freqs [Hz], S complesso)."""
+    vna.one_sweep(wait=True)
+    real, imag = vna.get_data(Sij)
+    return vna.get_frequencies(), real + 1j * imag
+
+
+def fit_notch(freqs, S21, path, window_hz=None, calibration=None):
+    """
+    Fit notch di CircleFit/main_fit.run_pipeline, senza plot ne' print.
+    Con freqs None (policy "spill" o resume) la traccia viene riletta da path.
+    Restituisce solo i numeri (niente array) per non rimandarli indietro dal worker.
+    """
+    from main_fit import run_pipeline
+
+    data = None if freqs is None else (freqs, S21)
+    with contextlib.redirect_stdout(io.StringIO()):
+        r = run_pipeline(path, window_hz=window_hz, show_plots=False, calibration=calibration, data=data)
+    perr = np.sqrt(np.abs(np.diag(r['pcov']))) if r['pcov'] is not None else [np.nan] * len(r['popt'])
+    return dict(fr=float(r['fr_fit']), fr_err=float(perr[3]), Ql=float(r['Ql_fit']), Ql_err=float(perr[0]),
+                Qi=float(r['Qi_fit']), Qc=float(abs(r['Qc_fit'])), Qc_phase=float(np.angle(r['Qc_fit'])))
+
+
+def _timed_fit(fit, freqs, S21, path, fit_kwargs):
+    # eseguito nel worker: il tempo di fit va nel risultato per il riepilogo della campagna
+    start = time.perf_counter()
+    result = fit(freqs, S21, path, **fit_kwargs)
+    result['fit_time'] = time.perf_counter() - start
+    return result
+
+
+class Campaign:
+    """
+    Campagna di misura su una lista di punti (dict, vedi grid), con i fit in un pool di processi.
+
+    Parameters
+    ----------
+    vna : VNA (classes2) o un oggetto con le stesse set_* / one_sweep / get_data / get_frequencies
+    directory : cartella delle tracce e di fits.jsonl (creata se non c'e')
+    setters : dict nome -> funzione(valore) per gli assi che non sono del VNA (es. 'T' per la
+        temperatura del criostato). power, ifbw, average, points e center+span vanno al VNA.
+    fit : funzione (freqs, S21, path, **fit_kwargs) -> dict di numeri, definita a livello di
+        modulo perche' deve arrivare ai worker (default: fit_notch)
+    fit_kwargs : argomenti extra per fit (es. window_hz, calibration=CalibrationCache(...))
+    acquire : funzione (vna, point) -> (freqs, S) (default: acquire_trace, S21; per altri parametri
+        functools.partial(acquire_trace, Sij="S11"))
+    workers : processi di fit (default: un core lasciato all'acquisizione)
+    max_pending : tracce al massimo in memoria in attesa di fit
+    policy : "block" o "spill" (vedi in cima al modulo)
+    file_pattern : nome dei file delle tracce, formattato con index e con i valori del punto
+    """
+
+    def __init__(self, vna, directory, setters=None, fit=fit_notch, fit_kwargs=None, acquire=acquire_trace,
+                 workers=None, max_pending=4, policy="block", file_pattern="trace_{index:04d}.npz"):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}")
+        self.vna = vna
+        self.directory = directory
+        self.setters = self._vna_setters(vna)
+        self.setters.update(setters or {})
+        self.fit = fit
+        self.fit_kwargs = fit_kwargs or {}
+        self.acquire = acquire
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.max_pending = max_pending
+        self.policy = policy
+        self.file_pattern = file_pattern
+        os.makedirs(directory, exist_ok=True)
+
+        self._pending = {}       # future -> riga dei risultati (senza il fit)
+        self._in_memory = set()  # future che si portano dietro la traccia
+        self.stats = {}
+
+    @staticmethod
+    def _vna_setters(vna):
+        names = {'power': 'set_power', 'ifbw': 'set_ifbw', 'average': 'set_average', 'points': 'set_points'}
+        return {key: getattr(vna, name) for key, name in names.items() if hasattr(vna, name)}
+
+    @property
+    def results_path(self):
+        return os.path.join(self.directory, RESULTS_FILE)
+
+    def results(self):
+        """Le righe di fits.jsonl scritte finora, in ordine di punto."""
+        return sorted(load_results(self.results_path), key=lambda row: row['index'])
+
+    def _apply(self, point, previous):
+        # si cambia solo quello che e' diverso dal punto precedente
+        changed = [key for key in point if previous is None or previous.get(key) != point[key]]
+        if 'center' in changed or 'span' in changed:
+            self.vna.set_freq_center(point['center'], point['span'])
+        for key in changed:
+            if key not in ('center', 'span'):
+                self.setters[key](point[key])
+
+    def _check(self, points):
+        for point in points:
+            missing = [key for key in point if key not in self.setters and key not in ('center', 'span')]
+            if missing:
+                raise KeyError(f"No setter for {missing}: pass setters={{'{missing[0]}': function}} "
+                               "(a function that does nothing if the value is only a label)")
+            if ('center' in point) != ('span' in point):
+                raise KeyError("'center' and 'span' go together")
+
+    def _write(self, row):
+        with open(self.results_path, "a") as f:
+            f.write(json.dumps(row) + "\n")
+
+    def _collect(self, block=False):
+        """Scrive i fit finiti; con block=True aspetta almeno un fit."""
+        if not self._pending:
+            return
+        done, _ = concurrent.futures.wait(self._pending, timeout=None if block else 0,
+                                          return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            row = self._pending.pop(future)
+            self._in_memory.discard(future)
+            try:
+                row.update(future.result())
+                self.stats['fit_time'] += row['fit_time']
+            except Exception as e:
+                # un fit che non converge non ferma la campagna (come in main_fit)
+                row['error'] = f"{type(e).__name__}: {e}"
+                self.stats['failed'] += 1
+            self._write(row)
+
+    def _submit(self, executor, row, path, freqs, S21):
+        if len(self._in_memory) >= self.max_pending:
+            if self.policy == "block":
+                start = time.perf_counter()
+                while len(self._in_memory) >= self.max_pending:
+                    self._collect(block=True)
+                self.stats['blocked_time'] += time.perf_counter() - start
+            else:
+                freqs = S21 = None
+                self.stats['spilled'] += 1
+        future = executor.submit(_timed_fit, self.fit, freqs, S21, path, self.fit_kwargs)
+        self._pending[future] = row
+        if freqs is not None:
+            self._in_memory.add(future)
+
+    def run(self, points, resume=False):
+        """
+        Misura e fitta tutti i punti; restituisce le righe dei risultati (vedi results).
+        resume=True salta le tracce gia' salvate (le fitta dal file se manca il fit) e i punti
+        gia' in fits.jsonl.
+        """
+        points = list(points)
+        self._check(points)
+        done = {row['file'] for row in self.results()} if resume else set()
+        if not resume and os.path.exists(self.results_path):
+            os.remove(self.results_path)
+
+        self.stats = dict(points=len(points), acquire_time=0.0, fit_time=0.0, blocked_time=0.0, spilled=0, failed=0)
+        start = time.perf_counter()
+        previous = None
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for index, point in enumerate(points):
+                name = self.file_pattern.format(index=index, **point)
+                path = os.path.join(self.directory, name)
+                row = dict(point, index=index, file=name)
+                if name in done:
+                    continue
+                if resume and os.path.exists(path):
+                    self._submit(executor, row, path, None, None)
+                    continue
+
+                t0 = time.perf_counter()
+                self._apply(point, previous)
+                previous = point
+                freqs, S = self.acquire(self.vna, point)
+                save_trace(path, freqs, S)
+                row['acquired'] = time.time()
+                self.stats['acquire_time'] += time.perf_counter() - t0
+
+                self._submit(executor, row, path, freqs, S)
+                self._collect()
+
+            while self._pending:
+                self._collect(block=True)
+
+        self.stats['total_time'] = time.perf_counter() - start
+        return self.results()
+
+    def summary(self):
+        """Riepilogo dei tempi dell'ultimo run."""
+        s = self.stats
+        print(f"{s['points']} punti in {s['total_time']:.1f} s: acquisizione {s['acquire_time']:.1f} s, "
+              f"fit {s['fit_time']:.1f} s (somma sui {self.workers} worker), "
+              f"in attesa dei fit {s['blocked_time']:.1f} s, tracce rilette da file {s['spilled']}, fit falliti {s['failed']}")
+
+
+def save_trace(path, freqs, S21):
+    """Salva la traccia nel formato di save_vna_data2 (array strutturato sotto la chiave '0')."""
+    dt = np.dtype([('freq', '<f8'), ('signal', '<f8'), ('phase', '<f8'), ('error_signal', '<f8'), ('error_phase', '<f8')])
+    data = np.zeros(len(freqs), dtype=dt)
+    data['freq'] = freqs
+    data['signal'] = np.abs(S21)
+    data['phase'] = np.angle(S21)
+    np.savez(path, **{'0': data})
+
+
+def load_results(path):
+    """Righe di un fits.jsonl come lista di dict ([] se il file non c'e')."""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Campagna VNA con fit in parallelo")
+    parser.add_argument("--ip", default="193.206.156.3")
+    parser.add_argument("--mock", action="store_true", help="MockVNA invece del VNA")
+    parser.add_argument("--out", default="campagna")
+    parser.add_argument("--T", type=float, nargs="*", default=[], help="temperature [mK]: si aspetta invio a ogni cambio")
+    parser.add_argument("--power", type=float, nargs="*", default=[-5])
+    parser.add_argument("--center", type=float, default=7.492e9)
+    parser.add_argument("--span", type=float, default=15e6)
+    parser.add_argument("--points", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-pending", type=int, default=4)
+    parser.add_argument("--policy", choices=POLICIES, default="block")
+    parser.add_argument("--sweep-time", type=float, default=0.5, help="durata simulata dello sweep con --mock [s]")
+    parser.add_argument("--resume", action="store_true")
+    args = parser.parse_args()
+
+    from classes2 import VNA, MockVNA
+
+    axes = dict(T=args.T) if args.T else {}
+    axes.update(power=args.power, center=[args.center], span=[args.span], points=[args.points])
+    setters = dict(T=lambda t: input(f"Porta il criostato a {t} mK e premi invio... "))
+
+    if args.mock:
+        vna = MockVNA(f_center=args.center, span=args.span, num_points=args.points, hz=True)
+        setters.update(T=lambda t: print(f"T = {t} mK"), power=lambda p: None, points=lambda n: None)
+        vna.set_freq_center = lambda center, span: None
+
+        def acquire_mock(vna, point):
+            time.sleep(args.sweep_time)
+            real, imag = vna.get_data("S21")
+            return vna.get_frequencies(), real + 1j * imag
+        acquire = acquire_mock
+    else:
+        vna = VNA(ip_address=args.ip)
+        acquire = acquire_trace
+
+    pattern = ("{T:g}mK_" if args.T else "") + "{power:g}dBm.npz"
+    campaign = Campaign(vna, args.out, setters=setters, acquire=acquire, workers=args.workers,
+                        max_pending=args.max_pending, policy=args.policy, file_pattern=pattern)
+    for row in campaign.run(grid(**axes), resume=args.resume):
+        print(row['file'], row.get('error') or f"fr = {row['fr']:.6e} Hz, Ql = {row['Ql']:.0f}, Qi = {row['Qi']:.0f}, |Qc| = {row['Qc']:.0f}")
+    campaign.summary()
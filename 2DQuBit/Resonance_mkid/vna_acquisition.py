@@ -25,8 +25,17 @@ freqs = np.linspace(f_start, f_stop, points)
 my_vna = MockVNA(f_center=5.1) # simulate a VNA with a resonance at 5.1 GHz
 freqs = my_vna.get_frequencies()
 '''
-my_vna.one_sweep()
-real, imag = my_vna.get_data("S21")
+# Sweep segmentato: finestre (center, span, points, IFBW) dense solo attorno alle risonanze.
+# Con windows = None si fa il solito sweep unico da 'points' punti su tutto lo span.
+windows = None
+#windows = [(7.4870e9, 5e6, 201, 1e4), (7.4920e9, 5e6, 4001, 1e3), (7.4970e9, 5e6, 201, 1e4)]
+
+if windows is None:
+    my_vna.one_sweep()
+    real, imag = my_vna.get_data("S21")
+else:
+    freqs, S21 = my_vna.segmented_sweep(windows, "S21")
+    real, imag = S21.real, S21.imag
 my_vna.save_vna_data2("7GHzpeak_100mK_10kpt.npz", freqs, real, imag)
 
 # plot grezzo dei dati acquisiti
@@ -0,0 +1,322 @@
+"""
+Benchmark dei driver degli strumenti contro il simulatore SCPI locale (scpi_simulator).
+
+Per ogni driver misura:
+    configure   tempo per applicare una configurazione tipica (frequenze, punti, scale, ...)
+    readout     tempo per leggere una traccia / forma d'onda
+    shot rate   shot al secondo (trigger o sweep + lettura)
+e conta comandi e byte scambiati per shot, che non dipendono dalla macchina e si possono
+confrontare tra versioni del codice.
+
+I driver sono quelli veri (classes2, 3DQubit/classes, SinglePhoton/VNA): quelli con
+l'indirizzo scritto nel codice vengono reindirizzati al simulatore con visa_sessions.redirect,
+i synth (LO) aprono la porta seriale simulata con l'URL socket:// del simulatore.
+Per i synth lo shot e' uno sweep() su --points frequenze (comandi in pipeline, FREQ? letti
+ogni drain_every punti).
+
+Per runnare (serve pyvisa-py per le risorse SOCKET):
+    python benchmark_drivers.py
+    python benchmark_drivers.py --latency 1e-3 --bandwidth 1e6 --points 10001
+    python benchmark_drivers.py --save base.json          # salva i risultati
+    python benchmark_drivers.py --compare base.json       # confronta con un run precedente
+    python benchmark_drivers.py --trace trace.json        # tempi per comando (visa_sessions.tracer)
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, "..", "..", "common"))
+import visa_sessions
+from scpi_simulator import SCPISimulator
+
+sys.path.append(os.path.join(HERE, "..", "..", "3DQubit", "classes"))
+sys.path.append(os.path.join(HERE, "..", "..", "SinglePhoton", "VNA"))
+
+DICT_PAR = dict(A=1, f=1e7, mu=0.0, sig=1e-7, n_sigma=3, name='bench', plot=False, N_cycles=1)
+
+
+def median_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times))
+
+
+def simulator(model, args, **kwargs):
+    sim = SCPISimulator(model, latency=args.latency, bandwidth=args.bandwidth,
+                        n_points=args.points, sweep_time=args.sweep_time, **kwargs)
+    sim.start()
+    return sim
+
+
+def redirected(address, sim):
+    visa_sessions.redirect(address, sim.address, **sim.attrs)
+    return address
+
+
+# ---------- driver ----------
+# ogni funzione restituisce (sim, configure, readout, shot)
+
+def classes2_vna(args):
+    from classes2 import VNA
+    sim = simulator("VNA", args)
+    vna = VNA(sim.address)
+
+    def configure():
+        vna.set_freq_minmax(4.5e9, 4.6e9)
+        vna.set_points(args.points)
+        vna.set_average(1)
+        vna.set_power(-20)
+        vna.set_ifbw(1000)
+
+    def readout():
+        vna.get_frequencies()
+        vna.get_data("S21")
+
+    def shot():
+        vna.one_sweep(wait=True)
+        vna.get_data("S21")
+
+    return sim, configure, readout, shot
+
+
+def classes2_tds(args, binary=True):
+    from classes2 import TDS
+    TDS._states.clear()
+    sim = simulator("TDS", args)
+    address = redirected("GPIB0::3::INSTR", sim)
+    tds = TDS(address.split("::")[1])
+    stop = args.points - 1
+
+    def configure():
+        tds.scale(1, 0.1)
+        tds.scale(2, 0.1)
+        tds.set_hor_scale(1e-7)
+        tds.prepare_for_trigger()
+
+    def readout():
+        if binary:
+            tds.acquisition_IQ(0, stop)
+        else:
+            tds.acquisition(1, 0, stop, binary=False)
+            tds.acquisition(2, 0, stop, binary=False)
+
+    def shot():
+        # come acquire_IQ: un oggetto TDS nuovo per ogni shot
+        shot_tds = TDS(address.split("::")[1])
+        shot_tds.prepare_for_trigger()
+        if binary:
+            shot_tds.acquisition_IQ(0, stop)
+        else:
+            shot_tds.acquisition(1, 0, stop, binary=False)
+            shot_tds.acquisition(2, 0, stop, binary=False)
+
+    return sim, configure, readout, shot
+
+
+def classes2_sdg(args):
+    from classes2 import SDG
+    SDG._libraries.clear()
+    sim = simulator("SDG", args)
+    redirected("TCPIP0::sim-sdg::inst0::INSTR", sim)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sdg = SDG("sim-sdg")
+    sigmas = iter(np.linspace(1e-7, 2e-7, 10000))
+
+    def configure():
+        with contextlib.redirect_stdout(io.StringIO()):
+            sdg.burst_mode(DICT_PAR)
+
+    def readout():
+        # forma d'onda nuova a ogni chiamata: compilazione + trasferimento
+        sdg.upload_waveform(dict(DICT_PAR, sig=next(sigmas)))
+
+    def shot():
+        sdg.upload_waveform(DICT_PAR)  # gia' caricata: solo ARWV
+        sdg.manual_trig()
+
+    return sim, configure, readout, shot
+
+
+def vna_3dqubit(args):
+    from VNA import VNA
+    sim = simulator("VNA", args)
+    redirected("TCPIP0::sim-vna3d::inst0::INSTR", sim)
+    vna = VNA("sim-vna3d")
+
+    def configure():
+        with contextlib.redirect_stdout(io.StringIO()), vna.batch():
+            vna.set_freq_limits(4.5e9, 4.6e9)
+            vna.set_sweep_points(args.points)
+            vna.set_n_means(1)
+            vna.set_ifband(1000)
+            vna.set_power(-20)
+
+    def readout():
+        vna.get_freq()
+        vna.get_S_parameters()
+
+    def shot():
+        vna.perform_single_sweep()
+        vna.get_S_parameters()
+
+    return sim, configure, readout, shot
+
+
+def psa_3dqubit(args):
+    from PSA import PSA
+    sim = simulator("PSA", args)
+    redirected("tcpip0::sim-psa::INSTR", sim)
+    psa = PSA("sim-psa")
+
+    def configure():
+        psa.set_point_count(args.points)
+        psa.set_min_freq(4.5e9)
+        psa.set_max_freq(4.6e9)
+
+    def readout():
+        psa.read_data()
+
+    return sim, configure, readout, readout
+
+
+def vna_singlephoton(args):
+    import VNA_class
+    sim = simulator("VNA", args)
+    redirected("tcpip0::sim-vna-sp::INSTR", sim)
+    VNA_class.VNA.debug = False
+    with contextlib.redirect_stdout(io.StringIO()):
+        vna = VNA_class.VNA("sim-vna-sp")
+    vna.avg_count = 1
+
+    def configure():
+        with vna.batch():
+            vna.min_freq = 4.5e9
+            vna.max_freq = 4.6e9
+            vna.point_count = args.points
+            vna.bandwidth = 1000
+
+    def readout():
+        with contextlib.redirect_stdout(io.StringIO()):
+            vna.read_data("S21")
+        vna.read_frequency_data()
+
+    return sim, configure, readout, readout
+
+
+def lo_sweep(LO, args):
+    sim = simulator("LO", args)
+    lo = LO(sim.serial_url)
+    freqs = np.linspace(5e9, 5.1e9, args.points)
+
+    def configure():
+        if hasattr(LO, "set_freq"):
+            lo.set_freq(5e9)
+            lo.set_pow(-10)
+        else:
+            lo.freq = 5e9
+
+    def readout():
+        lo.query("FREQ?")
+
+    def shot():
+        lo.sweep(freqs)
+
+    return sim, configure, readout, shot
+
+
+def classes2_lo(args):
+    from classes2 import LO
+    return lo_sweep(LO, args)
+
+
+def lo_3dqubit(args):
+    from LO import LO
+    return lo_sweep(LO, args)
+
+
+DRIVERS = {
+    "classes2.VNA": classes2_vna,
+    "classes2.TDS": classes2_tds,
+    "classes2.TDS ascii": lambda args: classes2_tds(args, binary=False),
+    "classes2.SDG": classes2_sdg,
+    "3DQubit VNA": vna_3dqubit,
+    "3DQubit PSA": psa_3dqubit,
+    "SinglePhoton VNA": vna_singlephoton,
+    "classes2.LO sweep": classes2_lo,
+    "3DQubit LO sweep": lo_3dqubit,
+}
+
+
+def run(name, args):
+    sim, configure, readout, shot = DRIVERS[name](args)
+    # primo giro fuori misura (sessioni, cache)
+    configure()
+    readout()
+    shot()
+    result = dict(configure=median_time(configure, args.repeat), readout=median_time(readout, args.repeat))
+    # le write non aspettano risposta: si lascia finire il simulatore prima di contare
+    time.sleep(0.2)
+    sim.reset_counters()
+    t_shot = median_time(shot, args.repeat)
+    time.sleep(0.2)
+    result.update(shot_rate=1 / t_shot,
+                  commands_per_shot=sim.n_commands / args.repeat,
+                  bytes_per_shot=(sim.bytes_sent + sim.bytes_received) / args.repeat)
+    # il prossimo driver deve aprire sessioni nuove verso il suo simulatore
+    visa_sessions.close_all()
+    visa_sessions.clear_redirects()
+    sim.close()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dei driver contro il simulatore SCPI")
+    parser.add_argument("--latency", type=float, default=0.0, help="s per comando nel simulatore")
+    parser.add_argument("--bandwidth", type=float, default=None, help="byte/s delle risposte")
+    parser.add_argument("--points", type=int, default=1001)
+    parser.add_argument("--sweep-time", type=float, default=0.0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--only", nargs="*", choices=list(DRIVERS), default=list(DRIVERS))
+    parser.add_argument("--save", help="file JSON dove salvare i risultati")
+    parser.add_argument("--compare", help="file JSON di un run precedente")
+    parser.add_argument("--trace", help="registra l'I/O, stampa p50/p99 per comando e salva la traccia (.json o .csv)")
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)["results"]
+
+    print(f"latency {args.latency*1e3:g} ms, bandwidth {args.bandwidth or 'inf'} B/s, "
+          f"{args.points} punti, mediana su {args.repeat}\n")
+    print(f"{'driver':<20}{'configure [ms]':>16}{'readout [ms]':>14}{'shot/s':>10}{'cmd/shot':>10}{'byte/shot':>12}")
+    if args.trace:
+        visa_sessions.tracer.enable()
+    results = {}
+    for name in args.only:
+        r = results[name] = run(name, args)
+        line = (f"{name:<20}{1e3*r['configure']:>16.2f}{1e3*r['readout']:>14.2f}{r['shot_rate']:>10.1f}"
+                f"{r['commands_per_shot']:>10.1f}{r['bytes_per_shot']:>12.0f}")
+        if name in previous:
+            line += f"   shot/s x{r['shot_rate'] / previous[name]['shot_rate']:.2f}"
+        print(line)
+
+    if args.trace:
+        print()
+        visa_sessions.tracer.report()
+        visa_sessions.tracer.dump(args.trace)
+
+    if args.save:
+        settings = {k: v for k, v in vars(args).items() if k not in ("save", "compare", "only", "trace")}
+        with open(args.save, "w") as f:
+            json.dump(dict(settings=settings, results=results), f, indent=1)
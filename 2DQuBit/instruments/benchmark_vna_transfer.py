@@ -0,0 +1,146 @@
+"""
+Benchmark del trasferimento CALC:DATA:SDATA? del VNA: ASCII (FORM ASC) contro
+binario (FORM REAL,64).
+
+Non serve il VNA: lo script avvia in locale un finto server SCPI su socket che
+risponde ai comandi usati da VNA.__init__ e VNA.get_data, conta i byte spediti
+per ogni traccia e misura il tempo di get_data() e del solo parsing.
+
+Per runnare (serve pyvisa-py per le risorse SOCKET):
+    python benchmark_vna_transfer.py
+"""
+
+import socket
+import threading
+import time
+import numpy as np
+
+from classes2 import VNA
+
+N_POINTS = 10000
+N_REPEAT = 20
+
+
+class MockSocketVNA(threading.Thread):
+    """Server SCPI minimale su 127.0.0.1 che simula CALC:DATA:SDATA? del VNA."""
+
+    def __init__(self, n_points=N_POINTS):
+        super().__init__(daemon=True)
+        rng = np.random.default_rng(0)
+        self.sdata = rng.normal(0, 0.5, 2*n_points)  # coppie (Re, Im)
+        self.form = "ASC"
+        self.big_endian = True
+        self.bytes_sent = 0
+        self._cache = {}
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(("127.0.0.1", 0))
+        self._server.listen(1)
+        self.port = self._server.getsockname()[1]
+
+    @property
+    def address(self):
+        return f"TCPIP0::127.0.0.1::{self.port}::SOCKET"
+
+    def _sdata_response(self):
+        # risposte precalcolate: il tempo di formattazione lato server non conta
+        key = (self.form, self.big_endian)
+        if key not in self._cache:
+            self._cache[key] = self._format_sdata()
+        return self._cache[key]
+
+    def _format_sdata(self):
+        if self.form == "ASC":
+            return ",".join(f"{v:.12E}" for v in self.sdata).encode() + b"\n"
+        payload = self.sdata.astype(">f8" if self.big_endian else "<f8").tobytes()
+        length = str(len(payload)).encode()
+        return b"#" + str(len(length)).encode() + length + payload + b"\n"
+
+    def _handle(self, line):
+        replies = []
+        for cmd in line.split(";"):
+            cmd = cmd.strip().upper()
+            if cmd.startswith(":"):
+                cmd = cmd[1:]
+            if cmd == "*OPC?":
+                replies.append(b"1")
+            elif cmd == "*IDN?":
+                replies.append(b"MOCK,VNA,0,0")
+            elif cmd.startswith("FORM:BORD"):
+                self.big_endian = cmd.endswith("NORM")
+            elif cmd.startswith("FORM"):
+                self.form = "ASC" if "ASC" in cmd else "REAL"
+            elif cmd == "CALC:DATA:SDATA?":
+                data = self._sdata_response()
+                self.bytes_sent += len(data)
+                return data
+        if replies:
+            return b";".join(replies) + b"\n"
+        return b""
+
+    def run(self):
+        conn, _ = self._server.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buffer = b""
+        with conn:
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                buffer += chunk
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    reply = self._handle(line.decode())
+                    if reply:
+                        conn.sendall(reply)
+
+
+def time_get_data(vna, server, binary):
+    vna.binary_transfer = binary
+    server.bytes_sent = 0
+    times = []
+    for _ in range(N_REPEAT):
+        t0 = time.perf_counter()
+        real, imag = vna.get_data("S21")
+        times.append(time.perf_counter() - t0)
+    assert np.allclose(real + 1j*imag, server.sdata[0::2] + 1j*server.sdata[1::2])
+    return server.bytes_sent / N_REPEAT, np.median(times)
+
+
+def time_parse(server, binary, n=N_REPEAT):
+    server.form = "REAL" if binary else "ASC"
+    block = server._sdata_response()
+    times = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        if binary:
+            # stesso parsing di VNA._get_sdata_binary, header #<n><len> saltato
+            offset = 2 + int(block[1:2])
+            values = np.frombuffer(block, ">f8", (len(block) - offset - 1)//8, offset)
+            S = np.empty(len(values)//2, dtype=np.complex128)
+            S.view(np.float64)[:] = values
+        else:
+            data = np.array(list(map(float, block.decode().split(","))))
+            S = data[0::2] + 1j*data[1::2]
+        times.append(time.perf_counter() - t0)
+    return np.median(times)
+
+
+if __name__ == "__main__":
+    server = MockSocketVNA()
+    server.start()
+    vna = VNA(server.address)
+    # pyvisa-py non espone VI_ATTR_TCPIP_NODELAY: senza questo ogni piccola
+    # write seguita da una query paga ~40 ms di Nagle/delayed ACK su loopback
+    vna._VNA.visalib.sessions[vna._VNA.session].interface.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    print(f"Traccia da {N_POINTS} punti, mediana su {N_REPEAT} letture\n")
+    print(f"{'formato':<10}{'byte/traccia':>15}{'get_data [ms]':>16}{'parsing [ms]':>15}")
+    results = {}
+    for name, binary in (("ASCII", False), ("REAL,64", True)):
+        nbytes, t_get = time_get_data(vna, server, binary)
+        t_parse = time_parse(server, binary)
+        results[name] = (nbytes, t_get, t_parse)
+        print(f"{name:<10}{nbytes:>15.0f}{1e3*t_get:>16.2f}{1e3*t_parse:>15.2f}")
+
+    a, b = results["ASCII"], results["REAL,64"]
+    print(f"\nByte sul filo: x{a[0]/b[0]:.1f} in meno, get_data: x{a[1]/b[1]:.1f} piu' veloce, parsing: x{a[2]/b[2]:.1f} piu' veloce")
@@ -2,11 +2,15 @@ from os import name
 import numpy as np
 import pyvisa
 import re
+import hashlib
 import warnings
 import matplotlib.pyplot as plt
 import sys
 import time
 import serial
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from visa_sessions import open_session, tracer
 
 # ----------------------------- WAVEFORM GENERATOR ---------------------------------
 def gaussian_sine(x, dict_par):
@@ -19,11 +23,71 @@ def gaussian_sine(x, dict_par):
         y = gauss * sine
         return y
 
+# inviluppi della forma d'onda: funzioni vettoriali di (t, dict_par); si scelgono con
+# dict_par['envelope'] (nome o funzione di t), default 'gauss'
+def gauss_envelope(t, dict_par):
+    return dict_par['A'] * np.exp(-((t - dict_par['mu'])**2) / (2 * dict_par['sig']**2))
+
+def square_envelope(t, dict_par):
+    # larghezza dict_par['width'] (default 2 sigma) centrata in mu
+    width = dict_par.get('width', 2 * dict_par['sig'])
+    return dict_par['A'] * (np.abs(t - dict_par['mu']) <= width / 2)
+
+ENVELOPES = dict(gauss=gauss_envelope, square=square_envelope, drag=gauss_envelope)
+
+def waveform_samples(dict_par, t):
+    """
+    Valori (in [-1, 1]) della forma d'onda sui tempi t: inviluppo per sin(2 pi f t).
+    Con envelope='drag' si aggiunge la derivata dell'inviluppo in quadratura,
+    beta * dG/dt * cos(2 pi f t), con beta = dict_par['beta'] (default 0).
+    """
+    envelope = dict_par.get('envelope', 'gauss')
+    phase = 2 * np.pi * dict_par['f'] * t
+    if callable(envelope):
+        return envelope(t) * np.sin(phase)
+    G = ENVELOPES[envelope](t, dict_par)
+    y = G * np.sin(phase)
+    if envelope == 'drag':
+        dG = -(t - dict_par['mu']) / dict_par['sig']**2 * G
+        y += dict_par.get('beta', 0.0) * dG * np.cos(phase)
+    return y
+
+def compile_waveform(dict_par, N=15):
+    """
+    Campioni int16 della forma d'onda di dict_par per l'SDG (su +-n_sigma*sig, al massimo 2400 punti).
+    Restituisce (array, info) con info: samples, samples_per_second, duration,
+    cropped (campioni tagliati a [-1, +1]) e peak (massimo di |y| prima del taglio).
+    """
+    interval = [-dict_par['n_sigma']*dict_par['sig'], +dict_par['n_sigma']*dict_par['sig']]
+    duration = interval[1] - interval[0]
+    samples_per_second = 2.4e9
+    if duration * samples_per_second > 2400:
+        samples_per_second = 2400 / duration
+    samples = int(duration * samples_per_second)
+
+    y = waveform_samples(dict_par, interval[0] + np.arange(samples) / samples_per_second)
+    n = np.rint((2**N) * y)
+    cropped = int(np.count_nonzero((n > 2**N - 1) | (n < -2**N)))
+    array = np.clip(n, -2**N, 2**N - 1).astype(np.int16)
+    if cropped > 0:
+        warnings.warn(f"The function 'func' was cropped to the range [-1, +1], for a total of {cropped} cropped samples.", stacklevel=2)
+
+    array[0] = 0
+    array[-1] = 0
+    info = dict(samples=samples, samples_per_second=samples_per_second, duration=duration,
+                cropped=cropped, peak=float(np.max(np.abs(y))) if samples else 0.0)
+    return array, info
+
 class SDG() :
+    # librerie delle forme d'onda caricate, per indirizzo IP (condivise tra gli oggetti SDG)
+    _libraries = {}
+
     def __init__(self, ip_address) :
         
-        rm = pyvisa.ResourceManager ()
-        self._SDG = rm.open_resource("TCPIP0::"+ip_address+"::inst0::INSTR")
+        # sessione condivisa: ricreare SDG ad ogni shot non riapre la connessione
+        self._SDG = open_session("TCPIP0::"+ip_address+"::inst0::INSTR")
+        # forme d'onda gia' caricate sullo strumento: hash del contenuto -> nome
+        self._library = SDG._libraries.setdefault(ip_address, {})
         print('for all function the parameter order is ch, f, amp, phase, off')
 
     def set_freq(self, ch, f) :
@@ -110,34 +174,24 @@ class SDG() :
         self._SDG.write(f"C{ch}:MDWV STATE,ON")
 
     def upload_waveform(self, dict_par):
-        interval = [-dict_par['n_sigma']*dict_par['sig'], +dict_par['n_sigma']*dict_par['sig']]
-        duration = interval[1] - interval[0]
-        samples_per_second = 2.4e9
-        if duration * samples_per_second > 2400:
-            samples_per_second = 2400 / duration
-        samples = int(duration * samples_per_second)
-        array = np.zeros(samples, dtype=np.int16)
-        N = 15
-        cropped = 0
-        for i in range(0,samples):
-            f = gaussian_sine(interval[0] + i / samples_per_second, dict_par=dict_par)
-            n = int(round((2**N)*f))
-            if n > (2**N - 1): 
-                n = 2**N - 1
-                cropped += 1
-            if n < -2**N: 
-                n = -2**N
-                cropped += 1
-            array[i] = n 
-            if cropped > 0: 
-                warnings.warn(f"The function 'func' was cropped to the range [-1, +1], for a total of {cropped} cropped samples.", stacklevel=2)
-
-
-        array[0] = 0
-        array[-1] = 0
-
-        self._SDG.write_binary_values(f"C1:WVDT WVNM,{dict_par['name']},LENGTH,{samples},WAVEDATA,", array, datatype="h", is_big_endian=False, header_fmt='empty')
-        self._SDG.write(f"C1:ARWV NAME,{dict_par['name']}")
+        """
+        Carica la forma d'onda di dict_par (vedi compile_waveform) e la seleziona sul canale 1.
+        Una forma d'onda con lo stesso contenuto gia' caricata da questo processo viene solo
+        selezionata con ARWV NAME, senza ritrasferirla. Il nome sullo strumento e'
+        dict_par['name'] seguito dall'hash del contenuto. Restituisce True se c'e' stato il trasferimento.
+        """
+        array, info = compile_waveform(dict_par)
+        samples, duration = info['samples'], info['duration']
+        interval = [-duration / 2, duration / 2]
+
+        digest = hashlib.sha1(array.tobytes()).hexdigest()[:8]
+        name = self._library.get(digest)
+        uploaded = name is None
+        if uploaded:
+            name = f"{dict_par['name']}_{digest}"
+            self._SDG.write_binary_values(f"C1:WVDT WVNM,{name},LENGTH,{samples},WAVEDATA,", array, datatype="h", is_big_endian=False, header_fmt='empty')
+            self._library[digest] = name
+        self._SDG.write(f"C1:ARWV NAME,{name}")
         
         arb_freq = 1/duration
         self._SDG.write(f"C1:BSWV FRQ,{arb_freq}")
@@ -149,17 +203,30 @@ class SDG() :
             print("duration = ", duration)
             print("samples", samples)
             print("frequenza del segnale gaussiano = ", arb_freq)
+        return uploaded
+
+    def forget_waveforms(self):
+        # da chiamare se la memoria dello strumento e' stata cancellata (es. dopo un riavvio)
+        self._library.clear()
         
+    def batch(self, **kwargs):
+        # comandi accumulati e mandati in un solo messaggio con *OPC? (vedi VisaSession.batch);
+        # l'SDG non ha SYST:ERR? e non accetta ':' davanti ai comandi
+        kwargs.setdefault("check_errors", False)
+        kwargs.setdefault("root", False)
+        return self._SDG.batch(**kwargs)
+
     def burst_mode(self, dict_par):
-        self._SDG.write("C1:OUTP OFF")
-        self._SDG.write("C1:BTWV MODE,NCYC") 
-        self._SDG.write(f"C1:BTWV NCYC,{dict_par['N_cycles']}") 
-        self._SDG.write(f"C1:BTWV TIME,1")
-        self._SDG.write(f"C1:BTWV PRD,3")
-        self._SDG.write("C1:BTWV TRSR,MAN")
-        self._SDG.write("C1:BTWV STATE,ON")
-        self._SDG.write("C1:BTWV ILVL,0V")
-        print(self._SDG.query("*OPC?"))
+        with self.batch() as batch:
+            self._SDG.write("C1:OUTP OFF")
+            self._SDG.write("C1:BTWV MODE,NCYC")
+            self._SDG.write(f"C1:BTWV NCYC,{dict_par['N_cycles']}")
+            self._SDG.write(f"C1:BTWV TIME,1")
+            self._SDG.write(f"C1:BTWV PRD,3")
+            self._SDG.write("C1:BTWV TRSR,MAN")
+            self._SDG.write("C1:BTWV STATE,ON")
+            self._SDG.write("C1:BTWV ILVL,0V")
+        print(batch.opc)
     
     def manual_trig(self):
         
@@ -185,8 +252,16 @@ class SDG() :
 class VNA():
     def __init__(self, ip_address) :
         
-        rm = pyvisa.ResourceManager ()
-        self._VNA = rm.open_resource("TCPIP0::"+ip_address+"::inst0::INSTR")
+        # si puo' passare anche una stringa VISA completa (es. "TCPIP0::127.0.0.1::5025::SOCKET")
+        address = ip_address if "::" in ip_address else "TCPIP0::"+ip_address+"::inst0::INSTR"
+        self._VNA = open_session(address)
+        if address.upper().endswith("SOCKET"):
+            self._VNA.read_termination = '\n'
+            self._VNA.write_termination = '\n'
+        # trasferimento binario (FORM REAL,64) di default, ASCII come fallback
+        self.binary_transfer = True
+        # sweep segmentato in un colpo solo se lo strumento lo accetta (vedi segmented_sweep)
+        self.segmented_supported = True
         self._VNA.write("*CLS")
         VNA =self._VNA.query("INST:SEL 'NA'; *OPC?")
         if VNA[0] != '1': raise Exception("Failed to select NA mode")
@@ -241,26 +316,106 @@ class VNA():
         
         return self._VNA.query("*OPC?")
     
-    def one_sweep(self):
-        self._VNA.write("INIT:IMM")
+    def one_sweep(self, wait=False):
+        if wait:
+            self._VNA.write("INIT:CONT OFF") # Disabilita lo sweep continuo
+            self._VNA.write("INIT:IMM")
+            self._VNA.query("*OPC?") # ritorna appena lo sweep e' finito
+        else:
+            self._VNA.write("INIT:IMM")
         
     def get_data(self, Sij="S21"):
         
         self._VNA.write(f"CALC:PAR:DEF {Sij}")
-        self._VNA.write("FORM ASC")
-        #self._VNA.write("INIT:CONT OFF") # Disabilita lo sweep continuo
-        self._VNA.query("*OPC?")
-
-        #self._VNA.wait
-        # Dati formattati (Reale, Immaginario)
-        data_string = self._VNA.query("CALC:DATA:SDATA?")
-        data = np.array(list(map(float, data_string.split(","))))
-        
-        real = np.array(data[0::2])
-        imag = np.array(data[1::2])
+        S = None
+        if self.binary_transfer:
+            try:
+                S = self._get_sdata_binary()
+            except (pyvisa.errors.VisaIOError, ValueError) as e:
+                warnings.warn(f"Binary transfer failed ({e}), falling back to ASCII.", stacklevel=2)
+                self.binary_transfer = False
+
+        if S is None:
+            self._VNA.write("FORM ASC")
+            #self._VNA.write("INIT:CONT OFF") # Disabilita lo sweep continuo
+            self._VNA.query("*OPC?")
+
+            #self._VNA.wait
+            # Dati formattati (Reale, Immaginario)
+            data_string = self._VNA.query("CALC:DATA:SDATA?")
+            data = np.array(list(map(float, data_string.split(","))))
+            S = data[0::2] + 1j * data[1::2]
+
+        real = S.real
+        imag = S.imag
         self._VNA.write("INIT:CONT ON")
 
         return real, imag
+
+    def _get_sdata_binary(self):
+        """Legge CALC:DATA:SDATA? in FORM REAL,64 e restituisce un array complex128."""
+        self._VNA.write("FORM:BORD NORM")
+        self._VNA.write("FORM REAL,64")
+        self._VNA.query("*OPC?")
+        try:
+            # np.frombuffer sul blocco ricevuto, nessun parsing di stringhe
+            values = self._VNA.query_binary_values("CALC:DATA:SDATA?", datatype='d', is_big_endian=True, container=np.array)
+        finally:
+            self._VNA.write("FORM ASC") # le altre query (es. FREQ:DATA?) restano in ASCII
+        if len(values) % 2 != 0:
+            raise ValueError(f"SDATA block has an odd number of values ({len(values)})")
+
+        # coppie (Re, Im) copiate direttamente nell'array complesso preallocato
+        S = np.empty(len(values) // 2, dtype=np.complex128)
+        S.view(np.float64)[:] = values
+        return S
+
+    def set_ifbw (self, bw):
+        self._VNA.write(f'BWID {bw}')
+
+        return self._VNA.query("*OPC?")
+
+    def get_frequencies(self):
+        """Asse delle frequenze dello sweep corrente (vale anche per lo sweep segmentato)."""
+        freq_string = self._VNA.query("FREQ:DATA?")
+        return np.array(list(map(float, freq_string.split(","))))
+
+    def segmented_sweep(self, windows, Sij="S21"):
+        """
+        Misura solo le finestre richieste e le unisce in un'unica traccia.
+
+        windows: lista di (center, span, points, IFBW), frequenze in Hz.
+        Se l'analizzatore supporta lo sweep segmentato le finestre diventano i segmenti
+        di un unico sweep, altrimenti si fa uno sweep per finestra (sweep_windows).
+        Restituisce (freqs, S) con S complesso, ordinati in frequenza.
+        Lo sweep segmentato viene disattivato solo se l'analizzatore rifiuta la tabella dei
+        segmenti (SYST:ERR?); un timeout durante lo sweep passa al chiamante.
+        """
+        if self.segmented_supported:
+            try:
+                return self._segmented_sweep_hw(windows, Sij)
+            except RuntimeError as e:
+                warnings.warn(f"Segmented sweep not supported ({e}), sweeping window by window.", stacklevel=2)
+                self.segmented_supported = False
+
+        return sweep_windows(self, windows, Sij)
+
+    def _segmented_sweep_hw(self, windows, Sij):
+        self._VNA.write("SENS:SEGM:DATA " + segment_table(windows))
+        self._VNA.write("SENS:SWE:TYPE SEGM")
+        err = self._VNA.query("SYST:ERR?").strip()
+        if not err.startswith(("+0", "0")):
+            self._VNA.write("SENS:SWE:TYPE LIN")
+            raise RuntimeError(err)
+
+        try:
+            self.one_sweep(wait=True)
+            freqs = self.get_frequencies()
+            real, imag = self.get_data(Sij)
+        finally:
+            self._VNA.write("SENS:SWE:TYPE LIN")
+
+        return stitch_sweeps([freqs], [real + 1j * imag])
     
 
     def save_vna_data(self, filename, freqs, real, imag):
@@ -315,14 +470,61 @@ class VNA():
         
         print(f"File salvato con successo NEL NUOVO FORMATO STRUTTURATO: {filename} ({len(freqs)} punti)")
 
+def segment_table(windows):
+    """
+    Tabella per SENS:SEGM:DATA: formato 5, stimolo center/span, IFBW per segmento, 
+    seguito da center, span, points, IFBW di ogni finestra (ordinate in frequenza).
+    """
+    windows = sorted(windows, key=lambda w: w[0] - w[1]/2)
+    values = [5, 1, 1, 0, 0, 0, len(windows)]
+    for center, span, points, ifbw in windows:
+        values += [center, span, int(points), ifbw]
+    return ",".join(str(v) for v in values)
+
+def sweep_windows(vna, windows, Sij="S21"):
+    """Uno sweep per ogni finestra (center, span, points, IFBW), risultati uniti con stitch_sweeps."""
+    freqs = []
+    data = []
+    for center, span, points, ifbw in windows:
+        vna.set_freq_center(center, span)
+        vna.set_points(int(points))
+        vna.set_ifbw(ifbw)
+        vna.one_sweep(wait=True)
+        real, imag = vna.get_data(Sij)
+        freqs.append(np.linspace(center - span/2, center + span/2, int(points)))
+        data.append(real + 1j * imag)
+
+    return stitch_sweeps(freqs, data)
+
+def stitch_sweeps(freqs, data):
+    """
+    Unisce piu' tracce in un'unica traccia ordinata in frequenza. 
+    Dove le finestre si sovrappongono si tiene un solo punto per frequenza.
+    """
+    freqs = np.concatenate(freqs)
+    S = np.concatenate(data)
+    order = np.argsort(freqs, kind='stable')
+    freqs = freqs[order]
+    S = S[order]
+    keep = np.r_[True, np.diff(freqs) > 0]
+    return freqs[keep], S[keep]
+
 # - - - - - - - - - - - - - - - - - OSCILLOSCOPE - - - - - - - - - - - - - 
 
 class TDS() :
+    # preambolo delle forme d'onda e impostazioni di trasferimento per indirizzo GPIB:
+    # condivisi tra gli oggetti TDS dello stesso strumento (acquire_IQ ne crea uno per shot)
+    _states = {}
+
     def __init__(self, address) :
         
-        rm = pyvisa.ResourceManager()
-        self._TDS = rm.open_resource("GPIB0::"+address+"::INSTR")  
+        self._TDS = open_session("GPIB0::"+address+"::INSTR")  
         self._TDS.write("*CLS")
+        self._state = TDS._states.setdefault(address, dict(preambles={}, data=None, hor_scale=None))
+
+    def clear_preamble(self):
+        # da chiamare se scale o base dei tempi vengono cambiate dal pannello
+        self._state['preambles'].clear()
 
     def get_IDN(self):
         return self._TDS.query("*IDN?")
@@ -339,6 +541,7 @@ class TDS() :
     
     def scale (self, ch, scale):
         self._TDS.write(f'CH{ch}:SCAle {scale}')
+        self._state['preambles'].pop(ch, None)
 
     def get_scale (self, ch):
         return float(self._TDS.query(f'CH{ch}:SCAle?'))
@@ -353,9 +556,13 @@ class TDS() :
 
     def set_sample_rate(self, num):
         self._TDS.write(f'HORizontal:MAIn:SAMPLERate {num}')
+        self.clear_preamble()
    
     def set_hor_scale(self, y):
         self._TDS.write(f'HORizontal:MAIn:SCAle {y}')
+        if y != self._state['hor_scale']:
+            self._state['hor_scale'] = y
+            self.clear_preamble()
 
     def prepare_for_trigger(self):
         #self._TDS.write("ACQ:STOPAFTER SEQUENCE") # Si ferma dopo un singolo evento         
@@ -365,7 +572,9 @@ class TDS() :
     
     
 
-    def acquisition(self, ch, start, stop):
+    def acquisition(self, ch, start, stop, binary=True):
+        if binary:
+            return self.acquire_channels((ch,), start, stop)[ch]
         h_sc = self._TDS.query("HOR:SCA?")
         Sr = self._TDS.query("HORizontal:MAIn:SAMPLERate?")
         v_sc = float(self._TDS.query(f'CH{ch}:SCAle?'))
@@ -378,15 +587,62 @@ class TDS() :
         data_array = np.array([float(parts[i]) for i in range (len(parts))])
         rescaled_data = data_array*4*v_sc/100
         result = dict(H_scale=float(h_sc), sample_rate = float(Sr), V_scale = float(v_sc), raw_data = data_array, data = rescaled_data)
+        # la codifica e' stata cambiata: il trasferimento binario va reimpostato
+        self._state['data'] = None
         return result
+
+    def _preamble(self, ch):
+        # scala verticale e orizzontale del canale, lette una volta e poi riusate a ogni shot
+        pre = self._state['preambles'].get(ch)
+        if pre is None:
+            self._TDS.write(f'DAT:SOU CH{ch}')
+            pre = dict(
+                ymult=float(self._TDS.query('WFMPRE:YMULT?')),
+                yoff=float(self._TDS.query('WFMPRE:YOFF?')),
+                yzero=float(self._TDS.query('WFMPRE:YZERO?')),
+                H_scale=float(self._TDS.query('HOR:SCA?')),
+                sample_rate=float(self._TDS.query('HORizontal:MAIn:SAMPLERate?')),
+                V_scale=float(self._TDS.query(f'CH{ch}:SCAle?')),
+            )
+            self._state['preambles'][ch] = pre
+        return pre
+
+    def acquire_channels(self, channels=(1, 2), start=0, stop=500):
+        """
+        Forme d'onda dei canali in binario (DAT:ENC RIB, 1 byte per punto).
+        Restituisce {ch: dict(H_scale, sample_rate, V_scale, raw_data, data)} come acquisition;
+        per ogni shot solo DAT:SOU e CURV? per canale, il resto viene dalla cache.
+        """
+        if self._state['data'] != (start, stop):
+            self._TDS.write('HEAD OFF')
+            self._TDS.write('DAT:ENC RIB')
+            self._TDS.write('DAT:WID 1')
+            self._TDS.write(f'DAT:STAR {start}')
+            self._TDS.write(f'DAT:STOP {stop}')
+            self._state['data'] = (start, stop)
+
+        results = {}
+        for ch in channels:
+            pre = self._preamble(ch)
+            self._TDS.write(f'DAT:SOU CH{ch}')
+            raw = self._TDS.query_binary_values('CURV?', datatype='b', is_big_endian=True, container=np.array)
+            data = (raw - pre['yoff']) * pre['ymult'] + pre['yzero']
+            results[ch] = dict(H_scale=pre['H_scale'], sample_rate=pre['sample_rate'], V_scale=pre['V_scale'],
+                               raw_data=raw, data=data)
+        return results
+
+    def acquisition_IQ(self, start=0, stop=500):
+        # I dal canale 1 e Q dal canale 2 con una sola chiamata
+        X = self.acquire_channels((1, 2), start, stop)
+        return X[1], X[2]
     
     def plot_acquisition(self, mode):
         start, stop = 0, 500
-        X = self.acquisition(1, start, stop)
-        print(X['sample_rate'], len(X['data']))
         if mode == 1:
-            Y = self.acquisition(2, start, stop)
-        else: Y = None
+            X, Y = self.acquisition_IQ(start, stop)
+        else:
+            X, Y = self.acquisition(1, start, stop), None
+        print(X['sample_rate'], len(X['data']))
         x = np.linspace(0, (stop-start)/X['sample_rate'], len(X['data']))
         z = np.zeros(len(x))
         fig, ax = plt.subplots(figsize=(10,5))
@@ -422,11 +678,11 @@ class TDS() :
 # ----------------------------- LOCAL OSCILLATOR ---------------------------------
 class LO():
 
-    debug = True
+    debug = False  # print every command (slow); for timings use visa_sessions.tracer
     debug_prefix = ""
 
     def __init__(self, name):
-        self._LO = serial.Serial(name)  # open serial port
+        self._LO = serial.serial_for_url(name)  # open serial port (or a URL, e.g. "loop://", "socket://host:port")
         self._LO.flushInput() # Clear the input buffer to ensure there are no pending commands
         
 
@@ -434,15 +690,19 @@ class LO():
 
 
     def write(self, unterminated_command):
+        start = time.perf_counter()
         command_utf8 = (unterminated_command + "\r\n").encode(encoding="utf-8")
         self._LO.write(command_utf8)
+        if tracer.enabled: tracer.record(self._LO.port, "write", unterminated_command, start)
 
         if self.debug: print(f"{self.debug_prefix}[{unterminated_command}]")
 
     def query(self, unterminated_command):    
+        start = time.perf_counter()
         command_utf8 = (unterminated_command + "\r\n").encode(encoding="utf-8")
         self._LO.write(command_utf8)
         string = self._LO.readline().decode("utf-8").strip()
+        if tracer.enabled: tracer.record(self._LO.port, "query", unterminated_command, start, string)
 
         if self.debug: print(f"{self.debug_prefix}[{unterminated_command}] {string}")
 
@@ -477,8 +737,6 @@ class LO():
         #self.write('OUTP:STAT ON')
         self.freq = f
 
-        print(type(self.query("FREQ?")), self.query("FREQ?"))              
-
         if int(self.query("FREQ?")) != f_millis: 
             raise Exception(f"Could not set 'freq' to {f}.")  
     def set_pow(self, pow):
@@ -486,6 +744,108 @@ class LO():
         time.sleep(0.005)
         self.pow = pow 
 
+    # FREQUENCY / POWER SWEEPS
+
+    list_mode_supported = None  # None: not probed yet
+
+    def sweep(self, freqs, powers=None, settle=0.0, on_point=None, verify=True, drain_every=100):
+        """
+        Step the LO through a list of frequencies (Hz), and powers (dBm) if given.
+
+        The commands are pipelined: no sleep and no query per point. With verify=True a
+        FREQ? follows every FREQ command and the answers are read and checked every
+        drain_every points (and at the end), so the points still cost no round trip each
+        and the serial input buffer (a few hundred answers on Windows) never overflows.
+        settle: wait (s) after every point; on_point(i, f) is called after every point
+        (e.g. to take the readout at that frequency). on_point must not talk to the LO:
+        its answers would be mixed with the pending FREQ? answers.
+        Returns dict(points, elapsed, points_per_second).
+        """
+        freqs = list(freqs)
+        if powers is not None and len(powers) != len(freqs):
+            raise ValueError("freqs and powers must have the same length.")
+
+        debug = self.debug
+        self.debug = False  # no print per point
+        start = time.perf_counter()
+        pending = []  # points whose FREQ? answer has not been read yet
+        failed = []
+        try:
+            for i, f in enumerate(freqs):
+                f_millis = int(round(f * 1000))  # mHz
+                command = f"FREQ {f_millis}mlHz"
+                if powers is not None:
+                    command += f"\r\nPOW {powers[i]}dBm"
+                if verify:
+                    command += "\r\nFREQ?"
+                self.write(command)
+                if verify:
+                    pending.append(f)
+                    if len(pending) >= drain_every:
+                        failed += self._check_freq_answers(pending)
+                        pending = []
+                if settle:
+                    time.sleep(settle)
+                if on_point is not None:
+                    on_point(i, f)
+
+            if verify:
+                failed += self._check_freq_answers(pending)
+        finally:
+            self.debug = debug
+        elapsed = time.perf_counter() - start
+
+        if freqs:
+            self.freq = freqs[-1]
+        if powers is not None and len(powers):
+            self.pow = powers[-1]
+        if verify and failed:
+            raise Exception(f"Could not set 'freq' to {', '.join(failed)}.")
+
+        stats = dict(points=len(freqs), elapsed=elapsed, points_per_second=len(freqs) / elapsed if elapsed > 0 else float('inf'))
+        if self.debug: print(f"{self.debug_prefix}[sweep] {len(freqs)} points, {stats['points_per_second']:.1f} points/s")
+        return stats
+
+    def _check_freq_answers(self, freqs):
+        """Read one pending FREQ? answer per frequency; returns the points that were not set."""
+        start = time.perf_counter()
+        failed = []
+        for f in freqs:
+            answer = self._LO.readline().decode("utf-8").strip()
+            if not answer.lstrip("+-").isdigit() or int(answer) != int(round(f * 1000)):
+                failed.append(f"{f} ({answer!r})")
+        if tracer.enabled and freqs: tracer.record(self._LO.port, "readline", f"FREQ? x{len(freqs)}", start)
+        return failed
+
+    def upload_list(self, freqs, powers=None, dwell=0.001):
+        """
+        Load a frequency (Hz) / power (dBm) list in the SCPI LIST mode of the synthesizer,
+        stepped by the instrument itself every dwell seconds after start_list().
+        Returns False (and remembers it) if the synthesizer does not accept the LIST commands;
+        use sweep() in that case.
+        """
+        if self.list_mode_supported is False:
+            return False
+        self.write("LIST:FREQ " + ",".join(f"{f:.3f}" for f in freqs))
+        if powers is not None:
+            self.write("LIST:POW " + ",".join(f"{p}" for p in powers))
+        self.write(f"LIST:DWEL {dwell}")
+        self.write("FREQ:MODE LIST")
+
+        err = self.query("SYST:ERR?")
+        self.list_mode_supported = err.startswith(("+0", "0"))
+        if not self.list_mode_supported:
+            self.write("FREQ:MODE CW")
+        return self.list_mode_supported
+
+    def start_list(self):
+        """Start the sweep loaded with upload_list"""
+        self.write("INIT")
+
+    def stop_list(self):
+        """Back to a single frequency (CW mode)"""
+        self.write("FREQ:MODE CW")
+
 #------------------function to acquire a singleshot------------------------------
 def acquire_singleshot(dict_par):
     # 1 Caricare la waveform sul generatore
@@ -508,8 +868,8 @@ def acquire_singleshot(dict_par):
 def acquire_IQ(dict_par):
     # 1 Caricare la waveform sul generatore
     my_sdg = SDG('193.206.156.10')
-    my_sdg.upload_waveform(dict_par)
-    time.sleep(5) 
+    if my_sdg.upload_waveform(dict_par):
+        time.sleep(5) # solo se la forma d'onda e' stata trasferita
     # 2 Configurare SDG in modalità burst
     my_sdg.burst_mode(dict_par)
     # 3 Preparare l'oscilloscopio per il trigger
@@ -532,18 +892,52 @@ def acquire_IQ(dict_par):
 
 # SIMULATORE DI VNA PER TESTARE IL CODICE DI ACQUISIZIONE E ANALISI DEI DATI SENZA AVERE IL VNA A DISPOSIZIONE
 class MockVNA:
-    def __init__(self, f_center=4.58, span=0.01, num_points=2000):
-        # Imposta le frequenze che il VNA scansionerà (in GHz)
+    def __init__(self, f_center=4.58, span=0.01, num_points=2000, resonators=None, hz=False):
+        # Imposta le frequenze che il VNA scansionerà (in GHz, o in Hz come il VNA vero con hz=True)
         self.freqs = np.linspace(f_center - span/2, f_center + span/2, num_points)
         
         # Parametri fisici del tuo risonatore superconduttore
-        self.f0 = f_center      # Frequenza di risonanza (GHz)
+        self.f0 = f_center      # Frequenza di risonanza (GHz, o Hz con hz=True)
+        self.hz_per_unit = 1 if hz else 1e9
         self.Ql = 15000         # Fattore di qualità caricato (Loaded Q)
         self.Qc = 18000         # Fattore di qualità di accoppiamento (Coupling Q)
+
+        # Chip con piu' risonatori: lista di (f0 [GHz], Ql, Qc). Se None c'e' solo quello sopra
+        self.resonators = resonators
         
         # Imperfezioni del setup nel criostato
         self.cable_delay = 15e-9 # Ritardo dei cavi (15 ns)
-        self.noise_level = 0.002 # Livello di rumore bianco
+        self.noise_level = 0.002 # Livello di rumore bianco (a IFBW = 1 kHz)
+        self.ifbw = 1e3
+
+        # Contatori per confrontare strategie di acquisizione
+        self.n_sweeps = 0
+        self.n_points_acquired = 0
+
+    def get_IDN(self):
+        print("MockVNA")
+
+    def set_freq_minmax(self, min, max):
+        self.freqs = np.linspace(min, max, len(self.freqs))
+        return '1'
+
+    def set_freq_center(self, center, span):
+        self.freqs = np.linspace(center - span/2, center + span/2, len(self.freqs))
+        return '1'
+
+    def set_points(self, num):
+        self.freqs = np.linspace(self.freqs[0], self.freqs[-1], num)
+        return '1'
+
+    def set_ifbw(self, bw):
+        self.ifbw = bw
+        return '1'
+
+    def one_sweep(self, wait=False):
+        pass
+
+    def segmented_sweep(self, windows, Sij="S21"):
+        return sweep_windows(self, windows, Sij)
 
     def get_frequencies(self):
         """Restituisce l'array delle frequenze scansionate."""
@@ -554,20 +948,27 @@ class MockVNA:
         if param != "S21":
             raise ValueError("Errore: il simulatore supporta solo S21.")
 
-        # 1. Calcolo della risposta ideale del risonatore (Notch)
-        dx = (self.freqs - self.f0) / self.f0
-        S21_ideal = 1 - (self.Ql / self.Qc) / (1 + 2j * self.Ql * dx)
+        # 1. Calcolo della risposta ideale dei risonatori (Notch), uno dopo l'altro sulla linea
+        resonators = self.resonators if self.resonators is not None else [(self.f0, self.Ql, self.Qc)]
+        S21_ideal = np.ones(len(self.freqs), dtype=complex)
+        for f0, Ql, Qc in resonators:
+            dx = (self.freqs - f0) / f0
+            S21_ideal *= 1 - (Ql / Qc) / (1 + 2j * Ql * dx)
 
         # 2. Aggiunta della rotazione di fase dovuta ai cavi lunghi
-        cable_phase = np.exp(-2j * np.pi * self.freqs * 1e9 * self.cable_delay)
+        cable_phase = np.exp(-2j * np.pi * self.freqs * self.hz_per_unit * self.cable_delay)
         
-        # 3. Aggiunta del rumore di misura
-        noise = np.random.normal(0, self.noise_level, len(self.freqs)) + \
-                1j * np.random.normal(0, self.noise_level, len(self.freqs))
+        # 3. Aggiunta del rumore di misura (cresce come sqrt(IFBW))
+        sigma = self.noise_level * np.sqrt(self.ifbw / 1e3)
+        noise = np.random.normal(0, sigma, len(self.freqs)) + \
+                1j * np.random.normal(0, sigma, len(self.freqs))
 
         # Segnale finale combinato
         S21_measured = (S21_ideal + noise) * cable_phase
 
+        self.n_sweeps += 1
+        self.n_points_acquired += len(self.freqs)
+
         return np.real(S21_measured), np.imag(S21_measured)
     
     def save_vna_data(self, filename, freqs, real, imag):
@@ -0,0 +1,152 @@
+"""
+Acquisizione adattiva delle risonanze (coarse-to-fine) con VNA o MockVNA.
+
+Invece di uno sweep unico da 10000 punti su tutto lo span:
+    1. sweep largo e rado per trovare i dip;
+    2. per ogni dip, fit lorentziano con gli stessi guess di CircleFitter._fit_lorentz
+       (argmin, gamma = span/10, ...) per stimare f0 e Ql;
+    3. nuovo sweep solo su +-n_linewidths larghezze di riga attorno al dip, con piu' punti,
+       finche' l'errore relativo su Ql scende sotto il target.
+
+Funziona con qualsiasi oggetto che abbia set_freq_center, set_points, one_sweep e get_data
+(VNA e MockVNA di classes2). Le frequenze sono nelle unita' dello strumento (Hz per il VNA,
+GHz per il MockVNA): f0/gamma non dipende dalle unita'.
+"""
+
+import numpy as np
+from scipy import optimize
+from scipy.signal import find_peaks
+
+
+def lorentzian_power_tilt(f, A, f0, gamma, y0, m):
+    return y0 + m*(f - f0) + A / (1 + 4*(f - f0)**2 / gamma**2)
+
+
+def fit_lorentz(f, y):
+    """
+    Fit lorentziano con gli stessi guess di CircleFitter._fit_lorentz. Va passato y = |S21|^2:
+    per un notch |S21|^2 e' esattamente una lorentziana di larghezza f0/Ql, |S21| no
+    (con |S21| il Ql esce sovrastimato). Restituisce f0, Ql ed errore su Ql (propagato da pcov, covarianza f0-gamma inclusa).
+    """
+    f0_guess = f[np.argmin(y)]
+    gamma_guess = (f.max() - f.min()) / 10
+    A_guess = y.max() - y.min()
+    y0_guess = np.median(np.r_[y[:max(10, len(y)//10)], y[-max(10, len(y)//10):]])
+    m_guess = (y[-1] - y[0]) / (f[-1] - f[0])
+
+    # la frequenza viene centrata e scalata sullo span per non avere un fit mal condizionato
+    fc = f0_guess
+    scale = f.max() - f.min()
+    x = (f - fc) / scale
+    p0 = [A_guess, 0.0, gamma_guess / scale, y0_guess, m_guess * scale]
+
+    popt, pcov = optimize.curve_fit(lorentzian_power_tilt, x, y, p0=p0, maxfev=10000)
+    A_fit, x0_fit, gamma_fit, y0_fit, m_fit = popt
+
+    f0 = fc + x0_fit * scale
+    gamma = abs(gamma_fit) * scale
+    Ql = f0 / gamma
+
+    # d(Ql)/d(x0) e d(Ql)/d(gamma) nelle variabili del fit
+    J = np.array([scale / gamma, -Ql / abs(gamma_fit)])
+    cov = pcov[1:3, 1:3]
+    Ql_err = np.sqrt(J @ cov @ J) if np.all(np.isfinite(cov)) else np.inf
+
+    return f0, Ql, Ql_err
+
+
+def find_dips(freqs, S21, n_max=None, n_sigma=10):
+    """
+    Trova i dip di |S21| in uno sweep largo. Restituisce una lista di (f0, Ql, Ql_err),
+    uno per dip, dal fit lorentziano su una finestra attorno a ciascun minimo.
+    """
+    mag = np.abs(S21)
+    noise = np.median(np.abs(np.diff(mag))) / 0.6745 / np.sqrt(2)
+    peaks, props = find_peaks(-mag, prominence=n_sigma * noise, width=1)
+    widths = props['widths']
+    if n_max is not None:
+        # si tengono solo gli n_max dip piu' profondi
+        keep = np.argsort(props['prominences'])[::-1][:n_max]
+        peaks, widths = peaks[keep], widths[keep]
+
+    dips = []
+    for idx, width in zip(peaks, widths):
+        half = max(10, int(3 * width))
+        sl = slice(max(0, idx - half), min(len(freqs), idx + half + 1))
+        try:
+            dips.append(fit_lorentz(freqs[sl], mag[sl]**2))
+        except (RuntimeError, ValueError):
+            # fit fallito: si tiene solo la posizione del minimo e la larghezza di find_peaks
+            df = freqs[1] - freqs[0]
+            dips.append((freqs[idx], freqs[idx] / (width * df), np.inf))
+
+    return sorted(dips)
+
+
+def zoom_resonance(vna, f0, Ql, n_linewidths=5, points=201, max_points=9999, target_rel_err=1e-3, max_iter=6, Sij="S21"):
+    """
+    Ri-misura una risonanza su +-n_linewidths larghezze di riga (f0/Ql) attorno a f0.
+    Ad ogni giro la finestra viene ricentrata e i punti raddoppiati, finche'
+    Ql_err/Ql < target_rel_err (o si arriva a max_iter / max_points).
+    """
+    result = dict(f0=f0, Ql=Ql, Ql_err=np.inf, freqs=None, S21=None, n_sweeps=0, n_points=0, converged=False)
+    for i in range(max_iter):
+        span = 2 * n_linewidths * f0 / Ql
+        vna.set_freq_center(f0, span)
+        vna.set_points(points)
+        vna.one_sweep(wait=True)
+        real, imag = vna.get_data(Sij)
+        freqs = np.linspace(f0 - span/2, f0 + span/2, points)
+        S21 = real + 1j*imag
+        result['n_sweeps'] += 1
+        result['n_points'] += points
+
+        try:
+            f0_fit, Ql_fit, Ql_err = fit_lorentz(freqs, np.abs(S21)**2)
+        except (RuntimeError, ValueError):
+            break
+        # un fit che esce dalla finestra non e' affidabile: si tiene la stima precedente
+        if not (freqs[0] < f0_fit < freqs[-1]) or Ql_fit <= 0:
+            break
+
+        f0, Ql = f0_fit, Ql_fit
+        result.update(f0=f0, Ql=Ql, Ql_err=Ql_err, freqs=freqs, S21=S21)
+        if Ql_err / Ql < target_rel_err:
+            result['converged'] = True
+            break
+        points = min(2 * points, max_points)
+
+    return result
+
+
+def adaptive_zoom(vna, center, span, coarse_points=1001, n_max=None, Sij="S21", **zoom_kwargs):
+    """
+    Sweep largo su (center, span) con coarse_points punti, ricerca dei dip e zoom su ciascuno.
+    Restituisce una lista di dizionari (uno per risonanza) con f0, Ql, Ql_err, freqs, S21,
+    n_sweeps, n_points e converged. Gli argomenti extra vanno a zoom_resonance.
+    """
+    vna.set_freq_center(center, span)
+    vna.set_points(coarse_points)
+    vna.one_sweep(wait=True)
+    real, imag = vna.get_data(Sij)
+    freqs = np.linspace(center - span/2, center + span/2, coarse_points)
+
+    results = []
+    for f0, Ql, Ql_err in find_dips(freqs, real + 1j*imag, n_max=n_max):
+        results.append(zoom_resonance(vna, f0, Ql, Sij=Sij, **zoom_kwargs))
+
+    return results
+
+
+if __name__ == "__main__":
+    # Prova offline su un MockVNA con tre risonatori (frequenze in GHz)
+    from classes2 import MockVNA
+
+    resonators = [(7.4880, 15000, 18000), (7.4920, 30000, 40000), (7.4965, 20000, 25000)]
+    mock = MockVNA(f_center=7.492, span=0.015, num_points=10000, resonators=resonators)
+
+    results = adaptive_zoom(mock, 7.492, 0.015, coarse_points=1001, target_rel_err=2e-3)
+    print(f"{'f0 [GHz]':>12}{'Ql':>10}{'err Ql':>10}{'vero Ql':>10}{'sweep':>7}{'punti':>8}")
+    for r, (f0, Ql, Qc) in zip(results, resonators):
+        print(f"{r['f0']:>12.6f}{r['Ql']:>10.0f}{r['Ql_err']:>10.0f}{Ql:>10.0f}{r['n_sweeps']:>7}{r['n_points']:>8}")
+    print(f"\nPunti totali acquisiti: {mock.n_points_acquired} (sweep unico: 10000)")
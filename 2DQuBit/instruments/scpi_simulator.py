@@ -0,0 +1,356 @@
+"""
+Simulatore locale di strumenti SCPI su socket (raw TCP, come le risorse ...::SOCKET di pyvisa).
+
+Risponde ai comandi usati dalle classi del laboratorio, cosi' i driver veri (pyvisa,
+visa_sessions, parsing ASCII/binario) si possono provare e cronometrare senza strumenti:
+
+    VNA   classes2.VNA, 3DQubit VNA, SinglePhoton EthernetDevice/VNA
+          (FREQ:STAR/STOP/CENT/SPAN, SWE:POIN, CALC:DATA:SDATA? in FORM ASC o REAL,64,
+          FREQ:DATA?, INIT:IMM con durata dello sweep, SENS:SWE:TIME?, SENS:SEGM:DATA)
+    PSA   3DQubit PSA (TRACE:DATA?)
+    TDS   classes2.TDS (CURV? in DAT:ENC ASCI o RIB/RPB con DAT:WID 1 o 2, WFMPRE:...?)
+    SDG   classes2.SDG (C1:WVDT con i dati binari, ARWV, BSWV, BTWV, MTRIG)
+    LO    classes2.LO, 3DQubit LO (FREQ <f>mlHz/Hz/kHz/MHz/GHz, FREQ? in mHz, POW, LIST:...),
+          come porta seriale con l'URL pyserial sim.serial_url
+
+Tutti gli altri comandi "HEADER valore" vengono memorizzati e "HEADER?" restituisce
+il valore (forma corta e nodi opzionali SENS/SOUR/MAIN sono equivalenti).
+latency e' il tempo di elaborazione di ogni comando, bandwidth (byte/s) limita le
+risposte; i comandi in unsupported finiscono nella coda di SYST:ERR? come -113.
+
+    sim = SCPISimulator("VNA", latency=0.5e-3, bandwidth=10e6)
+    sim.start()
+    vna = VNA(sim.address)
+
+    sim_lo = SCPISimulator("LO")
+    sim_lo.start()
+    lo = LO(sim_lo.serial_url)
+
+Per le classi con l'indirizzo scritto nel codice (es. 3DQubit VNA):
+
+    visa_sessions.redirect("TCPIP0::192.168.40.10::inst0::INSTR", sim.address, **sim.attrs)
+"""
+
+import re
+import socket
+import threading
+import time
+import numpy as np
+
+# forme corte SCPI che non seguono la regola delle 4 lettere
+SHORT_FORMS = {"SCALE": "SCA", "SCAL": "SCA", "MAIN": "MAI", "SAMPLERATE": "SAMPLER", "SAMPLER": "SAMPLER", "ENCDG": "ENC", "DATA": "DAT"}
+# nodi che si possono omettere
+OPTIONAL_NODES = {"SENS", "SOUR", "MAI"}
+
+MODELS = ("VNA", "PSA", "TDS", "SDG", "LO")
+
+# FREQ del synth (classes2.LO): unita' -> mHz
+FREQ_UNITS = {"MLHZ": 1, "HZ": 1e3, "KHZ": 1e6, "MHZ": 1e9, "GHZ": 1e12}
+_QUANTITY = re.compile(r"\s*([-+0-9.eE]+)\s*([A-Za-z]*)\s*$")
+
+_WVDT = re.compile(rb"C(\d):WVDT [^\n]*?LENGTH,(\d+),WAVEDATA,")
+
+
+def _short(word):
+    word = word.upper()
+    if word in SHORT_FORMS:
+        return SHORT_FORMS[word]
+    if len(word) > 4 and not word[-1].isdigit():
+        return word[:3] if word[3] in "AEIOU" else word[:4]
+    return word
+
+
+def normalize(header):
+    """Forma canonica di un header SCPI (es. 'SENS:FREQ:START' -> 'FREQ:STAR')."""
+    nodes = [_short(n) for n in header.strip().lstrip(":").split(":") if n]
+    return ":".join(n for n in nodes if n not in OPTIONAL_NODES)
+
+
+def ieee_block(payload):
+    """Blocco binario IEEE 488.2 definito (#<n><lunghezza><dati>)."""
+    length = str(len(payload)).encode()
+    return b"#" + str(len(length)).encode() + length + payload
+
+
+class SCPISimulator(threading.Thread):
+    """
+    Server SCPI su 127.0.0.1 che simula un modello di strumento (vedi MODELS).
+
+    model:       "VNA", "PSA", "TDS", "SDG" o "LO"
+    latency:     secondi di elaborazione per ogni comando
+    bandwidth:   byte/s delle risposte (None: nessun limite)
+    n_points:    punti di default di sweep e tracce
+    sweep_time:  durata (s) di uno sweep (INIT:IMM) per media
+    unsupported: header (forma qualsiasi) che generano un errore -113
+    """
+
+    def __init__(self, model="VNA", latency=0.0, bandwidth=None, n_points=1001, sweep_time=0.0,
+                 unsupported=(), port=0, seed=0):
+        super().__init__(daemon=True)
+        if model not in MODELS:
+            raise ValueError(f"model must be one of {MODELS}")
+        self.model = model
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.sweep_time = sweep_time
+        self.unsupported = {normalize(h) for h in unsupported}
+        self.rng = np.random.default_rng(seed)
+
+        self.state = {}
+        self.errors = []
+        self.waveforms = {}     # SDG: nome -> int16
+        self.n_commands = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._set("SWE:POIN", str(n_points))
+        self._set("FREQ:STAR", "4e9")
+        self._set("FREQ:STOP", "5e9")
+        self._set("AVER:COUN", "1")
+        self._set("FORM", "ASC")
+        self._set("DAT:ENC", "ASCI")
+        self._set("DAT:WID", "1")
+        self._set("DAT:STAR", "1")
+        self._set("DAT:STOP", str(n_points))
+        self._set("FREQ", "5000000000000")  # LO: mHz
+        self._set("POW", "0")
+
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(("127.0.0.1", port))
+        self._server.listen(5)
+        self.port = self._server.getsockname()[1]
+
+    @property
+    def address(self):
+        return f"TCPIP0::127.0.0.1::{self.port}::SOCKET"
+
+    @property
+    def serial_url(self):
+        # URL pyserial (serial.serial_for_url) per le classi che parlano con una porta seriale (LO)
+        return f"socket://127.0.0.1:{self.port}"
+
+    @property
+    def attrs(self):
+        # attributi della sessione pyvisa per parlare con il simulatore
+        return dict(read_termination="\n", write_termination="\n")
+
+    def reset_counters(self):
+        self.n_commands = self.bytes_sent = self.bytes_received = 0
+
+    # ---------- stato ----------
+
+    def _set(self, header, value):
+        self.state[normalize(header)] = value.strip()
+
+    def _get(self, header, default="0"):
+        return self.state.get(normalize(header), default)
+
+    def _float(self, header, default=0.0):
+        try:
+            return float(self._get(header, str(default)).split(",")[0].replace("V", ""))
+        except ValueError:
+            return default
+
+    # ---------- dati simulati ----------
+
+    def frequencies(self):
+        n = int(self._float("SWE:POIN", 1001))
+        if normalize("FREQ:CENT") in self.state and normalize("FREQ:SPAN") in self.state:
+            center, span = self._float("FREQ:CENT"), self._float("FREQ:SPAN")
+            return np.linspace(center - span/2, center + span/2, n)
+        return np.linspace(self._float("FREQ:STAR"), self._float("FREQ:STOP"), n)
+
+    def s21(self):
+        # risonanza notch al centro della banda piu' un po' di rumore
+        f = self.frequencies()
+        f0, Ql, Qc = f.mean(), 2e4, 5e4
+        S = 1 - (Ql/Qc) / (1 + 2j*Ql*(f/f0 - 1))
+        return S + 1e-3*(self.rng.normal(size=len(f)) + 1j*self.rng.normal(size=len(f)))
+
+    def _number_block(self, values):
+        # ASCII separato da virgole o REAL,64 secondo FORM e FORM:BORD
+        if self._get("FORM").upper().startswith("REAL"):
+            dtype = "<f8" if self._get("FORM:BORD", "NORM").upper().startswith("SWAP") else ">f8"
+            return ieee_block(np.asarray(values, dtype=dtype).tobytes())
+        return ",".join(f"{v:.12E}" for v in values).encode()
+
+    def _curve(self):
+        start, stop = int(self._float("DAT:STAR", 1)), int(self._float("DAT:STOP", 500))
+        n = max(stop - start + 1, 0)
+        width = int(self._float("DAT:WID", 1))
+        ch = int(self._get("DAT:SOU", "CH1")[-1])
+        t = np.arange(n)
+        levels = 100 * np.sin(2*np.pi*t/50 + (ch - 1)*np.pi/2) * np.exp(-((t - n/2)/(n/6 + 1))**2)
+        levels += self.rng.normal(0, 2, n)
+        if width == 2:
+            levels *= 256
+        encoding = self._get("DAT:ENC").upper()
+        if encoding.startswith("ASC"):
+            return ",".join(str(int(v)) for v in np.rint(levels)).encode()
+        dtype = {1: "i1", 2: ">i2"}[width]
+        counts = np.clip(np.rint(levels), np.iinfo(dtype).min, np.iinfo(dtype).max).astype(dtype)
+        if encoding.startswith("RP"):
+            counts = (counts.astype(np.int32) - np.iinfo(dtype).min).astype(dtype.replace("i", "u"))
+        return ieee_block(counts.tobytes())
+
+    def _waveform_preamble(self, field):
+        ch = self._get("DAT:SOU", "CH1")[-1]
+        width = int(self._float("DAT:WID", 1))
+        volts_per_div = self._float(f"CH{ch}:SCA", 0.1)
+        values = {"YMULT": volts_per_div / 25 / (256 if width == 2 else 1), "YOFF": 0.0, "YZERO": 0.0,
+                  "XINCR": 1 / self._float("HOR:SAMPLER", 1e9)}
+        return {_short(name): value for name, value in values.items()}.get(field)
+
+    # ---------- comandi ----------
+
+    def _query(self, header):
+        key = normalize(header)
+        if key == "*IDN":
+            return f"SIM,{self.model},0,1.0".encode()
+        if key == "*OPC":
+            return b"1"
+        if key == "*ESR":
+            return b"1"
+        if key == "SYST:ERR":
+            return (self.errors.pop(0) if self.errors else '+0,"No error"').encode()
+        if self.model in ("VNA", "PSA"):
+            if key == "CALC:DAT:SDAT":
+                S = self.s21()
+                pairs = np.empty(2*len(S))
+                pairs[0::2], pairs[1::2] = S.real, S.imag
+                return self._number_block(pairs)
+            if key in ("FREQ:DAT", "CALC:X"):
+                return ",".join(f"{f:.12E}" for f in self.frequencies()).encode()
+            if key == "TRAC:DAT":
+                f = self.frequencies()
+                trace = -90 + 60*np.exp(-((f - f.mean())/(np.ptp(f)/50 + 1))**2) + self.rng.normal(0, 1, len(f))
+                return ",".join(f"{v:.6E}" for v in trace).encode()
+            if key == "SWE:TIME":
+                return f"{self.sweep_time:.6E}".encode()
+        if self.model == "TDS":
+            if key == "CURV":
+                return self._curve()
+            if key.startswith("WFMP:") or key.startswith("WFMO:"):
+                value = self._waveform_preamble(key.split(":")[-1])
+                if value is not None:
+                    return f"{value:.6E}".encode()
+        if self.model == "SDG" and key.endswith(":BSWV"):
+            return f"{header.split(':')[0]}:BSWV WVTP,ARB,{self._get(header, '')}".encode()
+        return self._get(header).encode()
+
+    def _command(self, header, value):
+        key = normalize(header)
+        if key == "*CLS":
+            self.errors.clear()
+        elif key == "INIT" or key == "INIT:IMM":
+            time.sleep(self.sweep_time * max(int(self._float("AVER:COUN", 1)), 1))
+        elif self.model == "LO" and key in ("FREQ", "POW") and value is not None:
+            # il synth risponde a FREQ? in mHz e a POW? in dBm, senza unita'
+            match = _QUANTITY.match(value)
+            if match is None or (key == "FREQ" and match.group(2).upper() not in FREQ_UNITS):
+                self.errors.append('-224,"Illegal parameter value"')
+                return
+            number = float(match.group(1))
+            if key == "FREQ":
+                value = str(int(round(number * FREQ_UNITS[match.group(2).upper()])))
+            else:
+                value = f"{number:g}"
+        elif key == "FREQ:STAR" or key == "FREQ:STOP":
+            # start/stop e center/span sono due modi di dire la stessa cosa
+            self.state.pop(normalize("FREQ:CENT"), None)
+            self.state.pop(normalize("FREQ:SPAN"), None)
+        if value is not None:
+            self.state[key] = value.strip()
+
+    def handle(self, message):
+        """Esegue un messaggio (comandi separati da ';') e restituisce la risposta o b''."""
+        replies = []
+        for item in message.split(";"):
+            item = item.strip()
+            if not item:
+                continue
+            self.n_commands += 1
+            if self.latency:
+                time.sleep(self.latency)
+            header, sep, value = item.partition(" ")
+            if normalize(header.rstrip("?")) in self.unsupported:
+                self.errors.append('-113,"Undefined header"')
+                continue
+            if header.endswith("?"):
+                replies.append(self._query(header[:-1]))
+            else:
+                self._command(header, value if sep else None)
+        return b";".join(replies)
+
+    def _wvdt(self, match, data):
+        # C<ch>:WVDT ... WAVEDATA,<dati int16 little endian>
+        header = match.group(0).decode()
+        name = re.search(r"WVNM,([^,]+)", header)
+        self.waveforms[name.group(1) if name else f"C{match.group(1)}"] = np.frombuffer(data, "<i2").copy()
+        self.n_commands += 1
+
+    # ---------- server ----------
+
+    def _send(self, conn, reply):
+        reply += b"\n"
+        if self.bandwidth:
+            time.sleep(len(reply) / self.bandwidth)
+        conn.sendall(reply)
+        self.bytes_sent += len(reply)
+
+    def _serve(self, conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buffer = b""
+        with conn:
+            while True:
+                if hasattr(socket, "TCP_QUICKACK"):
+                    # ACK subito: altrimenti il Nagle del client aspetta ~40 ms tra write e query
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+                chunk = conn.recv(1 << 20)
+                if not chunk:
+                    break
+                self.bytes_received += len(chunk)
+                buffer += chunk
+                while True:
+                    match = _WVDT.match(buffer)
+                    if match:
+                        end = match.end() + 2*int(match.group(2))
+                        if len(buffer) < end + 1:
+                            break
+                        self._wvdt(match, buffer[match.end():end])
+                        buffer = buffer[end:].lstrip(b"\r\n")
+                        continue
+                    if b"\n" not in buffer:
+                        break
+                    line, buffer = buffer.split(b"\n", 1)
+                    reply = self.handle(line.decode(errors="replace"))
+                    if reply:
+                        self._send(conn, reply)
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def close(self):
+        self._server.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulatore SCPI locale")
+    parser.add_argument("model", choices=MODELS)
+    parser.add_argument("--port", type=int, default=5025)
+    parser.add_argument("--latency", type=float, default=0.0, help="s per comando")
+    parser.add_argument("--bandwidth", type=float, default=None, help="byte/s delle risposte")
+    parser.add_argument("--points", type=int, default=1001)
+    parser.add_argument("--sweep-time", type=float, default=0.0)
+    args = parser.parse_args()
+
+    sim = SCPISimulator(args.model, args.latency, args.bandwidth, args.points, args.sweep_time, port=args.port)
+    print(f"{args.model} simulato su {sim.address} (Ctrl+C per uscire)")
+    sim.run()
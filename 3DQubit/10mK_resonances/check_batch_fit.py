@@ -0,0 +1,46 @@
+import sys
+import glob
+import time
+import numpy as np
+sys.path.append("..")
+from circle_fit import CircleFitter
+
+# Confronto tra CircleFitter._fit (una traccia alla volta) e CircleFitter._fit_batch (tutte le
+# tracce insieme, autovalori in un'unica chiamata). Il riferimento dei parametri e' il solver
+# "newton", indipendente da _solve_eig che usano sia _fit (default) sia _fit_batch;
+# i tempi sono quelli del loop con il solver di default.
+
+files = sorted(glob.glob("data_10mK/*.txt"))
+data = [np.loadtxt(f, delimiter="\t") for f in files]
+# una riga contigua per traccia, come una pila di tracce acquisite
+x = np.stack([d[:, 1] for d in data])
+y = np.stack([d[:, 2] for d in data])
+
+fitter = CircleFitter()
+newton = CircleFitter(solver="newton")
+
+loop = lambda: np.array([fitter._fit(x[i], y[i]) for i in range(len(files))])
+loop()
+ref = np.array([newton._fit(x[i], y[i]) for i in range(len(files))])
+batch = fitter._fit_batch(x, y)
+
+# tempi: il migliore su REPEAT ripetizioni (la prima chiamata e' gia' fatta sopra)
+REPEAT = 50
+def best_time(fn):
+    times = []
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+t_loop = best_time(loop)
+t_batch = best_time(lambda: fitter._fit_batch(x, y))
+
+for f, (xc, yc, r), diff in zip(files, batch, np.abs(batch - ref).max(axis=1)):
+    print(f"{f:<35} xc = {xc:+.6e}  yc = {yc:+.6e}  r = {r:.6e}  |diff| = {diff:.1e}")
+
+rel = np.max(np.abs(batch - ref) / np.abs(ref))
+print(f"\nMassima differenza relativa: {rel:.1e}")
+print(f"Loop: {1e3*t_loop:.2f} ms, batch: {1e3*t_batch:.2f} ms, x{t_loop/t_batch:.1f} ({len(files)} tracce da {x.shape[1]} punti, migliore su {REPEAT})")
+assert rel < 1e-10
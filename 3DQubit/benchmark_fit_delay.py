@@ -0,0 +1,59 @@
+"""
+Microbenchmark di CircleFitter._fit_delay con i due solver del fit algebrico del cerchio:
+    "newton" -> Newton su det(M - eta B) + null_space (vecchio metodo)
+    "eig"    -> autovalori di B^-1 M (default)
+
+_fit_delay chiama _fit_from_complex a ogni valutazione dei residui dentro leastsq,
+quindi il solver e' il punto piu' caldo della pipeline.
+
+Per runnare (dalla cartella 3DQubit):
+    python benchmark_fit_delay.py
+"""
+
+import glob
+import time
+import numpy as np
+from circle_fit import CircleFitter
+
+N_REPEAT = 5
+
+files = sorted(glob.glob("10mK_resonances/data_10mK/*.txt"))
+traces = []
+for f in files:
+    data = np.loadtxt(f, delimiter="\t")
+    traces.append((data[:, 0], data[:, 1] + 1j*data[:, 2]))
+
+
+def time_fit_delay(solver):
+    fitter = CircleFitter(solver=solver)
+    n_fits = 0
+    original = fitter._fit_from_complex
+
+    def counted(s):
+        nonlocal n_fits
+        n_fits += 1
+        return original(s)
+
+    fitter._fit_from_complex = counted
+    taus, times = [], []
+    for f, z in traces:
+        delay_guess = fitter._guess_delay(f, z)
+        t = []
+        for _ in range(N_REPEAT):
+            t0 = time.perf_counter()
+            tau = fitter._fit_delay(f, z, delay_guess)
+            t.append(time.perf_counter() - t0)
+        taus.append(tau)
+        times.append(np.median(t))
+    return np.array(taus), np.array(times), n_fits / (N_REPEAT * len(traces))
+
+
+if __name__ == "__main__":
+    tau_n, t_n, fits_n = time_fit_delay("newton")
+    tau_e, t_e, fits_e = time_fit_delay("eig")
+
+    print(f"{'file':<38}{'newton [ms]':>12}{'eig [ms]':>10}{'speedup':>9}{'|dtau| [s]':>12}")
+    for f, tn, te, dn in zip(files, t_n, t_e, np.abs(tau_n - tau_e)):
+        print(f"{f.split('/')[-1]:<38}{1e3*tn:>12.2f}{1e3*te:>10.2f}{tn/te:>9.1f}{dn:>12.1e}")
+    print(f"\nFit del cerchio per chiamata a _fit_delay: newton {fits_n:.0f}, eig {fits_e:.0f}")
+    print(f"Totale: newton {1e3*t_n.sum():.1f} ms, eig {1e3*t_e.sum():.1f} ms -> x{t_n.sum()/t_e.sum():.1f}")
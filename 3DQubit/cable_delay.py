@@ -1,7 +1,14 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy import stats
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from calibration_cache import CalibrationCache
 TAU =89.29e-09 + 400 * 1.0001000100010001e-07
+# Chiave della calibrazione salvata in calibration/index.json (la rileggono i fit con CircleFitter)
+RUN = "default"
+LINE = "default"
 # This makes your plot look like latex. Great for writing papers!
 plt.rcParams.update({
     "text.usetex": True,
@@ -11,6 +18,7 @@ plt.rcParams.update({
 # Carica i dati dal file
 data = np.load("data_2.npz")
 frequencies = data['0']['freq']
+band = (frequencies.min(), frequencies.max())
 signal = np.abs(data['0']['signal'])
 phase = (data['0']['phase'])
 
@@ -29,6 +37,8 @@ coefficients = np.polyfit(frequencies , phase, 1)
 
 tau = -coefficients[0]/(2*np.pi)
 print("tau fit:", tau)
+# tau vale per tutta la banda del file, non solo per la coda usata nel fit
+CalibrationCache(run=RUN, line=LINE).store(frequencies, tau, band=band)
 b_intercept = coefficients[1]
 
 
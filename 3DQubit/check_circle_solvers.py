@@ -0,0 +1,55 @@
+"""
+Controllo del solver "eig" del fit algebrico del cerchio contro "newton" su cerchi esatti
+e quasi esatti: senza rumore l'eta giusto e' ~0 e puo' uscire leggermente negativo, e il
+solver deve comunque prendere quell'autovettore (e non un altro cerchio).
+
+Controlla CircleFitter._fit, CircleFitter._fit_batch (3DQubit) e CircleEstimator
+(2DQuBit/Resonance_mkid/CircleFit).
+
+Per runnare (dalla cartella 3DQubit):
+    python check_circle_solvers.py
+"""
+
+import os
+import sys
+import numpy as np
+from circle_fit import CircleFitter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "2DQuBit", "Resonance_mkid", "CircleFit"))
+from ResonatorFitter import CircleEstimator
+
+N_CIRCLES = 200
+N_POINTS = 500
+NOISE = [0.0, 1e-9, 1e-6, 1e-3]
+
+rng = np.random.default_rng(0)
+theta = np.linspace(0, 2*np.pi, N_POINTS, endpoint=False)
+
+
+def same(a, b):
+    return np.allclose(a, b, rtol=1e-6, atol=1e-9)
+
+
+if __name__ == "__main__":
+    # caso che con il solo controllo eta >= 0 dava (-2.00, 1.52, 2.83)
+    x, y = 0.3 + 0.5*np.cos(theta), -0.2 + 0.5*np.sin(theta)
+    params = CircleFitter()._fit(x, y)
+    print(f"Cerchio (0.3, -0.2), r = 0.5 -> eig: ({params[0]:.6f}, {params[1]:.6f}, {params[2]:.6f})")
+    assert same(params, (0.3, -0.2, 0.5))
+
+    print(f"\n{'rumore':>8}{'_fit':>8}{'_fit_batch':>12}{'CircleEstimator':>17}   (fit diversi da newton su {N_CIRCLES})")
+    for noise in NOISE:
+        bad_fit = bad_batch = bad_estimator = 0
+        for _ in range(N_CIRCLES):
+            xc, yc, r = rng.uniform(-1, 1), rng.uniform(-1, 1), rng.uniform(0.05, 2)
+            x = xc + r*np.cos(theta) + noise*rng.standard_normal(N_POINTS)
+            y = yc + r*np.sin(theta) + noise*rng.standard_normal(N_POINTS)
+
+            ref = CircleFitter(solver="newton")._fit(x, y)
+            bad_fit += not same(CircleFitter()._fit(x, y), ref)
+            bad_batch += not same(CircleFitter()._fit_batch(x[None], y[None])[0], ref)
+            bad_estimator += not same(CircleEstimator().fit(x, y), CircleEstimator(solver="newton").fit(x, y))
+        print(f"{noise:>8.0e}{bad_fit:>8}{bad_batch:>12}{bad_estimator:>17}")
+        assert bad_fit == bad_batch == bad_estimator == 0
+
+    print("\neig e newton danno lo stesso cerchio")
@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(HERE)
+import frequency_vs_temperature as fvt
+
+# Tabella di frequency_vs_temperature con i fit in seriale e su piu' processi, con la cache
+# di calibrazione attiva e vuota all'inizio di ogni run: le due tabelle devono essere identiche
+# (il delay di ogni file viene risolto nel processo principale prima dei worker).
+
+N_WORKERS = 4
+
+jobs = [(t, name, os.path.join(HERE, pattern.format(t=t))) for name, pattern in fvt.Resonators.items() for t in fvt.Temps]
+
+
+def run(n_workers):
+    # cartella nuova: "calibration" (CALIBRATION_DIR) e' relativa alla cwd, anche nei worker
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            t0 = time.perf_counter()
+            table = fvt.build_table(fvt.run_fits(jobs, n_workers=n_workers))
+            elapsed = time.perf_counter() - t0
+            entries = len(fvt.CalibrationCache(fvt.CALIBRATION_DIR)._load())
+        finally:
+            os.chdir(cwd)
+    return table, elapsed, entries
+
+
+if __name__ == "__main__":
+    serial, t_serial, n_serial = run(1)
+    parallel, t_parallel, n_parallel = run(N_WORKERS)
+
+    print(f"{'T':<10}{'f_r seriale':>18}{'f_r parallelo':>18}{'Ql seriale':>14}{'Ql parallelo':>14}")
+    for a, b in zip(serial, parallel):
+        print(f"{a['label']:<10}{a['f_r']:>18.6f}{b['f_r']:>18.6f}{a['Ql']:>14.2f}{b['Ql']:>14.2f}")
+
+    print(f"\nSeriale: {t_serial:.2f} s, {N_WORKERS} processi: {t_parallel:.2f} s")
+    print(f"Voci nella cache di calibrazione: {n_serial} (seriale), {n_parallel} (parallelo)")
+    assert n_serial == n_parallel
+    assert all(np.array_equal(serial[name], parallel[name]) for name in serial.dtype.names), "tabelle diverse"
+    print("Tabelle identiche")
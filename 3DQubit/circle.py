@@ -5,7 +5,10 @@ from scipy.optimize import least_squares
 import matplotlib.pyplot as plt
 from matplotlib.gridspec import GridSpec
 from circle_fit import CircleFitter
+import os
 import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from s21_loader import load_s21
 sys.path.append("/")
 ########## SCRIPT 4 LATEX #####
 plt.rcParams.update({
@@ -34,14 +37,10 @@ save_as = "fit" + n_misura
 
 
 # Assumi che il file ../data/misura_S21.txt contenga: freq, real, imag
-data = np.loadtxt("10mK_resonances/data_10mK/"+data_file + ".txt", delimiter="\t")
-frequencies = data[:, 0]  # Frequenze in Hz
+frequencies, S21_file = load_s21("10mK_resonances/data_10mK/"+data_file + ".txt")  # Frequenze in Hz, S21 complesso
 
-real_S21 = data[:, 1]     # Parte reale di S21
-imag_S21 = data[:, 2]     # Parte immaginaria di S21
-
-signal = np.abs(real_S21 + 1j * imag_S21)
-phase = np.unwrap(np.angle(real_S21 + 1j * imag_S21))
+signal = np.abs(S21_file)
+phase = np.unwrap(np.angle(S21_file))
 
 
 ####################################
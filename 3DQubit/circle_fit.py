@@ -6,12 +6,23 @@ from scipy import stats
 class CircleFitter:
     """
     Algebraic circle fit using generalized eigenvalue problem.
+
+    solver = "eig"    -> autovalori di B^-1 M in un colpo solo (default)
+    solver = "newton" -> Newton su det(M - eta B) partendo da 0 + null_space (vecchio metodo)
+
+    calibration: CalibrationCache (calibration_cache.py) da cui leggere tau e baseline della
+    linea; None = delay rifittato su ogni traccia.
     """
 
-    def __init__(self):
+    def __init__(self, solver="eig", calibration=None):
+        if solver not in ("eig", "newton"):
+            raise ValueError(f"Unknown solver '{solver}' (use 'eig' or 'newton')")
+        self.solver = solver
+        self.calibration = calibration
         self.params_ = None
         self.coeffs_ = None
         self.eta_ = None
+        self.notch_nfev_ = None
 
     @staticmethod
     def _moments(x, y):
@@ -56,6 +67,36 @@ class CircleFitter:
         f = lambda e: CircleFitter._char_eq(M, B, e)
         return optimize.newton(f, 0.0)
 
+    # B^-1 della matrice di vincolo di _build_matrices
+    _B_inv = np.array([
+        [0.0, 0.0, 0.0, -0.5],
+        [0.0, 1.0, 0.0,  0.0],
+        [0.0, 0.0, 1.0,  0.0],
+        [-0.5,0.0, 0.0,  0.0]
+    ], dtype=float)
+
+    @staticmethod
+    def _solve_eig(M):
+        """
+        Risolve M a = eta B a come autovalori di B^-1 M (stesso pencil di scipy.linalg.eig(M, B),
+        ma senza l'overhead di LAPACK ggev) e restituisce il piu' piccolo eta non negativo con il
+        suo autovettore. M puo' essere (4, 4) o una pila (n, 4, 4): np.linalg.eig lavora sul primo asse.
+        Newton partendo da 0 puo' finire sulla radice negativa o su quella sbagliata; qui no.
+        Gli autovalori non negativi si riconoscono da a^T B a > 0 (M e' semidefinita positiva, quindi
+        a^T M a = eta a^T B a >= 0) e non dal segno di eta: su dati senza rumore l'eta giusto e' ~0
+        e puo' uscire -1e-15.
+        """
+        w, v = np.linalg.eig(CircleFitter._B_inv @ M)
+        w, v = w.real, v.real
+        # a^T B a per ogni autovettore (colonne di v)
+        alpha = v[..., 1, :]**2 + v[..., 2, :]**2 - 4.0*v[..., 0, :]*v[..., 3, :]
+        k = np.argmin(np.where(alpha > 0, w, np.inf), axis=-1)
+        eta = np.take_along_axis(w, k[..., None], axis=-1)[..., 0]
+        if not np.all(np.take_along_axis(alpha, k[..., None], axis=-1) > 0):
+            raise RuntimeError("No eigenvector with a^T B a > 0")
+        a = np.take_along_axis(v, k[..., None, None], axis=-1)[..., 0]
+        return eta, a
+
     @staticmethod
     def _normalize_eigenvector(a, B):
         alpha = a @ B @ a
@@ -75,15 +116,17 @@ class CircleFitter:
     def _fit(self, x, y):
         m = self._moments(x, y)
         M, B = self._build_matrices(m)
-        eta = self._solve_eta(M, B)
+        if self.solver == "eig":
+            eta, a = self._solve_eig(M)
+        else:
+            eta = self._solve_eta(M, B)
+            D = M - eta * B
+            A = null_space(D)
+            if A.size == 0:
+                raise RuntimeError("Null space empty; no eigenvector")
+            a = A[:, 0]
         self.eta_ = eta
 
-        D = M - eta * B
-        A = null_space(D)
-        if A.size == 0:
-            raise RuntimeError("Null space empty; no eigenvector")
-
-        a = A[:, 0]
         a = self._normalize_eigenvector(a, B)
         self.coeffs_ = a
         A0, B0, C0, D0 = a
@@ -95,6 +138,58 @@ class CircleFitter:
     def _fit_from_complex(self, s):
         return self._fit(s.real, s.imag)
 
+    # ---------- Fit di tante tracce insieme ----------
+
+    @staticmethod
+    def _batch_moments(x, y):
+        # stesse somme di _moments per tutte le tracce, ognuna con un einsum sulle (n_traces, n_points):
+        # niente pila Z = [z, x, y, 1] (n_traces, n_points, 4), la cui costruzione costava piu' del loop
+        z = x*x + y*y
+        dot = lambda a, b: np.einsum('tn,tn->t', a, b)
+        Sxx, Syy, Szz = dot(x, x), dot(y, y), dot(z, z)
+        Sxy, Sxz, Syz = dot(x, y), dot(x, z), dot(y, z)
+        Sx, Sy, Sz = np.einsum('tn->t', x), np.einsum('tn->t', y), np.einsum('tn->t', z)
+        n = np.full_like(Sx, x.shape[1])
+        return np.stack([
+            np.stack([Szz, Sxz, Syz, Sz], axis=-1),
+            np.stack([Sxz, Sxx, Sxy, Sx], axis=-1),
+            np.stack([Syz, Sxy, Syy, Sy], axis=-1),
+            np.stack([Sz,  Sx,  Sy,  n ], axis=-1)
+        ], axis=1)
+
+    def _fit_batch(self, x, y):
+        """
+        Stesso fit di _fit su una pila di tracce di shape (n_traces, n_points):
+        tutte le matrici dei momenti con einsum sulla pila e tutti gli autovalori con una chiamata a _solve_eig.
+        Restituisce un array (n_traces, 3) con (x_c, y_c, r).
+        """
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        y = np.atleast_2d(np.asarray(y, dtype=float))
+        M = self._batch_moments(x, y)
+
+        eta, a = self._solve_eig(M)
+
+        # normalizzazione a^T B a = 1 (B = inversa di _B_inv)
+        alpha = a[:, 1]**2 + a[:, 2]**2 - 4.0*a[:, 0]*a[:, 3]
+        if np.any(np.isclose(alpha, 0.0)):
+            raise ZeroDivisionError("a^T B a = 0 → can't normalize")
+        a = a / np.sqrt(alpha)[:, None]
+
+        A0, B0, C0, D0 = a.T
+        if np.any(np.isclose(A0, 0.0)):
+            raise ZeroDivisionError("A0 = 0 → r can't be computed")
+        x_c = -0.5 * B0 / A0
+        y_c = -0.5 * C0 / A0
+        r   = 0.5 *np.sqrt(B0*B0 + C0*C0 - 4.0*A0*D0) / np.abs(A0)
+
+        self.eta_ = eta
+        self.coeffs_ = a
+        self.params_ = np.stack([x_c, y_c, r], axis=1)
+        return self.params_
+
+    def _fit_batch_from_complex(self, s):
+        return self._fit_batch(s.real, s.imag)
+
 
     def _guess_delay(self,f_data,z_data):
         phase2 = np.unwrap(np.angle(z_data))
@@ -115,6 +210,25 @@ class CircleFitter:
         p_final = optimize.leastsq(residuals,delay,args=(f_data,z_data),maxfev=10000,ftol=1e-15,xtol=1e-15)
         return p_final[0][0]
 
+    def _calibrated_delay(self, f_data, z_data):
+        # tau dalla cache se c'e' per questa banda, altrimenti _guess_delay + _fit_delay
+        # (il leastsq annidato, la parte piu' lenta dei guess) e si salva per le tracce dopo
+        if self.calibration is not None:
+            tau = self.calibration.tau(f_data)
+            if tau is not None:
+                return tau
+        tau = self._guess_delay(f_data, z_data)
+        tau += self._fit_delay(f_data, self._remove_cable_delay(f_data, z_data, tau))
+        if self.calibration is not None:
+            self.calibration.store(f_data, tau)
+        return tau
+
+    def _remove_baseline(self, f_data, z_data):
+        if self.calibration is None:
+            return z_data
+        baseline = self.calibration.baseline(f_data)
+        return z_data if baseline is None else z_data / baseline
+
 
     def _canonize(self, f_data, z_data, scaling, rotation, delay):
         z_data = 1/scaling * np.exp(-1j * rotation)*self._remove_cable_delay(f_data,z_data, delay)
@@ -170,29 +284,168 @@ class CircleFitter:
 
         return p.x
 
-    def _fit_notch(self, z_data, f_data, Ql_guess, Qc_guess, fr_guess, a_guess, alpha_guess, tau_guess):
-        
-        def S21_notch(f, Ql, abs_Qc, phase_Qc, f0, a, alpha, tau):
-            mod_QC = abs_Qc
-            phi = phase_Qc
-            return a * np.exp(1j*alpha)*np.exp(-1j* 2*np.pi*tau * f) * (1 - ((Ql/mod_QC) * np.exp(1j *phi))/(1 + 2j *Ql*(f/f0 -1)))
-
-        def S21_notch_real(f, Ql, abs_Qc, phase_Qc, f0, a, alpha, tau):
-            z = S21_notch(f, Ql, abs_Qc, phase_Qc, f0, a, alpha, tau)
-            return np.hstack([z.real, z.imag])
-
-        ydata = np.hstack([z_data.real, z_data.imag])
+    def _fit_notch(self, z_data, f_data, Ql_guess, Qc_guess, fr_guess, a_guess, alpha_guess, tau_guess, fix_tau=False, **kwargs):
+        # fix_tau=True: tau resta quello passato (es. delay condiviso da tutto lo sweep)
+        # kwargs vanno a NotchFitter.fit / least_squares (es. x_scale='jac')
 
         abs_Qc_guess = abs(Qc_guess)
         phase_Qc_guess = np.angle(Qc_guess)
 
         p0 = [Ql_guess , abs_Qc_guess, phase_Qc_guess, fr_guess, a_guess, alpha_guess, tau_guess]
 
-        lower = [1,   1e1,   -np.pi, f_data.min() , 1e-7, -np.pi, -1e7]
-        upper = [1e8 ,  1e8,   np.pi, f_data.max(),  1e7,  np.pi,  1e7 ]
+        # alpha e' una fase globale: limiti a +-pi attorno al guess (e risultato riportato in (-pi, pi]),
+        # altrimenti quando vale ~pi il fit resta incollato al bordo e tau/phi compensano
+        lower = [1,   1e1,   -np.pi, f_data.min() , 1e-7, alpha_guess - np.pi, -1e7]
+        upper = [1e8 ,  1e8,   np.pi, f_data.max(),  1e7,  alpha_guess + np.pi,  1e7 ]
 
-        popt, pcov = optimize.curve_fit(S21_notch_real, f_data, ydata, p0=p0, bounds=(lower, upper), maxfev = 10000)
+        notch = NotchFitter(f_data, z_data)
+        popt, pcov = notch.fit(p0, bounds=(lower, upper), max_nfev=10000, fixed=[6] if fix_tau else None, **kwargs)
+        popt[5] = np.angle(np.exp(1j*popt[5]))
+        self.notch_nfev_ = notch.n_model
 
         return popt, pcov
 
 
+class NotchFitter:
+    """
+    Fit del modello notch (Probst) con jacobiano analitico.
+
+        z = P (1 - C/D),  P = a e^{i alpha} e^{-2 pi i tau f},  C = (Ql/|Qc|) e^{i phi},  D = 1 + 2i Ql (f/f0 - 1)
+
+    Parametri nello stesso ordine di _fit_notch: (Ql, |Qc|, phi, f0, a, alpha, tau).
+    Con Q = P C / D (quindi z = P - Q) le derivate sono:
+        dz/dQl = -Q/(Ql D)      dz/d|Qc| = Q/|Qc|      dz/dphi = -i Q
+        dz/df0 = -Q/D * 2i Ql f/f0^2      dz/da = z/a      dz/dalpha = i z      dz/dtau = -2 pi i f z
+
+    I termini complessi vengono calcolati in buffer allocati una volta sola; il jacobiano riusa
+    quelli dell'ultima valutazione dei residui (least_squares lo chiede sempre nello stesso punto).
+    fit() restituisce popt, pcov come curve_fit.
+    """
+
+    def __init__(self, f_data, z_data):
+        self.f = np.asarray(f_data, dtype=float)
+        z_data = np.asarray(z_data, dtype=complex)
+        n = self.f.size
+        self.n = n
+        self.ydata = np.concatenate([z_data.real, z_data.imag])
+        self.n_model = 0
+        self.n_jac = 0
+
+        self._x = None
+        self._P = np.empty(n, dtype=complex)
+        self._D = np.empty(n, dtype=complex)
+        self._Q = np.empty(n, dtype=complex)
+        self._z = np.empty(n, dtype=complex)
+        self._tmp = np.empty(n, dtype=complex)
+        self._jac = np.empty((2*n, 7))
+
+    def _evaluate(self, p):
+        Ql, abs_Qc, phi, f0, a, alpha, tau = p
+        P, D, Q, z = self._P, self._D, self._Q, self._z
+
+        # P = a e^{i(alpha - 2 pi tau f)}
+        self._tmp.real = 0.0
+        np.multiply(self.f, -2*np.pi*tau, out=self._tmp.imag)
+        self._tmp.imag += alpha
+        np.exp(self._tmp, out=P)
+        P *= a
+
+        # D = 1 + 2i Ql (f/f0 - 1)
+        D.real = 1.0
+        np.multiply(self.f, 2*Ql/f0, out=D.imag)
+        D.imag -= 2*Ql
+
+        # Q = P C / D,  z = P - Q
+        np.multiply(P, Ql/abs_Qc*np.exp(1j*phi), out=Q)
+        Q /= D
+        np.subtract(P, Q, out=z)
+
+        self._x = np.array(p, dtype=float)
+        self.n_model += 1
+        return z
+
+    def model(self, p):
+        return self._evaluate(p).copy()
+
+    def residuals(self, p):
+        z = self._evaluate(p)
+        # array nuovo a ogni chiamata: least_squares tiene il residuo precedente per confrontarlo
+        r = np.empty(2*self.n)
+        np.subtract(z.real, self.ydata[:self.n], out=r[:self.n])
+        np.subtract(z.imag, self.ydata[self.n:], out=r[self.n:])
+        return r
+
+    def jacobian(self, p, *args):
+        if self._x is None or not np.array_equal(self._x, p):
+            self._evaluate(p)
+        Ql, abs_Qc, phi, f0, a, alpha, tau = p
+        D, Q, z, tmp, J = self._D, self._Q, self._z, self._tmp, self._jac
+        n = self.n
+
+        def put(k, dz):
+            J[:n, k] = dz.real
+            J[n:, k] = dz.imag
+
+        # Q/D, usato da dQl e df0
+        np.divide(Q, D, out=tmp)
+        put(0, tmp * (-1/Ql))
+        put(3, tmp * (-2j*Ql/f0**2) * self.f)
+        put(1, Q * (1/abs_Qc))
+        put(2, Q * -1j)
+        put(4, z * (1/a))
+        put(5, z * 1j)
+        put(6, z * (-2j*np.pi) * self.f)
+
+        self.n_jac += 1
+        return J
+
+    def fit(self, p0, bounds=(-np.inf, np.inf), max_nfev=10000, fixed=None, **kwargs):
+        """
+        Stesso problema che curve_fit passa a least_squares (metodo 'trf'), ma con jacobiano
+        analitico. pcov e' calcolata come in curve_fit (SVD del jacobiano, scalata con il chi2 ridotto),
+        ma con le colonne del jacobiano normalizzate prima della SVD: con f0 ~ 1e9 e tau ~ 1e-8 la soglia
+        di curve_fit (eps * s_max) taglia i valori singolari piccoli e gli errori escono assurdi.
+        fixed: indici dei parametri da tenere fermi al valore di p0 (es. [6] per tau gia' noto);
+        le loro righe e colonne di pcov sono nulle.
+        Gli argomenti extra vanno a least_squares: con f0 ~ 1e9 e tau ~ 1e-8 conviene x_scale='jac',
+        altrimenti xtol ferma il fit dopo pochi passi (come succede con curve_fit).
+        """
+        p0 = np.asarray(p0, dtype=float)
+        free = np.ones(p0.size, dtype=bool)
+        if fixed is not None:
+            free[list(fixed)] = False
+        lower, upper = (np.broadcast_to(np.asarray(b, dtype=float), p0.shape) for b in bounds)
+
+        def full(q):
+            p = p0.copy()
+            p[free] = q
+            return p
+
+        if free.all():
+            fun, jac = self.residuals, self.jacobian
+        else:
+            fun = lambda q: self.residuals(full(q))
+            jac = lambda q, *args: self.jacobian(full(q))[:, free]
+
+        res = optimize.least_squares(fun, p0[free], jac=jac, bounds=(lower[free], upper[free]),
+                                     method='trf', max_nfev=max_nfev, **kwargs)
+        if not res.success:
+            raise RuntimeError("Optimal parameters not found: " + res.message)
+
+        norm = np.linalg.norm(res.jac, axis=0)
+        norm[norm == 0] = 1
+        _, s, VT = np.linalg.svd(res.jac / norm, full_matrices=False)
+        threshold = np.finfo(float).eps * max(res.jac.shape) * s[0]
+        s = s[s > threshold]
+        VT = VT[:s.size]
+        pcov_free = np.dot(VT.T / s**2, VT) / np.outer(norm, norm)
+
+        dof = self.ydata.size - free.sum()
+        if dof > 0:
+            pcov_free = pcov_free * (2 * res.cost / dof)
+        else:
+            pcov_free = np.full_like(pcov_free, np.inf)
+
+        pcov = np.zeros((p0.size, p0.size))
+        pcov[np.ix_(free, free)] = pcov_free
+        return full(res.x), pcov
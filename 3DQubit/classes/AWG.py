@@ -1,11 +1,13 @@
 import numpy as np
-import pyvisa
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from visa_sessions import open_session
 
 class AWG() :
     def __init__(self, ip_address) :
         
-        rm = pyvisa.ResourceManager ()
-        self._AWG = rm.open_resource("TCPIP0::"+ip_address+"::inst0::INSTR")
+        self._AWG = open_session("TCPIP0::"+ip_address+"::inst0::INSTR")
         print('for all function the parameter order is ch, f, amp, phase, off')
     def set_freq(self, ch, f) :
 
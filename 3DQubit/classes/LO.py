@@ -1,5 +1,9 @@
 import serial
 import time
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from visa_sessions import tracer
 
 class LO(serial.Serial):
     """
@@ -15,11 +19,11 @@ class LO(serial.Serial):
     """
 
     
-    debug = True
+    debug = False  # print every command (slow); for timings use visa_sessions.tracer
     debug_prefix = ""
 
     def __init__(self, name):
-        self.__ser = serial.Serial(name)  # open serial port
+        self.__ser = serial.serial_for_url(name)  # open serial port (or a URL, e.g. "loop://", "socket://host:port")
         self.__ser.flushInput() # Clear the input buffer to ensure there are no pending commands
         self.__freq = 0.0
 
@@ -28,16 +32,20 @@ class LO(serial.Serial):
        
         
     def write(self, unterminated_command):
+        start = time.perf_counter()
         command_utf8 = (unterminated_command + "\r\n").encode(encoding="utf-8")
         self.__ser.write(command_utf8)
+        if tracer.enabled: tracer.record(self.__ser.port, "write", unterminated_command, start)
 
         if self.debug: print(f"{self.debug_prefix}[{unterminated_command}]")
         
         
     def query(self, unterminated_command):    
+        start = time.perf_counter()
         command_utf8 = (unterminated_command + "\r\n").encode(encoding="utf-8")
         self.__ser.write(command_utf8)
         string = self.__ser.readline().decode("utf-8").strip()
+        if tracer.enabled: tracer.record(self.__ser.port, "query", unterminated_command, start, string)
 
         if self.debug: print(f"{self.debug_prefix}[{unterminated_command}] {string}")
 
@@ -71,4 +79,104 @@ class LO(serial.Serial):
         self.__freq = f
 
         if int(self.query("FREQ?")) != f_millis: 
-            raise Exception(f"Could not set 'freq' to {f}.")
\ No newline at end of file
+            raise Exception(f"Could not set 'freq' to {f}.")
+
+    # FREQUENCY / POWER SWEEPS
+
+    list_mode_supported = None  # None: not probed yet
+
+    def sweep(self, freqs, powers=None, settle=0.0, on_point=None, verify=True, drain_every=100):
+        """
+        Step the LO through a list of frequencies (Hz), and powers (dBm) if given.
+
+        The commands are pipelined: no sleep and no query per point. With verify=True a
+        FREQ? follows every FREQ command and the answers are read and checked every
+        drain_every points (and at the end), so the points still cost no round trip each
+        and the serial input buffer (a few hundred answers on Windows) never overflows.
+        settle: wait (s) after every point; on_point(i, f) is called after every point
+        (e.g. to take the readout at that frequency). on_point must not talk to the LO:
+        its answers would be mixed with the pending FREQ? answers.
+        Returns dict(points, elapsed, points_per_second).
+        """
+        freqs = list(freqs)
+        if powers is not None and len(powers) != len(freqs):
+            raise ValueError("freqs and powers must have the same length.")
+
+        debug = self.debug
+        self.debug = False  # no print per point
+        start = time.perf_counter()
+        pending = []  # points whose FREQ? answer has not been read yet
+        failed = []
+        try:
+            for i, f in enumerate(freqs):
+                f_millis = int(round(f * 1000))  # mHz
+                command = f"FREQ {f_millis}mlHz"
+                if powers is not None:
+                    command += f"\r\nPOW {powers[i]}dBm"
+                if verify:
+                    command += "\r\nFREQ?"
+                self.write(command)
+                if verify:
+                    pending.append(f)
+                    if len(pending) >= drain_every:
+                        failed += self._check_freq_answers(pending)
+                        pending = []
+                if settle:
+                    time.sleep(settle)
+                if on_point is not None:
+                    on_point(i, f)
+
+            if verify:
+                failed += self._check_freq_answers(pending)
+        finally:
+            self.debug = debug
+        elapsed = time.perf_counter() - start
+
+        if freqs:
+            self.__freq = freqs[-1]
+        if verify and failed:
+            raise Exception(f"Could not set 'freq' to {', '.join(failed)}.")
+
+        stats = dict(points=len(freqs), elapsed=elapsed, points_per_second=len(freqs) / elapsed if elapsed > 0 else float('inf'))
+        if self.debug: print(f"{self.debug_prefix}[sweep] {len(freqs)} points, {stats['points_per_second']:.1f} points/s")
+        return stats
+
+    def _check_freq_answers(self, freqs):
+        """Read one pending FREQ? answer per frequency; returns the points that were not set."""
+        start = time.perf_counter()
+        failed = []
+        for f in freqs:
+            answer = self.__ser.readline().decode("utf-8").strip()
+            if not answer.lstrip("+-").isdigit() or int(answer) != int(round(f * 1000)):
+                failed.append(f"{f} ({answer!r})")
+        if tracer.enabled and freqs: tracer.record(self.__ser.port, "readline", f"FREQ? x{len(freqs)}", start)
+        return failed
+
+    def upload_list(self, freqs, powers=None, dwell=0.001):
+        """
+        Load a frequency (Hz) / power (dBm) list in the SCPI LIST mode of the synthesizer,
+        stepped by the instrument itself every dwell seconds after start_list().
+        Returns False (and remembers it) if the synthesizer does not accept the LIST commands;
+        use sweep() in that case.
+        """
+        if self.list_mode_supported is False:
+            return False
+        self.write("LIST:FREQ " + ",".join(f"{f:.3f}" for f in freqs))
+        if powers is not None:
+            self.write("LIST:POW " + ",".join(f"{p}" for p in powers))
+        self.write(f"LIST:DWEL {dwell}")
+        self.write("FREQ:MODE LIST")
+
+        err = self.query("SYST:ERR?")
+        self.list_mode_supported = err.startswith(("+0", "0"))
+        if not self.list_mode_supported:
+            self.write("FREQ:MODE CW")
+        return self.list_mode_supported
+
+    def start_list(self):
+        """Start the sweep loaded with upload_list"""
+        self.write("INIT")
+
+    def stop_list(self):
+        """Back to a single frequency (CW mode)"""
+        self.write("FREQ:MODE CW")
@@ -1,13 +1,15 @@
-import pyvisa
 import numpy as np
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from visa_sessions import open_session
 
 
 class PSA:
     _name = ""
 
     def __init__(self, ip_address_string):
-        res_manager = pyvisa.ResourceManager()
-        self.__res = res_manager.open_resource(f"tcpip0::{ip_address_string}::INSTR")
+        self.__res = open_session(f"tcpip0::{ip_address_string}::INSTR")
 
         self.__res.write("*CLS") # clear settings
         self._name = self.__res.query("*IDN?")
@@ -1,18 +1,25 @@
+import contextlib
 import numpy as np
 import pyvisa as pyvisa
 import matplotlib.pyplot as plt 
 import time
 import os
 from data import Data
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from visa_sessions import open_session, close_session
 
 class VNA():
     def __init__(self, ip):
         
-        rm = pyvisa.ResourceManager()
-        self.__VNA = rm.open_resource(f"TCPIP0::{ip}::inst0::INSTR")
+        self.__address = f"TCPIP0::{ip}::inst0::INSTR"
+        self.__VNA = open_session(self.__address)
         
         self.__VNA.write("*CLS") # Reset internal status and clear the error queue 
 
+        # Trasferimento binario (FORM REAL,64) di default, ASCII come fallback
+        self.binary_transfer = True
+
         VNA_mode = self.__VNA.write("INST:SEL 'NA'")
         #if VNA_mode[0] != '1': raise Exception("Failed to select NA mode")
         
@@ -23,77 +30,120 @@ class VNA():
         try:
             self.__VNA.clear()  # Pulisce il buffer
         finally:
-            self.__VNA.close()  # Chiude la connessione
+            close_session(self.__address)  # Chiude la connessione (e la toglie dal registro delle sessioni)
 
     def wait_for_opc(self, timeout=300):
         """
-        Metodo generale per attendere il completamento del comando inviato tramite *OPC.
+        Metodo generale per attendere il completamento dei comandi inviati.
+        *OPC? e' bloccante: lo strumento risponde appena le operazioni sono finite,
+        quindi non serve interrogarlo a intervalli.
         
         :param timeout: Tempo massimo (in secondi) da attendere prima di sollevare un TimeoutError.
         """
-        start_time = time.time()
-        while True:
-            status = self.__VNA.query("*OPC?")  # Interroga lo stato del comando *OPC
-            if status.strip() == '1':  # Se la risposta è '1', l'operazione è completata
-                return True
-            if time.time() - start_time > timeout:
-                raise TimeoutError("Timeout: l'operazione non è stata completata.")
-            time.sleep(0.5)  # Pausa prima di verificare di nuovo
+        self._query_timeout("*OPC?", timeout)
+        return True
+
+    def _query_timeout(self, command, timeout):
+        # query con un timeout VISA dedicato (in secondi), poi si torna a quello della sessione
+        old_timeout = self.__VNA.timeout
+        self.__VNA.timeout = int(timeout * 1000)
+        try:
+            return self.__VNA.query(command)
+        except pyvisa.errors.VisaIOError as e:
+            if e.error_code != pyvisa.constants.StatusCode.error_timeout:
+                raise
+            # la risposta arriverebbe in ritardo e sporcherebbe la query successiva
+            self.__VNA.clear()
+            raise TimeoutError("Timeout: l'operazione non è stata completata.") from e
+        finally:
+            self.__VNA.timeout = old_timeout
+
+    def sweep_timeout(self, margin=2.0):
+        """
+        Tempo massimo (s) per uno sweep con tutte le medie: durata di uno sweep
+        (SENS:SWE:TIME?) per il numero di medie, per margin, piu' 10 s.
+        """
+        sweep_time, n_means = self.__VNA.query("SENS:SWE:TIME?;:SENS:AVER:COUN?").split(";")
+        return float(sweep_time) * max(int(float(n_means)), 1) * margin + 10
+
+    def enable_srq(self):
+        """
+        Fa generare allo strumento un Service Request quando finisce un'operazione
+        marcata con *OPC (bit OPC -> ESB dello status byte -> SRQ).
+        """
+        self.__VNA.write("*CLS;*ESE 1;*SRE 32")
+        self.__VNA.enable_event(pyvisa.constants.EventType.service_request, pyvisa.constants.EventMechanism.queue)
+
+    def wait_for_srq(self, timeout=300):
+        """
+        Attende il Service Request dello strumento (vedi enable_srq) senza tenere
+        una query aperta; timeout in secondi.
+        """
+        try:
+            self.__VNA.wait_on_event(pyvisa.constants.EventType.service_request, int(timeout * 1000))
+        except pyvisa.errors.VisaIOError as e:
+            if e.error_code != pyvisa.constants.StatusCode.error_timeout:
+                raise
+            raise TimeoutError("Timeout: l'operazione non è stata completata.") from e
+        self.__VNA.query("*ESR?")  # azzera l'Event Status Register per il prossimo SRQ
+        return True
+
+    def batch(self, **kwargs):
+        """
+        Context per mandare piu' impostazioni con un solo *OPC? (e un SYST:ERR?) alla fine:
+
+            with vna.batch():
+                vna.set_freq_limits(f_min, f_max)
+                vna.set_power(power)
+                vna.set_sweep_points(points)
+
+        Vedi VisaSession.batch per i parametri.
+        """
+        return self.__VNA.batch(**kwargs)
+
+    @contextlib.contextmanager
+    def _setting(self, message):
+        # Impostazione in un batch; il messaggio si stampa solo se il batch e' il piu' esterno:
+        # dentro un altro batch i comandi partono (e vengono controllati) solo alla sua chiusura
+        nested = self.__VNA.in_batch()
+        with self.batch():
+            yield
+        if not nested:
+            print(message)
 
     def wait(self, wait_time):
         time.sleep(wait_time)  # Attende il tempo specificato
 
 
     def set_freq_limits(self, min_freq, max_freq):
-        self.__VNA.write(f'FREQ:STAR {min_freq}')
-        self.__VNA.write(f'FREQ:STOP {max_freq}')
-        self.__VNA.write('*OPC')  # Segna che i comandi sono stati inviati
-
-        if self.wait_for_opc():
-            print("Frequenza minima e massima inserite correttamente.")
+        with self._setting("Frequenza minima e massima inserite correttamente."):
+            self.__VNA.write(f'FREQ:STAR {min_freq}')
+            self.__VNA.write(f'FREQ:STOP {max_freq}')
 
     def set_freq_span(self, center, span):
-        self.__VNA.write(f'FREQ:CENT {center}')
-        self.__VNA.write(f'FREQ:SPAN {span}')
-        self.__VNA.write('*OPC')
-
-        if self.wait_for_opc():
-            print("Frequenza centrale e span impostati correttamente.")
+        with self._setting("Frequenza centrale e span impostati correttamente."):
+            self.__VNA.write(f'FREQ:CENT {center}')
+            self.__VNA.write(f'FREQ:SPAN {span}')
         
     def set_power(self, power_dbm):
-        self.__VNA.write(f'SOUR:POW {power_dbm}')
-        self.__VNA.write('*OPC')
-
-        if self.wait_for_opc():
-            print(f"Potenza impostata correttamente a {power_dbm} dBm.")
+        with self._setting(f"Potenza impostata correttamente a {power_dbm} dBm."):
+            self.__VNA.write(f'SOUR:POW {power_dbm}')
 
     def set_ifband(self, ifband):
-        self.__VNA.write(f'BWID {ifband}')
-        self.__VNA.write('*OPC')
-
-        if self.wait_for_opc():
-            print(f"Larghezza di banda IF impostata correttamente a {ifband} Hz.")
+        with self._setting(f"Larghezza di banda IF impostata correttamente a {ifband} Hz."):
+            self.__VNA.write(f'BWID {ifband}')
 
     def set_sweep_time(self, time):
-        self.__VNA.write(f'SWE:TIME {time}')
-        self.__VNA.write('*OPC')
-
-        if self.wait_for_opc():
-            print(f"Tempo di sweep impostato correttamente a {time} secondi.")
+        with self._setting(f"Tempo di sweep impostato correttamente a {time} secondi."):
+            self.__VNA.write(f'SWE:TIME {time}')
 
     def set_sweep_points(self, sweep_points):
-        self.__VNA.write(f'SWE:POIN {sweep_points}')
-        self.__VNA.write('*OPC')
-
-        if self.wait_for_opc():
-            print(f"Numero di punti di sweep impostato correttamente a {sweep_points}.")
+        with self._setting(f"Numero di punti di sweep impostato correttamente a {sweep_points}."):
+            self.__VNA.write(f'SWE:POIN {sweep_points}')
 
     def set_n_means(self, n_means):
-        self.__VNA.write(f"SENS:AVER:COUN {n_means}")
-        self.__VNA.write('*OPC')
-
-        if self.wait_for_opc():
-            print(f"Numero di medie impostato correttamente a {n_means}.")
+        with self._setting(f"Numero di medie impostato correttamente a {n_means}."):
+            self.__VNA.write(f"SENS:AVER:COUN {n_means}")
     
     def get_IDN(self):
         a = self.__VNA.query("*IDN?")
@@ -103,14 +153,44 @@ class VNA():
         
         self.__VNA.write(f"CALC:PAR:DEF {Sij}")
         
-        #self.__VNA.wait
-        # Dati formattati (Reale, Immaginario)
-        data_str = self.__VNA.query("CALC:DATA:SDATA?")
-        data = np.array(list(map(float, data_str.split(","))))
-        
-        real = np.array(data[0::2])
-        imag = np.array(data[1::2])
+        S = None
+        if self.binary_transfer:
+            try:
+                S = self._get_sdata_binary()
+            except (pyvisa.errors.VisaIOError, ValueError) as e:
+                print(f"Trasferimento binario fallito ({e}), uso ASCII.")
+                self.binary_transfer = False
+
+        if S is None:
+            #self.__VNA.wait
+            # Dati formattati (Reale, Immaginario)
+            data_str = self.__VNA.query("CALC:DATA:SDATA?")
+            data = np.array(list(map(float, data_str.split(","))))
+            S = data[0::2] + 1j * data[1::2]
+
+        real = S.real
+        imag = S.imag
         return real, imag
+
+    def _get_sdata_binary(self):
+        """
+        Legge CALC:DATA:SDATA? in formato REAL,64 (big endian) e restituisce 
+        un array complex128. Il formato viene poi riportato ad ASCII, che e' 
+        quello usato dalle altre query (es. FREQ:DATA?).
+        """
+        self.__VNA.write("FORM:BORD NORM")
+        self.__VNA.write("FORM REAL,64")
+        try:
+            values = self.__VNA.query_binary_values("CALC:DATA:SDATA?", datatype='d', is_big_endian=True, container=np.array)
+        finally:
+            self.__VNA.write("FORM ASC")
+        if len(values) % 2 != 0:
+            raise ValueError(f"SDATA block has an odd number of values ({len(values)})")
+
+        # Le coppie (Re, Im) vengono copiate direttamente nell'array complesso preallocato
+        S = np.empty(len(values) // 2, dtype=np.complex128)
+        S.view(np.float64)[:] = values
+        return S
     
     def get_power(self):
         real, imag = self.get_S_parameters()
@@ -129,20 +209,33 @@ class VNA():
         freq_str = self.__VNA.query("FREQ:DATA?")
         return list(map(float, freq_str.split(",")))
     
-    def perform_single_sweep(self, timeout=300):
+    def perform_single_sweep(self, timeout=None, use_srq=False):
         """
         Disabilita lo sweep continuo, avvia uno sweep singolo 
         e attende il completamento di tutte le medie.
+
+        Con lo sweep continuo spento un solo trigger fa tutte le medie impostate
+        (set_n_means) e poi lo strumento si ferma: il metodo ritorna appena ha finito.
+        timeout in secondi (default: calcolato con sweep_timeout).
+        use_srq: aspetta il Service Request invece di tenere aperta la query *OPC?
+        (richiede un backend VISA che supporti gli eventi, es. NI-VISA).
         """
+        if timeout is None:
+            timeout = self.sweep_timeout()
+
         # 1. Disabilita lo sweep continuo
         self.__VNA.write("INIT:CONT OFF")
         
         # 2. (Opzionale) Resetta il conteggio delle medie per partire da zero
         self.__VNA.write("SENS:AVER:CLE")
         
-        # 3. Avvia lo sweep (Trigger)
-        self.__VNA.write("INIT:IMM")
-        
-        return self.wait_for_opc(timeout=timeout)
+        # 3. Avvia lo sweep (Trigger) e attende la fine di tutte le medie
+        if use_srq:
+            self.enable_srq()
+            self.__VNA.write("INIT:IMM;*OPC")
+            return self.wait_for_srq(timeout=timeout)
+
+        self._query_timeout("INIT:IMM;*OPC?", timeout)
+        return True
 
     
@@ -4,9 +4,13 @@ from scipy.optimize import curve_fit
 from scipy.optimize import least_squares
 import matplotlib.pyplot as plt
 from matplotlib.gridspec import GridSpec
+from concurrent.futures import ProcessPoolExecutor
 from circle_fit import CircleFitter
-import sys
 import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from calibration_cache import CalibrationCache
+from s21_loader import load_s21
 
 ########## SCRIPT 4 LATEX #####
 plt.rcParams.update({
@@ -24,73 +28,83 @@ def S21_notch(f, Ql, abs_Qc, phase_Qc, f0, a, alpha, tau):
     phi = phase_Qc
     return a * np.exp(1j*alpha)*np.exp(-1j* 2*np.pi*tau * f) * (1 - ((Ql/mod_QC) * np.exp(1j *phi))/(1 + 2j *Ql*(f/f0 -1)))
 
-################ MAIN ########################
+################ IMPOSTAZIONI ########################
 
 # Lista delle temperature
 Temps = [
-    "10mK", 
-    "200mK_b", 
-    "300mK_b", 
-    "400mK_b",  
-    "500mK_b", "550mK_b", "600mK_b", "650mK_b", "675mK_b", 
+    "10mK",
+    "200mK_b",
+    "300mK_b",
+    "400mK_b",
+    "500mK_b", "550mK_b", "600mK_b", "650mK_b", "675mK_b",
     "700mK", "725mK", "750mK", "775mK",
     "800mK", "825mK", "850mK", "875mK_b","900mK","925mK_b",
-    "950mK", "975mK", "1000mK", 
+    "950mK", "975mK", "1000mK",
 ]
 
-fitter = CircleFitter()
-
-# Array per conservare i risultati finali
-revQ_val_num = []
-Ql_val_num = []
-Qc_val_num = []
-T_val_num = []
-fr_val = []
-
-# --- Preparazione Grafico globale (Mag vs Freq per tutte le T) ---
-fig_all, ax_all = plt.subplots(figsize=(10, 6))
-ax_all.set_xlabel(r"$f \ [GHz]$", fontsize=14)
-ax_all.set_ylabel(r"$|S_{21}|$", fontsize=14)
-ax_all.set_title("Resonances at different Temperatures", fontsize=16)
-ax_all.grid(True, alpha=0.3)
-
-# Cartelle dove salvare i risultati (create se non esistono)
-os.makedirs("T_dep_results", exist_ok=True)
-# NUOVA CARTELLA PER I PLOT INDIVIDUALI
-os.makedirs("T_dep_results/individual_plots", exist_ok=True) 
-
-# ---------------- Ciclo su tutte le Temperature ----------------
-for t in Temps:
-    print(f"\n{'='*40}")
-    print(f"--- Analyzing Temperature: {t} ---")
-    print(f"{'='*40}")
-    
-    # Rimuovi "mK" dalla stringa per salvare il numero nel file di output
-    new_t = t.replace("_b", "")
-    T_num = float(new_t.replace("mK", ""))
-    
-    # Caricamento del dataset
-    file_path = f"T_dep/2_MKID_resonance_{t}.txt"
-    try:
-        data = np.loadtxt(file_path, delimiter="\t")
-    except FileNotFoundError:
-        print(f"ATTENZIONE: File {file_path} non trovato. Salto questa temperatura...")
-        continue
-
-    frequencies = data[:, 0]  # Frequenze in Hz
-    real_S21 = data[:, 1]     # Parte reale di S21
-    imag_S21 = data[:, 2]     # Parte immaginaria di S21
-
-    signal = np.abs(real_S21 + 1j * imag_S21)
-    phase = np.unwrap(np.angle(real_S21 + 1j * imag_S21))
+# Un pattern per risonatore: {t} viene sostituito con la temperatura
+Resonators = {
+    "2_MKID": "T_dep/2_MKID_resonance_{t}.txt",
+}
+
+# Numero di processi per i fit (None = tutti i core, 1 = seriale nel processo principale).
+# Con T_dep (22 file, ~60 ms di fit per file) i processi non convengono: 1.2-1.4 s in seriale
+# contro 1.45-1.6 s con 4 processi (check_parallel_fits.py). Servono con molti piu' file o risonatori.
+N_WORKERS = 1
+
+# Sweep "caldo": ogni temperatura parte dai parametri del fit precedente invece di rifare
+# _guess_delay, _fit_delay, _fit_lorentz e il fit di fase. Le temperature di un risonatore
+# vanno quindi in sequenza e in parallelo vanno solo i risonatori: con un risonatore solo
+# conviene il default (False), che con N_WORKERS > 1 fitta tutte le temperature in parallelo (run_fits).
+WARM_START = False
+# Delay del cavo fittato una volta sola (primo punto) e tenuto fisso per tutto lo sweep.
+# Con i file di T_dep non conviene: le serie "_b" sono di un altro raffreddamento e il tau cambia.
+SHARED_TAU = False
+# Un fit caldo con residuo relativo > RESIDUAL_FACTOR volte quello del punto precedente
+# (o che fallisce) viene rifatto con i guess da zero
+RESIDUAL_FACTOR = 3.0
+# Scala dei parametri per least_squares nel fit notch: con f0 ~ 1e9 e tau ~ 1e-8, x_scale=1
+# (il default di curve_fit) fa fermare il fit su xtol dopo un passo; 'jac' lo fa convergere
+NOTCH_X_SCALE = 'jac'
+# Cache del delay del cavo (e baseline) per (run, linea, banda), vedi calibration_cache.py:
+# il _fit_delay si fa al primo file di ogni raffreddamento e poi si rilegge da disco.
+# La cache viene letta e scritta solo dal processo principale (resolve_delays), prima di
+# mandare i fit ai worker: cosi' il tau di ogni file non dipende dall'ordine dei processi.
+# None = delay rifittato su ogni file.
+CALIBRATION_DIR = "calibration"
+CALIBRATION_LINE = "MKID"
+
+def calibration_run(t):
+    # le serie "_b" sono di un altro raffreddamento: tau diverso
+    return "T_dep_b" if t.endswith("_b") else "T_dep"
+
+# Tabella finale: una riga per (temperatura, risonatore), ordinata per temperatura
+TABLE_DTYPE = [
+    ("T_mK", float),
+    ("resonator", "U32"),
+    ("label", "U16"),
+    ("f_r", float),
+    ("Ql", float),
+    ("Qc_re", float),
+    ("Qc_im", float),
+    ("Qi_rev", float),
+    ("tau", float),
+    ("fit_ok", bool),
+    ("warm", bool),
+    ("nfev", int),
+]
 
-    S21 = signal * np.exp(1j * phase)
+################ FIT DI UNA TEMPERATURA ########################
 
+def cold_guess(fitter, frequencies, S21, signal, phase, tau=None):
+    """
+    Guess iniziali da zero: delay (se tau non e' dato), cerchio, lorentziana, fase e cerchio canonico.
+    Restituisce Q_r, Q_c (complesso), f_r, a, alpha, tau.
+    """
     # --------- Analisi ed Estrazione dei Parametri ---------
-    TAU = fitter._guess_delay(frequencies, S21)
-    S21_calibrated = fitter._remove_cable_delay(frequencies, S21, TAU)
-    tau_true = fitter._fit_delay(frequencies, S21_calibrated)
-    S21_calibrated = fitter._remove_cable_delay(frequencies, S21_calibrated, tau_true)
+    if tau is None:
+        tau = fitter._calibrated_delay(frequencies, S21)
+    S21_calibrated = fitter._remove_cable_delay(frequencies, S21, tau)
 
     x_c, y_c, r_0 = fitter._fit_from_complex(S21_calibrated)
     S21_centered = fitter._center(S21_calibrated, x_c, y_c)
@@ -110,114 +124,342 @@ for t in Temps:
 
     # Ora eseguiamo il fit della fase in totale sicurezza:
     theta_0, Q_r, f_r = fitter._fit_phase(S21_centered, frequencies, theta_0_guess_safe, Q_r_guess_safe, f_r_guess_safe)
-    beta = (theta_0 + np.pi) 
+    beta = (theta_0 + np.pi)
     P_off = x_c + r_0 * np.cos(beta)  + 1j*(y_c + r_0 * np.sin(beta))
-    a_scaling = abs(P_off)  
-    alpha = np.angle(P_off) 
+    a_scaling = abs(P_off)
+    alpha = np.angle(P_off)
 
-    x_can, y_can, r_0_can = fitter._fit_from_complex(fitter._canonize(frequencies, S21, a_scaling, alpha, TAU + tau_true))
+    x_can, y_can, r_0_can = fitter._fit_from_complex(fitter._canonize(frequencies, S21, a_scaling, alpha, tau))
 
-    Q_c_mag = Q_r * 2 * r_0_can
     phi_0 = -np.arcsin(y_can/r_0_can)
     Q_c = Q_r /(2 * r_0_can * np.exp( -1j * phi_0 ))
-    Q_c_rev = 1/Q_c
-    Q_i_rev = 1/Q_r - Q_c_rev.real
-    Q_i = 1/Q_i_rev
+
+    return Q_r, Q_c, f_r, a_scaling, alpha, tau
+
+
+def fit_temperature(t, resonator, file_path, init_params=None, tau=None, delay=None):
+    """
+    Tutta l'analisi di un file (delay, cerchio, fase, notch) senza effetti collaterali:
+    niente plot, niente variabili globali. Restituisce un dizionario con i risultati e i
+    dati per il plot, oppure None se il file non esiste.
+
+    init_params: parametri notch (Ql, |Qc|, phi, f0, a, alpha, tau) di un fit vicino; se dati,
+                 si salta tutta la catena di guess e si parte direttamente da questi.
+    tau:         delay del cavo gia' noto; se dato non viene rifittato (ne' con _fit_delay
+                 ne' nel fit notch).
+    delay:       delay del cavo dalla calibrazione (resolve_delays): sostituisce _fit_delay
+                 nei guess, ma nel fit notch tau resta libero. La cache di calibrazione qui
+                 si usa solo in lettura (baseline).
+    """
+    # Rimuovi "mK" dalla stringa per salvare il numero nel file di output
+    new_t = t.replace("_b", "")
+    T_num = float(new_t.replace("mK", ""))
+
+    # Caricamento del dataset (freq, Re, Im; dalla seconda volta dalla cache .npy)
+    try:
+        frequencies, S21_file = load_s21(file_path)
+    except FileNotFoundError:
+        return None
+
+    calibration = None
+    if CALIBRATION_DIR is not None:
+        calibration = CalibrationCache(CALIBRATION_DIR, run=calibration_run(t), line=CALIBRATION_LINE)
+    fitter = CircleFitter(calibration=calibration)
+
+    # Se in cache c'e' una baseline per questa banda viene tolta subito
+    S21_raw = fitter._remove_baseline(frequencies, S21_file)
+    signal = np.abs(S21_raw)
+    phase = np.unwrap(np.angle(S21_raw))
+
+    S21 = signal * np.exp(1j * phase)
+
+    if init_params is not None:
+        # --------- Partenza calda dal fit precedente ---------
+        Q_r, abs_Q_c, phase_Q_c, f_r, a_scaling, alpha, tau_guess = init_params
+        Q_c = abs_Q_c * np.exp(1j * phase_Q_c)
+        f_r = max(frequencies.min() + 1, min(f_r, frequencies.max() - 1))
+        if tau is not None:
+            tau_guess = tau
+    else:
+        Q_r, Q_c, f_r, a_scaling, alpha, tau_guess = cold_guess(fitter, frequencies, S21, signal, phase,
+                                                                tau if tau is not None else delay)
 
     # --- Fit complesso ---
     S = signal * np.exp(1j * phase)
-    
-    # Blocco try-except inserito perché a T molto alte la risonanza 
+
+    # Blocco try-except inserito perché a T molto alte la risonanza
     # potrebbe "sparire" e mandare in crash la minimizzazione del fit
     try:
-        params, pcov = fitter._fit_notch(S, frequencies, Q_r, Q_c, f_r, a_scaling, alpha, TAU + tau_true)
+        params, pcov = fitter._fit_notch(S, frequencies, Q_r, Q_c, f_r, a_scaling, alpha, tau_guess, fix_tau=tau is not None, x_scale=NOTCH_X_SCALE)
         Ql_fit, abs_Qc_fit, phase_Qc_fit, f0_fit, a_fit, alpha_fit, tau_fit = params
         S_fit = S21_notch(frequencies, Ql_fit, abs_Qc_fit, phase_Qc_fit, f0_fit, a_fit, alpha_fit, tau_fit)
+        fit_ok = True
+        message = ""
+        nfev = fitter.notch_nfev_
     except Exception as e:
-        print(f"Fit complesso fallito per {t}: {e}\nUso f_r dallo step di fit in fase.")
-        f0_fit = f_r
+        # Si tengono le stime dal fit di fase e dal cerchio
+        Ql_fit, abs_Qc_fit, phase_Qc_fit, f0_fit, tau_fit = Q_r, abs(Q_c), np.angle(Q_c), f_r, tau_guess
+        params = np.array([Q_r, abs(Q_c), np.angle(Q_c), f_r, a_scaling, alpha, tau_guess])
         # Creiamo un S_fit approssimato dai risultati iniziali per permettere comunque il plot
-        S_fit = S21_notch(frequencies, Q_r, abs(Q_c), np.angle(Q_c), f_r, a_scaling, alpha, TAU + tau_true)
-        
-    print(f" -> Trovata f_r = {f0_fit/1e9:.6f} GHz")
-    
+        S_fit = S21_notch(frequencies, Q_r, abs(Q_c), np.angle(Q_c), f_r, a_scaling, alpha, tau_guess)
+        fit_ok = False
+        message = str(e)
+        nfev = 0
+
+    # Residuo relativo, per decidere se un fit caldo va rifatto da zero
+    residual = np.sqrt(np.mean(np.abs(S - S_fit)**2)) / np.median(signal)
+
     # --- Calcolo del Q valore
     Q_c_fit = abs_Qc_fit * np.exp(1j * phase_Qc_fit)
     Q_c_rev = 1/Q_c_fit
     Q_i_rev = 1/Ql_fit - Q_c_rev.real
-    # --- Salvataggio dati ---
-    T_val_num.append(T_num)
-    fr_val.append(f0_fit)
-    revQ_val_num.append(Q_i_rev)
-    Qc_val_num.append(Q_c_fit)
-    
-    # --- Popoliamo il plot GLOBALE ---
-    p = ax_all.plot(frequencies/1e9, abs(S), 'o', ms=4, alpha=0.3, label=f"Data {t}")
-    color = p[0].get_color() # Recuperiamo il colore assegnato da matplotlib
-    ax_all.plot(frequencies/1e9, abs(S_fit), '-', lw=2.5, color=color)
-
-    # =========================================================================
-    # --- NUOVO: CREAZIONE E SALVATAGGIO DEL PLOT INDIVIDUALE PER QUESTA T ---
-    # =========================================================================
-    # Creiamo una figura con 2 subplots (sopra Modulo, sotto Fase)
-    fig_indiv, (ax_mag, ax_phase) = plt.subplots(2, 1, figsize=(8, 8), sharex=True)
-    
-    # Modulo
-    ax_mag.plot(frequencies/1e9, abs(S), 'o', ms=4, alpha=0.5, color='blue', label='Data')
-    ax_mag.plot(frequencies/1e9, abs(S_fit), '-', lw=2, color='red', label='Fit')
-    ax_mag.set_ylabel(r"$|S_{21}|$", fontsize=14)
-    ax_mag.set_title(f"Resonance Fit - Temperature: {t}", fontsize=15)
-    ax_mag.grid(True, alpha=0.3)
-    ax_mag.legend(loc='lower left')
-
-    # Fase
-    ax_phase.plot(frequencies/1e9, np.unwrap(np.angle(S)), 'o', ms=4, alpha=0.5, color='blue')
-    ax_phase.plot(frequencies/1e9, np.unwrap(np.angle(S_fit)), '-', lw=2, color='red')
-    ax_phase.set_ylabel(r"Phase [rad]", fontsize=14)
-    ax_phase.set_xlabel(r"$f \ [GHz]$", fontsize=14)
-    ax_phase.grid(True, alpha=0.3)
-
-    fig_indiv.tight_layout()
-    
-    # Salviamo il file PDF nella nuova cartella
-    indiv_plot_name = f"T_dep_fits/Fit_{t}.pdf"
-    fig_indiv.savefig(indiv_plot_name, bbox_inches="tight")
-    
-    # CHIUDIAMO LA FIGURA: vitale per non esaurire la memoria durante il ciclo!
-    plt.close(fig_indiv)
-    # =========================================================================
-
-# --------- Salvataggio del grafico globale finale ---------
-# Sposta la legenda fuori dal grafico per evitare che copra le curve
-ax_all.legend(bbox_to_anchor=(1.05, 1), loc='upper left', fontsize=9)
-fig_all.tight_layout()
-
-plot_name = "T_dep_results/All_Resonances_Fit.pdf"
-fig_all.savefig(plot_name, bbox_inches="tight")
-print(f"\nGrafico collettivo salvato in '{plot_name}'")
-
-# --------- Salvataggio del .txt (Temperatura vs Frequenza) ---------
-txt_output = "T_dep_results/Resonance_vs_Temperature.txt"
-with open(txt_output, "w") as file_txt:
-    #file_txt.write("T_mK\tf_r_Hz\n")
-    for t_n, fr_n in zip(T_val_num, fr_val):
-        file_txt.write(f"{t_n}\t{fr_n}\n")
-
-print(f"Risultati tabellati salvati in '{txt_output}'\n")
-
-# --------- Salvataggio del .txt (1/Q vs Frequenza) ---------
-txt_output = "T_dep_results/revQ_vs_Temperature.txt"
-with open(txt_output, "w") as file_txt:
-    for t_n, revQ_n in zip(T_val_num, revQ_val_num):
-        file_txt.write(f"{t_n}\t{revQ_n}\n")
-        
-# --------- Salvataggio del .txt (1/Q vs Frequenza) ---------
-txt_output = "T_dep_results/Qc_vs_Temperature.txt"
-with open(txt_output, "w") as file_txt:
-    for t_n, Qc_n in zip(T_val_num, Qc_val_num):
-        file_txt.write(f"{t_n}\t{Qc_n}\n")
-
-print(f"Risultati tabellati salvati in '{txt_output}'\n")
-
-# Mostra il grafico globale finale a schermo
-plt.show()
\ No newline at end of file
+
+    return {
+        "row": (T_num, resonator, t, f0_fit, Ql_fit, Q_c_fit.real, Q_c_fit.imag, Q_i_rev, tau_fit, fit_ok, init_params is not None, nfev),
+        "params": np.asarray(params),
+        "fit_ok": fit_ok,
+        "residual": residual,
+        "message": message,
+        "frequencies": frequencies,
+        "S": S,
+        "S_fit": S_fit,
+    }
+
+
+def resolve_delays(jobs):
+    """
+    Delay del cavo dei (t, risonatore, file) di jobs, nel processo principale e nell'ordine
+    dei jobs: dalla cache di calibrazione se c'e' una voce per la banda, altrimenti fittato
+    sul file (_guess_delay + _fit_delay) e salvato, cosi' i file dopo nella stessa banda lo
+    ritrovano. Restituisce una lista allineata a jobs (None per i file che mancano o senza cache).
+    """
+    delays = []
+    for t, resonator, file_path in jobs:
+        if CALIBRATION_DIR is None:
+            delays.append(None)
+            continue
+        try:
+            frequencies, S21 = load_s21(file_path)
+        except FileNotFoundError:
+            delays.append(None)
+            continue
+        calibration = CalibrationCache(CALIBRATION_DIR, run=calibration_run(t), line=CALIBRATION_LINE)
+        fitter = CircleFitter(calibration=calibration)
+        # stesso S21 su cui cold_guess fitterebbe il delay (baseline tolta, fase srotolata)
+        S21 = fitter._remove_baseline(frequencies, S21)
+        S21 = np.abs(S21) * np.exp(1j * np.unwrap(np.angle(S21)))
+        delays.append(fitter._calibrated_delay(frequencies, S21))
+    return delays
+
+
+def _accepted(r, previous):
+    return r["fit_ok"] and r["residual"] <= RESIDUAL_FACTOR * previous["residual"]
+
+
+def fit_sweep(resonator, pattern, temps, warm_start=WARM_START, shared_tau=SHARED_TAU, delays=None):
+    """
+    Fit in sequenza di tutte le temperature di un risonatore.
+    warm_start: ogni punto parte dai parametri dell'ultimo fit riuscito; se il fit caldo fallisce
+                o ha residuo > RESIDUAL_FACTOR volte il precedente, si rifa' con i guess da zero.
+    shared_tau: il delay del cavo si fitta solo al primo punto e poi resta fisso (niente _fit_delay
+                e tau bloccato nel fit notch); se con quel tau un punto non torna nemmeno da zero,
+                il delay viene rifittato e diventa il nuovo tau condiviso.
+    Senza nessuno dei due equivale a fit_temperature punto per punto.
+    delays:     dict t -> delay del cavo dalla calibrazione (vedi resolve_delays).
+    """
+    delays = delays or {}
+    results = []
+    previous = None
+    tau = None
+    for t in temps:
+        file_path = pattern.format(t=t)
+        r = None
+        if warm_start and previous is not None:
+            r = fit_temperature(t, resonator, file_path, init_params=previous["params"], tau=tau, delay=delays.get(t))
+            if r is not None and not _accepted(r, previous):
+                r = None
+        if r is None:
+            r = fit_temperature(t, resonator, file_path, tau=tau, delay=delays.get(t))
+            if r is not None and tau is not None and not _accepted(r, previous):
+                # anche da zero con il tau condiviso non torna: probabilmente e' cambiato il setup
+                # (altro raffreddamento, cavo...), si rifitta il delay e si riparte da qui
+                r = fit_temperature(t, resonator, file_path, delay=delays.get(t))
+                tau = None
+
+        if r is not None and r["fit_ok"]:
+            previous = r
+            if shared_tau and tau is None:
+                tau = r["params"][6]
+        results.append(r)
+    return results
+
+
+def _fit_job(job):
+    return fit_temperature(*job)
+
+
+def _sweep_job(job):
+    return fit_sweep(*job)
+
+
+def run_fits(jobs, n_workers=N_WORKERS):
+    """
+    Esegue fit_temperature su tutti i (t, risonatore, file) di jobs.
+    Con n_workers=1 gira in seriale, altrimenti su un ProcessPoolExecutor: map restituisce
+    i risultati nello stesso ordine dei jobs e i delay sono risolti prima (resolve_delays),
+    quindi i due percorsi danno lo stesso output.
+    """
+    jobs = [(t, name, file_path, None, None, delay) for (t, name, file_path), delay in zip(jobs, resolve_delays(jobs))]
+    if n_workers == 1:
+        return [_fit_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        return list(pool.map(_fit_job, jobs))
+
+
+def run_sweeps(resonators, temps, n_workers=N_WORKERS, warm_start=WARM_START, shared_tau=SHARED_TAU):
+    """
+    Un fit_sweep per risonatore, in parallelo sui risonatori. Restituisce la lista piatta
+    dei risultati nello stesso ordine di run_fits (risonatore per risonatore, temperature in ordine).
+    """
+    jobs = []
+    for name, pattern in resonators.items():
+        delays = resolve_delays([(t, name, pattern.format(t=t)) for t in temps])
+        jobs.append((name, pattern, temps, warm_start, shared_tau, dict(zip(temps, delays))))
+    if n_workers == 1:
+        sweeps = [_sweep_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            sweeps = list(pool.map(_sweep_job, jobs))
+    return [r for sweep in sweeps for r in sweep]
+
+
+def build_table(results):
+    """Raccoglie le righe valide in un array strutturato ordinato per temperatura (e risonatore)."""
+    rows = [r["row"] for r in results if r is not None]
+    table = np.array(rows, dtype=TABLE_DTYPE)
+    return table[np.argsort(table, order=("T_mK", "resonator"), kind="stable")]
+
+################ PLOT ########################
+
+def plot_results(results):
+    # --- Preparazione Grafico globale (Mag vs Freq per tutte le T) ---
+    fig_all, ax_all = plt.subplots(figsize=(10, 6))
+    ax_all.set_xlabel(r"$f \ [GHz]$", fontsize=14)
+    ax_all.set_ylabel(r"$|S_{21}|$", fontsize=14)
+    ax_all.set_title("Resonances at different Temperatures", fontsize=16)
+    ax_all.grid(True, alpha=0.3)
+
+    for r in results:
+        if r is None:
+            continue
+        t = r["row"][2]
+        frequencies, S, S_fit = r["frequencies"], r["S"], r["S_fit"]
+
+        # --- Popoliamo il plot GLOBALE ---
+        p = ax_all.plot(frequencies/1e9, abs(S), 'o', ms=4, alpha=0.3, label=f"Data {t}")
+        color = p[0].get_color() # Recuperiamo il colore assegnato da matplotlib
+        ax_all.plot(frequencies/1e9, abs(S_fit), '-', lw=2.5, color=color)
+
+        # =========================================================================
+        # --- CREAZIONE E SALVATAGGIO DEL PLOT INDIVIDUALE PER QUESTA T ---
+        # =========================================================================
+        # Creiamo una figura con 2 subplots (sopra Modulo, sotto Fase)
+        fig_indiv, (ax_mag, ax_phase) = plt.subplots(2, 1, figsize=(8, 8), sharex=True)
+
+        # Modulo
+        ax_mag.plot(frequencies/1e9, abs(S), 'o', ms=4, alpha=0.5, color='blue', label='Data')
+        ax_mag.plot(frequencies/1e9, abs(S_fit), '-', lw=2, color='red', label='Fit')
+        ax_mag.set_ylabel(r"$|S_{21}|$", fontsize=14)
+        ax_mag.set_title(f"Resonance Fit - Temperature: {t}", fontsize=15)
+        ax_mag.grid(True, alpha=0.3)
+        ax_mag.legend(loc='lower left')
+
+        # Fase
+        ax_phase.plot(frequencies/1e9, np.unwrap(np.angle(S)), 'o', ms=4, alpha=0.5, color='blue')
+        ax_phase.plot(frequencies/1e9, np.unwrap(np.angle(S_fit)), '-', lw=2, color='red')
+        ax_phase.set_ylabel(r"Phase [rad]", fontsize=14)
+        ax_phase.set_xlabel(r"$f \ [GHz]$", fontsize=14)
+        ax_phase.grid(True, alpha=0.3)
+
+        fig_indiv.tight_layout()
+
+        # Salviamo il file PDF nella cartella dei fit
+        indiv_plot_name = f"T_dep_fits/Fit_{t}.pdf"
+        fig_indiv.savefig(indiv_plot_name, bbox_inches="tight")
+
+        # CHIUDIAMO LA FIGURA: vitale per non esaurire la memoria durante il ciclo!
+        plt.close(fig_indiv)
+        # =========================================================================
+
+    # --------- Salvataggio del grafico globale finale ---------
+    # Sposta la legenda fuori dal grafico per evitare che copra le curve
+    ax_all.legend(bbox_to_anchor=(1.05, 1), loc='upper left', fontsize=9)
+    fig_all.tight_layout()
+
+    plot_name = "T_dep_results/All_Resonances_Fit.pdf"
+    fig_all.savefig(plot_name, bbox_inches="tight")
+    print(f"\nGrafico collettivo salvato in '{plot_name}'")
+
+################ SALVATAGGIO ########################
+
+def save_table(table):
+    # --------- Tabella completa ---------
+    txt_output = "T_dep_results/T_dep_table.txt"
+    np.savetxt(txt_output, table, fmt=["%s"]*len(TABLE_DTYPE), delimiter="\t",
+               header="\t".join(name for name, _ in TABLE_DTYPE))
+    print(f"Tabella completa salvata in '{txt_output}'\n")
+
+    # --------- Salvataggio del .txt (Temperatura vs Frequenza) ---------
+    txt_output = "T_dep_results/Resonance_vs_Temperature.txt"
+    with open(txt_output, "w") as file_txt:
+        #file_txt.write("T_mK\tf_r_Hz\n")
+        for row in table:
+            file_txt.write(f"{row['T_mK']}\t{row['f_r']}\n")
+
+    print(f"Risultati tabellati salvati in '{txt_output}'\n")
+
+    # --------- Salvataggio del .txt (1/Q vs Frequenza) ---------
+    txt_output = "T_dep_results/revQ_vs_Temperature.txt"
+    with open(txt_output, "w") as file_txt:
+        for row in table:
+            file_txt.write(f"{row['T_mK']}\t{row['Qi_rev']}\n")
+
+    # --------- Salvataggio del .txt (1/Q vs Frequenza) ---------
+    txt_output = "T_dep_results/Qc_vs_Temperature.txt"
+    with open(txt_output, "w") as file_txt:
+        for row in table:
+            file_txt.write(f"{row['T_mK']}\t{complex(row['Qc_re'], row['Qc_im'])}\n")
+
+    print(f"Risultati tabellati salvati in '{txt_output}'\n")
+
+################ MAIN ########################
+
+if __name__ == "__main__":
+    # Cartelle dove salvare i risultati (create se non esistono)
+    os.makedirs("T_dep_results", exist_ok=True)
+    os.makedirs("T_dep_fits", exist_ok=True)
+
+    jobs = [(t, name, pattern.format(t=t)) for name, pattern in Resonators.items() for t in Temps]
+
+    # ---------------- Fit di tutte le Temperature (in parallelo se N_WORKERS != 1) ----------------
+    if WARM_START or SHARED_TAU:
+        results = run_sweeps(Resonators, Temps)
+    else:
+        results = run_fits(jobs)
+
+    for (t, name, file_path), r in zip(jobs, results):
+        if r is None:
+            print(f"ATTENZIONE: File {file_path} non trovato. Salto questa temperatura...")
+        elif not r["fit_ok"]:
+            print(f"Fit complesso fallito per {name} {t}: {r['message']}\nUso f_r dallo step di fit in fase.")
+        else:
+            print(f"--- {name} {t}: trovata f_r = {r['row'][3]/1e9:.6f} GHz")
+
+    table = build_table(results)
+    save_table(table)
+
+    # ---------------- Plot (nel processo principale) ----------------
+    plot_results(results)
+
+    # Mostra il grafico globale finale a schermo
+    plt.show()
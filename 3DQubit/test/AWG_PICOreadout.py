@@ -8,8 +8,11 @@ import matplotlib.pyplot as plt
 from picosdk.functions import adc2mV, assert_pico_ok, mV2adc
 import sys
 sys.path.append("../classes")
+sys.path.append("../../common")
 from data import Data
 from AWG import AWG
+from pico_recorder import PicoRecorder
+import time
 
 myAWG = AWG(ip_address="193.206.156.10") # Check IP: Utility > Interface > LAN Setup > IP Address
 myAWG.timeout = 10e3
@@ -108,6 +111,7 @@ assert_pico_ok(status["runBlock"])
 ready = ctypes.c_int16(0)
 while ready.value == 0:
     status["isReady"] = ps.ps5000aIsReady(chandle, ctypes.byref(ready))
+    time.sleep(0.001)
 
 # ---------------------------------------------------------
 #            LETTURA DATI
@@ -128,10 +132,13 @@ time = np.linspace(0, (cmaxSamples.value - 1) * timeIntervalns.value, cmaxSample
 
 file_name = "AWG_gaus_data"
 
-# Salvataggio file
-np.savetxt("../data/"+file_name+".txt", np.column_stack((time, data_mV_A)),
-           header="Time(ns)\tVoltage(mV)-A\tVoltage(mV)-B", fmt="%.6f")
-print("File "+file_name+".txt salvato.")
+# Salvataggio file: conteggi ADC grezzi (int16) + header JSON, si rilegge con PicoRecording
+header = {"channels": ["A"], "range": {"A": chRange}, "offset": {"A": 0}, "maxADC": maxADC.value,
+          "dt": timeIntervalns.value * 1e-9, "timebase": timebase,
+          "trigger": {"channel": "A", "threshold_mV": 50, "direction": "RISING", "delay": 0, "auto_trigger_ms": 1000}}
+with PicoRecorder("../data", file_name, header) as recorder:
+    recorder.write(bufferA_np[:cmaxSamples.value])
+print("File "+file_name+".json salvato.")
 
 # ---------------------------------------------------------
 #            FFT (For A)
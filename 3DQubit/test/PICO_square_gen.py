@@ -6,6 +6,7 @@ import matplotlib.pyplot as plt
 
 from picosdk.ps5000a import ps5000a as ps
 from picosdk.functions import assert_pico_ok, adc2mV, mV2adc
+import time
 
 # ============================================================
 # 1) Caricamento DLL e Parametri
@@ -87,7 +88,9 @@ def main():
         )
         
         ready = ctypes.c_int16(0)
-        while ready.value == 0: ps.ps5000aIsReady(chandle, ctypes.byref(ready))
+        while ready.value == 0:
+            ps.ps5000aIsReady(chandle, ctypes.byref(ready))
+            time.sleep(0.001)
 
         buffer = (ctypes.c_int16 * totalSamples)()
         ps.ps5000aSetDataBuffers(chandle, 0, ctypes.byref(buffer), None, totalSamples, 0, 0)
@@ -33,13 +33,14 @@ try:
     print("VNA ID:")
     vna.get_IDN()
 
-    # 2. Configurazione della Misura
-    #vna.set_freq_span(f_central, f_span)
-    vna.set_freq_limits(f_min,f_max)
-    vna.set_sweep_points(n_points)
-    vna.set_n_means(n_means)
-    vna.set_ifband(ifband)
-    vna.set_power(power)
+    # 2. Configurazione della Misura (un solo *OPC? per tutte le impostazioni)
+    with vna.batch():
+        #vna.set_freq_span(f_central, f_span)
+        vna.set_freq_limits(f_min,f_max)
+        vna.set_sweep_points(n_points)
+        vna.set_n_means(n_means)
+        vna.set_ifband(ifband)
+        vna.set_power(power)
 
     freq = np.array(vna.get_freq())
     powe = vna.get_dbm()
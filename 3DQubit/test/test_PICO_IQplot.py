@@ -7,6 +7,11 @@ import numpy as np
 from picosdk.ps5000a import ps5000a as ps
 import matplotlib.pyplot as plt
 from picosdk.functions import adc2mV, assert_pico_ok, mV2adc
+import sys
+sys.path.append("../classes")
+sys.path.append("../../common")
+from pico_recorder import PicoRecorder
+import time
 
 # ---------------------------------------------------------
 #            APERTURA STRUMENTO
@@ -124,6 +129,7 @@ assert_pico_ok(status["runBlock"])
 ready = ctypes.c_int16(0)
 while ready.value == 0:
     status["isReady"] = ps.ps5000aIsReady(chandle, ctypes.byref(ready))
+    time.sleep(0.001)
 
 # ---------------------------------------------------------
 #            LETTURA DATI
@@ -147,10 +153,13 @@ bufferB_np = np.array(bufferB, dtype=np.int16)
 data_mV_B = adc2mV(bufferB_np, chRange, maxADC)
 time = np.linspace(0, (cmaxSamples.value - 1) * timeIntervalns.value, cmaxSamples.value)
 
-# Salvataggio file
-np.savetxt("../data/pico_data.txt", np.column_stack((time, data_mV_A, data_mV_B)),
-           header="Time(ns)\tVoltage(mV)-A\tVoltage(mV)-B", fmt="%.6f")
-print("File acquisizione.txt salvato.")
+# Salvataggio file: conteggi ADC grezzi (int16) + header JSON, si rilegge con PicoRecording
+header = {"channels": ["A", "B"], "range": {"A": chRange, "B": chRange}, "offset": {"A": 0, "B": 0},
+          "maxADC": maxADC.value, "dt": timeIntervalns.value * 1e-9, "timebase": timebase,
+          "trigger": {"channel": "B", "threshold_mV": 50, "direction": "RISING", "delay": 0, "auto_trigger_ms": 1000}}
+with PicoRecorder("../data", "pico_data", header) as recorder:
+    recorder.write({"A": bufferA_np[:cmaxSamples.value], "B": bufferB_np[:cmaxSamples.value]})
+print("File pico_data.json salvato.")
 
 # ---------------------------------------------------------
 #            FFT (For A)
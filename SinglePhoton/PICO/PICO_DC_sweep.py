@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Curva VFD vs VDC con PicoScope.sweep: stessa misura di PICO_DC_gen_delay.py, ma il buffer
+dell'AWG viene riusato e il passo successivo si assesta mentre si calcolano media e std
+del precedente (circa settle + acquisizione per punto).
+"""
+import numpy as np
+import matplotlib.pyplot as plt
+
+from picosdk.ps5000a import ps5000a as ps
+from pico_class import PicoScope
+
+# ============================================================
+# PARAMETRI DC
+# ============================================================
+TARGET_VOLTAGE_V_START = -1.310      # In Volt
+TARGET_VOLTAGE_V_END = -1.40        # In Volt
+VOLTAGE_STEP = -0.001               # Passo in Volt
+WAVEFORM_SAMPLES = 10000           # Buffer AWG
+CAPTURE_SAMPLES = 2000             # Campioni acquisizione
+SAMPLE_RATE = 2e5                   # Hz (calculate_timebase -> 5000, come TIMEBASE negli altri script)
+SETTLE_S = 1.0                      # Attesa dopo ogni passo
+OUTPUT_FILE = "dati_sweep_DC.npy"
+# ============================================================
+
+def main():
+    scope = PicoScope("PicoScope_DC_sweep")
+    scope.resolution = ps.PS5000A_DEVICE_RESOLUTION["PS5000A_DR_16BIT"]
+    scope.initialize()
+
+    try:
+        scope.set_channel('A', True, 'DC', '5V', 0)
+
+        vdc_values = np.arange(TARGET_VOLTAGE_V_START, TARGET_VOLTAGE_V_END - 0.001, VOLTAGE_STEP)
+
+        def show(k, row):
+            print(f"VDC = {row['value']:.3f} V | Media : {row['mean_A']/1000:.5f} V | Std Dev : {row['std_A']/1000:.5f} V")
+
+        results = scope.sweep(
+            vdc_values, SAMPLE_RATE, CAPTURE_SAMPLES,
+            set_point=lambda v: scope.set_awg_dc(v, WAVEFORM_SAMPLES),
+            settle=SETTLE_S,
+            on_step=show
+        )
+        np.save(OUTPUT_FILE, results)
+        print(f"Risultati salvati in {OUTPUT_FILE}")
+        if results['overflow'].any():
+            print(f"Overflow in {np.count_nonzero(results['overflow'])} passi")
+
+        # ----------------------------------------------------
+        # Plot
+        # ----------------------------------------------------
+        plt.figure(figsize=(8,4))
+        plt.errorbar(
+            results['value']/2,
+            results['mean_A']/1000,
+            yerr=results['std_A']/1000,
+            fmt='o-',
+            ecolor='r',
+            capsize=3,
+            markersize=4,
+            label='Media ± std'
+        )
+        plt.xlabel("VDC (V)")
+        plt.ylabel("VFD (V)")
+        plt.title("Risposta Canale A vs VDC")
+        plt.grid(True)
+        plt.legend()
+        plt.tight_layout()
+        plt.show()
+
+    finally:
+        scope.kill()
+        print("PicoScope chiuso.")
+
+if __name__ == "__main__":
+    main()
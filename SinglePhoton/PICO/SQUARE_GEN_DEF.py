@@ -6,6 +6,7 @@ import matplotlib.pyplot as plt
 
 from picosdk.ps5000a import ps5000a as ps
 from picosdk.functions import assert_pico_ok, adc2mV, mV2adc
+import time
 
 # ============================================================
 # 1) Caricamento DLL
@@ -176,6 +177,7 @@ def main():
         ready = ctypes.c_int16(0)
         while ready.value == 0:
             status["isReady"] = ps.ps5000aIsReady(chandle, ctypes.byref(ready))
+            time.sleep(0.001)
 
         # Recupero Dati
         bufferMax = (ctypes.c_int16 * totalSamples)()
@@ -2,7 +2,7 @@ import ctypes
 import numpy as np
 from picosdk.ps5000a import ps5000a as ps
 import matplotlib.pyplot as plt
-from picosdk.functions import adc2mV, mV2adc, assert_pico_ok
+from picosdk.functions import mV2adc, assert_pico_ok
 import time
 import sys
 import os
@@ -11,6 +11,7 @@ sys.path.append(r"C:\Users\kid\labQT\Lab2025\Single photon")
 
 from QTLab2526.SinglePhoton.PICO.instruments import Instrument
 import threading
+import asyncio
 import json
 import atexit
 
@@ -36,6 +37,47 @@ class PicoScope(Instrument):
         # Set up channel information storage
         self.channel_info = {}
         
+        # Status codes returned by the driver calls
+        self.status = {}
+        
+        # Persistent block buffers and cached conversion data (see acq_block)
+        self._block_config = None
+        self._block_counts = {}
+        self._block_mV = {}
+        self._time_key = None
+        self._time_cache = None
+        self._max_adc = None
+        
+        # Block completion, signalled by the driver BlockReady callback (see start_block)
+        self._block_ready = threading.Event()
+        self._block_status = None
+        self._block_ready_callback = ps.BlockReadyType(self._on_block_ready)
+        self._pending_block = None
+        
+        # Driver strings of PicoStrings.json (see get_command_value)
+        self._commands = None
+        
+        # Signal generator buffer, reused by set_awg_dc
+        self._awg_buffer = None
+        self._awg_phase = None
+        
+        # Trigger settings (see set_trigger)
+        self.trigger_info = None
+        
+        # Streaming state (see acq_streaming); empty until the first stream, so that iter_frames
+        # and streaming_stats can be called at any time
+        self._streaming_thread = None
+        self._ring = None
+        self._ring_size = 0
+        self._stream_channels = []
+        self._stream_sample_rate = None
+        self._stream_lock = threading.Condition()
+        self._stream_written = 0
+        self._stream_read = 0
+        self._stream_dropped = 0
+        self._stream_overflow = {}
+        self._stream_next_index = 0
+        
         # Register the kill method to be called at exit
         atexit.register(self.kill)
 
@@ -64,7 +106,7 @@ class PicoScope(Instrument):
         except KeyError:
             raise ValueError(f"Invalid range: {range}. Check the available ranges on the json file.")
         
-        self.status[status_key] = ps.ps5000SetChannel(self.chandle,
+        self.status[status_key] = ps.ps5000aSetChannel(self.chandle,
                                                     ps.PS5000A_CHANNEL[f'PS5000A_CHANNEL_{channel}'],
                                                     enabled,
                                                     ps.PS5000A_COUPLING['PS5000A_DC' if coupling == 'DC' else 'PS5000A_AC'],
@@ -74,11 +116,50 @@ class PicoScope(Instrument):
 
         # Store the channel information
         self.channel_info[channel] = {'enabled': enabled, 'coupling': coupling, 'range': range_value, 'offset': offset}
+        
+        # The block buffers are registered again at the next acq_block
+        self._block_config = None
 
-    def acq_block(self, sample_rate: float, post_trigger_samples: int, pre_trigger_samples: int = 0, memory_segment_index: int = 0, time_out: int = 3000):
+    def set_trigger(self, channel: str, threshold_mV: float, direction: str = 'RISING', delay: int = 0, auto_trigger_ms: int = 1000):
+        """
+        Set a simple edge trigger on a channel.
+        
+        Parameters
+        ----------
+        channel : str
+            Channel identifier ('A', 'B', 'C', 'D'), must be already configured with set_channel
+        threshold_mV : float
+            Trigger threshold in mV
+        direction : str, optional
+            'RISING', 'FALLING', 'ABOVE', 'BELOW' or 'RISING_OR_FALLING' (default: 'RISING')
+        delay : int, optional
+            Delay between the trigger event and the start of the block, in samples (default: 0)
+        auto_trigger_ms : int, optional
+            Time after which the scope triggers anyway, 0 to wait forever (default: 1000)
+        """
+        threshold = int(mV2adc(threshold_mV, self.channel_info[channel]['range'], ctypes.c_int16(self.max_adc())))
+        self.status["trigger"] = ps.ps5000aSetSimpleTrigger(self.chandle,
+                                                            1,
+                                                            ps.PS5000A_CHANNEL[f'PS5000A_CHANNEL_{channel}'],
+                                                            threshold,
+                                                            ps.PS5000A_THRESHOLD_DIRECTION[f'PS5000A_{direction}'],
+                                                            delay,
+                                                            auto_trigger_ms)
+        assert_pico_ok(self.status["trigger"])
+        
+        # Store the trigger information (saved in the recording headers)
+        self.trigger_info = {'channel': channel, 'threshold_mV': threshold_mV, 'direction': direction,
+                             'delay': delay, 'auto_trigger_ms': auto_trigger_ms}
+
+    def acq_block(self, sample_rate: float, post_trigger_samples: int, pre_trigger_samples: int = 0, memory_segment_index: int = 0, time_out: int = 3000, recorder=None, reuse_output: bool = False):
         """
         Acquire a block of data from the oscilloscope.
         
+        Equivalent to start_block, wait_ready and get_block: the wait is on the driver
+        BlockReady callback, so the calling thread sleeps during the capture.
+        The driver buffers are NumPy arrays registered once per configuration (enabled channels,
+        number of samples, segment) and reused by the following calls with the same configuration.
+        
         Parameters
         ----------
         sample_rate : float
@@ -91,17 +172,56 @@ class PicoScope(Instrument):
             The index of the memory segment to use (default: 0)
         time_out : int, optional
             The timeout in milliseconds (default: 3000)
+        recorder : PicoRecorder, optional
+            If given, the raw ADC counts are also queued to this recorder (default: None)
+        reuse_output : bool, optional
+            Convert in place into float32 arrays owned by the scope instead of new arrays
+            (default: False); they are overwritten by the next call with the same configuration
             
         Returns
         -------
         dict
-            Dictionary containing the acquired data (in mV) for each channel and the time data
+            Dictionary containing the acquired data (in mV, float32) for each channel and the time data
+            (cached and read-only)
             
         Raises
         ------
         TimeoutError
             If the acquisition times out
         """
+        self.start_block(sample_rate, post_trigger_samples, pre_trigger_samples, memory_segment_index)
+        self.wait_ready(time_out)
+        return self.get_block(recorder=recorder, reuse_output=reuse_output)
+
+    async def acq_block_async(self, sample_rate: float, post_trigger_samples: int, pre_trigger_samples: int = 0, memory_segment_index: int = 0, time_out: int = 3000, recorder=None, reuse_output: bool = False):
+        """
+        Awaitable version of acq_block: the event loop keeps running other tasks during the capture.
+        Same parameters and return value as acq_block.
+        """
+        self.start_block(sample_rate, post_trigger_samples, pre_trigger_samples, memory_segment_index)
+        await asyncio.to_thread(self.wait_ready, time_out)
+        return self.get_block(recorder=recorder, reuse_output=reuse_output)
+
+    def start_block(self, sample_rate: float, post_trigger_samples: int, pre_trigger_samples: int = 0, memory_segment_index: int = 0) -> threading.Event:
+        """
+        Arm the oscilloscope for a block and return without waiting for the trigger.
+        
+        Parameters
+        ----------
+        sample_rate : float
+            The desired sampling rate in Hz
+        post_trigger_samples : int
+            The number of samples to acquire after the trigger event
+        pre_trigger_samples : int, optional
+            The number of samples to acquire before the trigger event (default: 0)
+        memory_segment_index : int, optional
+            The index of the memory segment to use (default: 0)
+            
+        Returns
+        -------
+        threading.Event
+            Set by the driver when the block is ready; then call get_block (or wait_ready first)
+        """
         no_of_samples = pre_trigger_samples + post_trigger_samples
         if no_of_samples == 0:
             raise Warning("No samples to acquire. Set pre_trigger_samples or post_trigger_samples. 100 samples will be acquired.")
@@ -110,147 +230,428 @@ class PicoScope(Instrument):
         # Get timebase for the given sample rate
         timebase = self.calculate_timebase(sample_rate)
         
+        self._pending_block = (sample_rate, no_of_samples, memory_segment_index)
+        return self._run_block(pre_trigger_samples, post_trigger_samples, timebase, memory_segment_index)
+
+    def _run_block(self, pre_trigger_samples: int, post_trigger_samples: int, timebase: int, memory_segment_index: int) -> threading.Event:
+        """
+        RunBlock with the BlockReady callback: the returned event is set when the capture is complete.
+        """
+        self._block_ready.clear()
+        self._block_status = None
+        
         # Hanldlers for returned values
         timeIndisposedMs = ctypes.c_int32()
-        pParameter = ctypes.c_void_p()
         
         # Run the block acquisition
-        self.status["runBlock"] = ps.ps5000RunBlock(
+        self.status["runBlock"] = ps.ps5000aRunBlock(
             self.chandle,
             pre_trigger_samples,
             post_trigger_samples,
             timebase,
             ctypes.byref(timeIndisposedMs),
             memory_segment_index,
-            None,
-            ctypes.byref(pParameter)
+            self._block_ready_callback,
+            None
         )
         assert_pico_ok(self.status["runBlock"])
+        return self._block_ready
+
+    def _on_block_ready(self, handle, status, pParameter):
+        # Called from a driver thread when the block (or all the rapid block segments) is ready
+        self._block_status = status
+        self._block_ready.set()
+
+    def wait_ready(self, time_out: int = 3000):
+        """
+        Wait (without polling) for the block started by start_block or acq_rapid_block.
         
-        # Check for data collection to finish using ps5000IsReady
-        ready = ctypes.c_int16(0)
-        check = ctypes.c_int16(0)
-        start_time = time.time() # Set a timeout for the acquisition
-        while ready.value == check.value:
-            self.status["isReady"] = ps.ps5000IsReady(self.chandle, ctypes.byref(ready))
-            if time.time() - start_time > time_out / 1000:  # Convert milliseconds to seconds
-                raise TimeoutError("Block acquisition timed out.")
-               
-        assert_pico_ok(self.status["isReady"])
-        
-        # Calculate the number of samples to be collected
-        buffers = {}
-        for ch in self.channel_info.keys():
-            if self.channel_info[ch]['enabled']:
-                buffers[ch] = {'Max': (ctypes.c_int16 * no_of_samples)(), 'Min': (ctypes.c_int16 * no_of_samples)()}
+        Parameters
+        ----------
+        time_out : int, optional
+            The timeout in milliseconds (default: 3000)
             
-        # Set data buffer location for data collection from active channels
+        Raises
+        ------
+        TimeoutError
+            If the acquisition times out; the capture is stopped
+        """
+        if not self._block_ready.wait(time_out / 1000):  # Convert milliseconds to seconds
+            self.status["stop"] = ps.ps5000aStop(self.chandle)
+            raise TimeoutError("Block acquisition timed out.")
+        self.status["blockReady"] = self._block_status
+        assert_pico_ok(self.status["blockReady"])
+
+    def get_block(self, recorder=None, reuse_output: bool = False) -> dict:
+        """
+        Read the block armed by start_block, once it is ready. Parameters and return value as in acq_block.
+        """
+        sample_rate = self._pending_block[0]
+        buffers, n, overflow = self._read_block()
+        if overflow != 0:
+            print(f"Overflow occurred: {overflow} samples lost.")
+        
+        if recorder is not None:
+            recorder.write({ch: buffers[ch][:n] for ch in buffers.keys()})
+        
+        # convert ADC counts data to mV
+        data = {}
         for ch in buffers.keys():
+            out = self._block_mV[ch][:n] if reuse_output else None
+            data[ch] = self.adc_to_mV(ch, buffers[ch][:n], out=out)
+
+        # Time data, computed once for each (samples, timebase)
+        data['time'] = self._time_axis(n, self.calculate_timebase(sample_rate))
+        
+        return data
+
+    def _read_block(self):
+        """
+        GetValues of the block armed by start_block into the persistent buffers.
+        Returns the buffers (channel -> int16 array), the number of samples read and the overflow flags.
+        """
+        sample_rate, no_of_samples, memory_segment_index = self._pending_block
+        
+        # Register the data buffers only when the configuration changes
+        buffers = self._block_buffers(no_of_samples, memory_segment_index)
+        
+        overflow = ctypes.c_int16()
+        cmaxSamples = ctypes.c_uint32(no_of_samples)
+        
+        self.status["getValues"] = ps.ps5000aGetValues(self.chandle, 0, ctypes.byref(cmaxSamples), 1, 0, memory_segment_index, ctypes.byref(overflow))
+        assert_pico_ok(self.status["getValues"])
+        if overflow.value != 0:
+            self.status["overflow"] = overflow.value
+        return buffers, cmaxSamples.value, overflow.value
+
+    def _block_buffers(self, no_of_samples: int, memory_segment_index: int) -> dict:
+        """
+        Return the int16 block buffers of the enabled channels, registering new ones with the driver
+        only if the configuration differs from the last registered one.
+        """
+        channels = tuple(ch for ch, info in self.channel_info.items() if info['enabled'])
+        config = (channels, no_of_samples, memory_segment_index)
+        if config == self._block_config:
+            return self._block_counts
+        
+        self._block_counts = {ch: np.zeros(no_of_samples, dtype=np.int16) for ch in channels}
+        self._block_mV = {ch: np.zeros(no_of_samples, dtype=np.float32) for ch in channels}
+        for ch in channels:
             source = ps.PS5000A_CHANNEL[f"PS5000A_CHANNEL_{ch}"]
-            status_key = f"setDataBuffers{ch}"
-            self.status[status_key] = ps.ps5000SetDataBuffers(
+            status_key = f"setDataBuffer{ch}"
+            # Only the max buffer: without downsampling the min buffer is never filled
+            self.status[status_key] = ps.ps5000aSetDataBuffer(
                 self.chandle,
                 source,
-                ctypes.byref(buffers[ch]['Max']),
-                ctypes.byref(buffers[ch]['Min']),
+                self._block_counts[ch].ctypes.data_as(ctypes.POINTER(ctypes.c_int16)),
                 no_of_samples,
                 memory_segment_index,
-                0  # No downsampling for block mode
+                ps.PS5000A_RATIO_MODE['PS5000A_RATIO_MODE_NONE']
             )
             assert_pico_ok(self.status[status_key])
+        self._block_config = config
+        return self._block_counts
+
+    def _time_axis(self, no_of_samples: int, timebase: int) -> np.ndarray:
+        """
+        Time axis in seconds of a block, cached for the last (samples, timebase) pair.
+        The sample interval is the one the driver reports for the timebase (as the 'dt' of
+        recording_header), not 1 / sample_rate.
+        """
+        key = (no_of_samples, timebase)
+        if self._time_key != key:
+            self._time_cache = np.arange(no_of_samples) * self.timebase_interval(timebase, no_of_samples)
+            self._time_cache.flags.writeable = False
+            self._time_key = key
+        return self._time_cache
+
+    def max_adc(self) -> int:
+        """
+        Maximum ADC count for the current resolution (read from the driver once).
+        """
+        if self._max_adc is None:
+            maxADC = ctypes.c_int16()
+            self.status["maximumValue"] = ps.ps5000aMaximumValue(self.chandle, ctypes.byref(maxADC))
+            assert_pico_ok(self.status["maximumValue"])
+            self._max_adc = maxADC.value
+        return self._max_adc
+
+    def adc_to_mV(self, channel: str, counts: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """
+        Convert ADC counts of a channel to mV with a single float32 scale.
         
-        overflow = ctypes.c_int16()
-        cmaxSamples = ctypes.c_int32(no_of_samples)
+        Parameters
+        ----------
+        channel : str
+            Channel identifier, for its voltage range
+        counts : np.ndarray
+            ADC counts (any shape, e.g. the (n_captures, n_samples) arrays of acq_rapid_block)
+        out : np.ndarray, optional
+            float32 array of the same shape to write the result into (default: a new array)
+        """
+        scale = np.float32(ps.PICO_VOLTAGE_RANGE[self.channel_info[channel]['range']] * 1000 / self.max_adc())
+        return np.multiply(counts, scale, out=out, dtype=np.float32)
+
+    def acq_rapid_block(self, n_captures: int, sample_rate: float, post_trigger_samples: int, pre_trigger_samples: int = 0, time_out: int = 3000, recorder=None):
+        """
+        Acquire n_captures triggered blocks in rapid block mode (segmented memory).
         
-        self.status["getValues"] = ps.ps5000GetValues(self.chandle, 0, ctypes.byref(cmaxSamples), 1, 0, memory_segment_index, ctypes.byref(overflow))
-        assert_pico_ok(self.status["getValues"])
-        if overflow.value != 0:
-            print(f"Overflow occurred: {overflow.value} samples lost.")
-            self.status["overflow"] = overflow.value
+        The memory is split in n_captures segments and armed once: the scope re-arms in
+        hardware after each trigger, so the dead time between shots is the re-arm time
+        instead of a full RunBlock/IsReady/GetValues round trip from Python.
+        All segments are read back with a single GetValuesBulk call.
         
-        # convert ADC counts data to mV
-        maxADC = ctypes.c_int16()
-        self.status["maximumValue"] = ps.ps5000MaximumValue(self.chandle, ctypes.byref(maxADC))
-        assert_pico_ok(self.status["maximumValue"])
+        Parameters
+        ----------
+        n_captures : int
+            Number of triggered captures (memory segments)
+        sample_rate : float
+            The desired sampling rate in Hz
+        post_trigger_samples : int
+            The number of samples to acquire after each trigger event
+        pre_trigger_samples : int, optional
+            The number of samples to acquire before each trigger event (default: 0)
+        time_out : int, optional
+            The timeout in milliseconds for the whole set of captures (default: 3000)
+        recorder : PicoRecorder, optional
+            If given, the captures are also queued to this recorder, one after the other (default: None)
+            
+        Returns
+        -------
+        dict
+            For each enabled channel an int16 array of ADC counts (see adc_to_mV) with shape
+            (n_captures, n_samples), plus 'trigger_offset' (s, one per capture),
+            'overflow' (channel overflow bit flags, one per capture), 'maxADC'
+            and 'time' (s, relative to the first sample)
+            
+        Raises
+        ------
+        ValueError
+            If a segment is too small for the requested number of samples
+        TimeoutError
+            If the acquisition times out
+        """
+        no_of_samples = pre_trigger_samples + post_trigger_samples
+        if no_of_samples == 0:
+            raise ValueError("No samples to acquire. Set pre_trigger_samples or post_trigger_samples.")
         
-        data = {}
-        for ch in buffers.keys():
-            data[ch] =  adc2mV(buffers[ch]['Max'], self.channel_info[ch]['range'], maxADC)
-
-        # Create time data
-        data['time'] = np.linspace(0, (cmaxSamples.value - 1) / sample_rate, cmaxSamples.value)
+        timebase = self.calculate_timebase(sample_rate)
+        
+        # The segment buffers below replace the ones registered by acq_block
+        self._block_config = None
+        
+        # Split the memory in n_captures segments and capture one block per segment
+        max_segment_samples = ctypes.c_int32()
+        self.status["memorySegments"] = ps.ps5000aMemorySegments(self.chandle, n_captures, ctypes.byref(max_segment_samples))
+        assert_pico_ok(self.status["memorySegments"])
+        # From here on the scope is segmented: always go back to a single segment (even after a
+        # timeout or a driver error), otherwise every later acq_block waits for n_captures triggers
+        try:
+            if no_of_samples > max_segment_samples.value:
+                raise ValueError(f"{no_of_samples} samples do not fit in a segment: {n_captures} segments hold at most {max_segment_samples.value} samples each.")
+        
+            self.status["setNoOfCaptures"] = ps.ps5000aSetNoOfCaptures(self.chandle, n_captures)
+            assert_pico_ok(self.status["setNoOfCaptures"])
+        
+            # Arm all the segments at once: the callback fires when the last one is captured
+            self._run_block(pre_trigger_samples, post_trigger_samples, timebase, 0)
+            self.wait_ready(time_out)
+        
+            # One preallocated (n_captures, n_samples) array per channel: segment i goes in row i
+            data = {}
+            for ch, info in self.channel_info.items():
+                if not info['enabled']:
+                    continue
+                data[ch] = np.empty((n_captures, no_of_samples), dtype=np.int16)
+                source = ps.PS5000A_CHANNEL[f"PS5000A_CHANNEL_{ch}"]
+                for segment in range(n_captures):
+                    self.status[f"setDataBuffer{ch}"] = ps.ps5000aSetDataBuffer(
+                        self.chandle,
+                        source,
+                        data[ch][segment].ctypes.data_as(ctypes.POINTER(ctypes.c_int16)),
+                        no_of_samples,
+                        segment,
+                        ps.PS5000A_RATIO_MODE['PS5000A_RATIO_MODE_NONE']
+                    )
+                    assert_pico_ok(self.status[f"setDataBuffer{ch}"])
+        
+            overflow = np.zeros(n_captures, dtype=np.int16)
+            cmaxSamples = ctypes.c_uint32(no_of_samples)
+            self.status["getValuesBulk"] = ps.ps5000aGetValuesBulk(
+                self.chandle,
+                ctypes.byref(cmaxSamples),
+                0,
+                n_captures - 1,
+                1,
+                ps.PS5000A_RATIO_MODE['PS5000A_RATIO_MODE_NONE'],
+                overflow.ctypes.data_as(ctypes.POINTER(ctypes.c_int16))
+            )
+            assert_pico_ok(self.status["getValuesBulk"])
+            if overflow.any():
+                print(f"Overflow occurred in {np.count_nonzero(overflow)} of {n_captures} captures.")
+        
+            # Trigger time offset of each segment (time between trigger and sample), in seconds
+            offsets = np.zeros(n_captures, dtype=np.int64)
+            units = np.zeros(n_captures, dtype=np.int32)
+            self.status["getTriggerTimeOffsetBulk"] = ps.ps5000aGetValuesTriggerTimeOffsetBulk64(
+                self.chandle,
+                offsets.ctypes.data_as(ctypes.POINTER(ctypes.c_int64)),
+                units.ctypes.data_as(ctypes.POINTER(ctypes.c_int32)),
+                0,
+                n_captures - 1
+            )
+            assert_pico_ok(self.status["getTriggerTimeOffsetBulk"])
+            # PS5000A_TIME_UNITS: 0 = fs, 1 = ps, ..., 5 = s
+            data['trigger_offset'] = offsets * 10.0 ** (3 * units - 15)
+            if recorder is not None:
+                # Captures one after the other: header['record_samples'] splits them back
+                recorder.write({ch: data[ch].reshape(-1) for ch in recorder.channels})
+            data['overflow'] = overflow
+        
+            data['maxADC'] = self.max_adc()
+        
+            data['time'] = self._time_axis(cmaxSamples.value, timebase)
+        finally:
+            self.status["setNoOfCaptures"] = ps.ps5000aSetNoOfCaptures(self.chandle, 1)
+            assert_pico_ok(self.status["setNoOfCaptures"])
+            self.status["memorySegments"] = ps.ps5000aMemorySegments(self.chandle, 1, ctypes.byref(max_segment_samples))
+            assert_pico_ok(self.status["memorySegments"])
         
         return data
 
-    def acq_streaming(self, sample_rate: float = 4e6, buffer_size: int = 500):
+    def acq_streaming(self, sample_rate: float = 4e6, buffer_size: int = None, ring_size: int = 2**22, memmap_path: str = None, poll_interval: float = 0.01, recorder=None):
         """
-        Start streaming data acquisition continuously.
+        Start streaming data acquisition continuously on all the enabled channels.
+        
+        The driver copies new samples into one overview buffer per channel; every poll_interval
+        the streaming thread moves them into a fixed-size ring buffer (no allocation per chunk).
+        Samples that are overwritten before being read by iter_frames are counted as dropped,
+        as are the gaps in the driver buffer when the thread polls too slowly.
         
         Parameters
         ----------
         sample_rate : float, optional
             The desired sampling rate in Hz (default: 4e6, or 4 MHz)
         buffer_size : int, optional
-            Size of the buffer for data acquisition (default: 500)
+            Size of the driver overview buffer per channel (default: enough for 4 poll intervals)
+        ring_size : int, optional
+            Number of samples per channel kept in the ring buffer (default: 2**22)
+        memmap_path : str, optional
+            If given, the ring buffer is a memory-mapped file of int16 with shape
+            (n_channels, ring_size) instead of an array in RAM, for long runs
+        poll_interval : float, optional
+            Time in seconds between two GetStreamingLatestValues calls (default: 0.01)
+        recorder : PicoRecorder, optional
+            If given, every new chunk is also queued to this recorder (default: None)
+            
+        Raises
+        ------
+        ValueError
+            If no channel is enabled
         """
+        channels = [ch for ch, info in self.channel_info.items() if info['enabled']]
+        if not channels:
+            raise ValueError("No channel enabled. Enable at least one channel with set_channel.")
+        if buffer_size is None:
+            buffer_size = max(500, int(4 * sample_rate * poll_interval))
+        
         self._streaming_stop = False
-        self._streamed_data = []  # reset storage
+        self._stream_channels = channels
         self._buffer_size = buffer_size
+        self._ring_size = ring_size
         
-        # Convert sample_rate to sample_interval in ns
-        sample_interval = int(1e9 / sample_rate)
+        # Driver buffers: one contiguous row per channel, registered once (replacing the acq_block ones)
+        self._block_config = None
+        self._stream_buffers = np.zeros((len(channels), buffer_size), dtype=np.int16)
+        if memmap_path is not None:
+            self._ring = np.memmap(memmap_path, dtype=np.int16, mode='w+', shape=(len(channels), ring_size))
+        else:
+            self._ring = np.zeros((len(channels), ring_size), dtype=np.int16)
         
-        # Create a buffer for channel A (for simplicity, one channel is used)
-        self._bufferA = np.zeros(shape=buffer_size, dtype=np.int16)
+        # Counters (in samples per channel since the start of the stream)
+        with self._stream_lock:
+            self._stream_written = 0
+            self._stream_read = 0
+            self._stream_dropped = 0
+            self._stream_overflow = {ch: 0 for ch in channels}
+            self._stream_next_index = 0
 
-        # Register the data buffer with the driver for channel A
-        status_key = "setDataBufferA_stream"
-        self.status[status_key] = ps.ps5000SetDataBuffer(self.chandle,
-                                                        ps.PS5000A_CHANNEL['PS5000A_CHANNEL_A'],
-                                                        self._bufferA.ctypes.data_as(ctypes.POINTER(ctypes.c_int16)),
-                                                        buffer_size,
-                                                        0,
-                                                        0)
-        assert_pico_ok(self.status[status_key])
+        for i, ch in enumerate(channels):
+            status_key = f"setDataBuffer{ch}_stream"
+            self.status[status_key] = ps.ps5000aSetDataBuffer(self.chandle,
+                                                             ps.PS5000A_CHANNEL[f'PS5000A_CHANNEL_{ch}'],
+                                                             self._stream_buffers[i].ctypes.data_as(ctypes.POINTER(ctypes.c_int16)),
+                                                             buffer_size,
+                                                             0,
+                                                             ps.PS5000A_RATIO_MODE['PS5000A_RATIO_MODE_NONE'])
+            assert_pico_ok(self.status[status_key])
 
         # Streaming mode: no pretrigger, no autoStop (0 means continuous)
         maxPreTriggerSamples = 0
         autoStopOn = 0  # continuous streaming
         downsampleRatio = 1
         
-        # Start streaming
-        sample_interval_ct = ctypes.c_int32(sample_interval)
-        self.status["runStreaming_stream"] = ps.ps5000RunStreaming(self.chandle,
-                                                                   ctypes.byref(sample_interval_ct),
-                                                                   0,  # time units
-                                                                   maxPreTriggerSamples,
-                                                                   0,  # total samples
-                                                                   autoStopOn,
-                                                                   downsampleRatio,
-                                                                   0,  # no downsampling
-                                                                   buffer_size)
+        # Start streaming, sample interval in ns
+        sample_interval_ct = ctypes.c_uint32(int(round(1e9 / sample_rate)))
+        self.status["runStreaming_stream"] = ps.ps5000aRunStreaming(self.chandle,
+                                                                    ctypes.byref(sample_interval_ct),
+                                                                    ps.PS5000A_TIME_UNITS['PS5000A_NS'],
+                                                                    maxPreTriggerSamples,
+                                                                    0,  # total samples
+                                                                    autoStopOn,
+                                                                    downsampleRatio,
+                                                                    ps.PS5000A_RATIO_MODE['PS5000A_RATIO_MODE_NONE'],
+                                                                    buffer_size)
         assert_pico_ok(self.status["runStreaming_stream"])
+        # The driver returns the interval it actually uses
+        self._stream_sample_rate = 1e9 / sample_interval_ct.value
 
-        # Define callback function for streaming
+        # Define callback function for streaming: copy the new samples in the ring (at most two slices)
         def streaming_callback(handle, noOfSamples, startIndex, overflow, triggerAt, triggered, autoStop, param):
-            if noOfSamples > 0:
-                chunk = self._bufferA[startIndex:startIndex+noOfSamples].copy()
-                self._streamed_data.append(chunk)
-            return 0
+            if noOfSamples <= 0:
+                return
+            with self._stream_lock:
+                # The driver writes its buffer circularly: a jump in startIndex means lost samples
+                if startIndex != self._stream_next_index:
+                    self._stream_dropped += (startIndex - self._stream_next_index) % buffer_size
+                self._stream_next_index = (startIndex + noOfSamples) % buffer_size
+                for ch in channels:
+                    # bit 0 is channel A, bit 1 channel B, ...
+                    if overflow & (1 << "ABCD".index(ch)):
+                        self._stream_overflow[ch] += 1
+                
+                pos = self._stream_written % ring_size
+                first = min(noOfSamples, ring_size - pos)
+                self._ring[:, pos:pos + first] = self._stream_buffers[:, startIndex:startIndex + first]
+                if first < noOfSamples:
+                    self._ring[:, :noOfSamples - first] = self._stream_buffers[:, startIndex + first:startIndex + noOfSamples]
+                self._stream_written += noOfSamples
+                if recorder is not None:
+                    recorder.write(self._stream_buffers[:, startIndex:startIndex + noOfSamples])
+                
+                # Unread samples overwritten by the writer are lost
+                lag = self._stream_written - self._stream_read
+                if lag > ring_size:
+                    self._stream_dropped += lag - ring_size
+                    self._stream_read = self._stream_written - ring_size
+                self._stream_lock.notify_all()
 
-        cFuncPtr = ps.StreamingReadyType(streaming_callback)
+        # Keep a reference to the ctypes callback for the whole stream
+        self._stream_callback = ps.StreamingReadyType(streaming_callback)
 
         def streaming_thread():
             while not self._streaming_stop:
-                self.status["getStreaming"] = ps.ps5000GetStreamingLatestValues(self.chandle, cFuncPtr, None)
-                time.sleep(0.01)
+                self.status["getStreaming"] = ps.ps5000aGetStreamingLatestValues(self.chandle, self._stream_callback, None)
+                time.sleep(poll_interval)
             # Stop streaming
-            self.status["stop_stream"] = ps.ps5000Stop(self.chandle)
+            self.status["stop_stream"] = ps.ps5000aStop(self.chandle)
             assert_pico_ok(self.status["stop_stream"])
+            with self._stream_lock:
+                self._stream_lock.notify_all()
             print("Streaming stopped.")
 
         # Start streaming thread
-        self._streaming_thread = threading.Thread(target=streaming_thread)
+        self._streaming_thread = threading.Thread(target=streaming_thread, daemon=True)
         self._streaming_thread.start()
 
     def stop_streaming(self):
@@ -260,16 +661,224 @@ class PicoScope(Instrument):
         self._streaming_stop = True
         if self._streaming_thread is not None:
             self._streaming_thread.join()
+            self._streaming_thread = None
+        if isinstance(self._ring, np.memmap):
+            self._ring.flush()
+
+    def iter_frames(self, frame_size: int, timeout: float = 1.0):
+        """
+        Iterate over the streamed data in frames of frame_size samples per channel.
+        
+        Each frame is a read-only view on the ring buffer with shape (n_channels, frame_size),
+        rows in the order of streaming_stats()['channels']. It stays valid until the writer
+        laps it: process (or copy) it before asking for the next one. If the consumer falls
+        more than ring_size samples behind, the oldest samples (up to the next frame boundary) are
+        skipped and counted as dropped.
+        The iteration ends when the streaming is stopped and all complete frames have been read.
+        
+        Parameters
+        ----------
+        frame_size : int
+            Number of samples per channel in each frame; must divide ring_size
+        timeout : float, optional
+            Maximum waiting time in seconds for a frame (default: 1.0)
+            
+        Raises
+        ------
+        ValueError
+            If frame_size does not divide the ring size
+        TimeoutError
+            If no frame is available within timeout
+        """
+        if self._ring_size % frame_size:
+            raise ValueError(f"frame_size ({frame_size}) must divide the ring size ({self._ring_size}).")
+        
+        while True:
+            with self._stream_lock:
+                ready = self._stream_lock.wait_for(
+                    lambda: self._stream_written - self._stream_read >= frame_size or self._streaming_thread is None or not self._streaming_thread.is_alive(),
+                    timeout)
+                if self._stream_written - self._stream_read < frame_size:
+                    if not ready:
+                        raise TimeoutError("No streaming frame available within the timeout.")
+                    return
+                # Realign to the frame grid after samples have been dropped: the samples skipped
+                # to get there are dropped too
+                skipped = (-self._stream_read) % frame_size
+                self._stream_read += skipped
+                self._stream_dropped += skipped
+                if self._stream_written - self._stream_read < frame_size:
+                    continue
+                pos = self._stream_read % self._ring_size
+                self._stream_read += frame_size
+            frame = self._ring[:, pos:pos + frame_size]
+            frame.flags.writeable = False
+            yield frame
+
+    def streaming_stats(self):
+        """
+        Return the counters of the current stream: enabled channels, sample rate, samples written
+        and not yet read, dropped samples and number of chunks with an overflow for each channel.
+        """
+        with self._stream_lock:
+            return {'channels': list(self._stream_channels),
+                    'sample_rate': self._stream_sample_rate,
+                    'written': self._stream_written,
+                    'pending': self._stream_written - self._stream_read,
+                    'dropped': self._stream_dropped,
+                    'overflow': dict(self._stream_overflow)}
 
     def get_streamed_data(self):
         """
-        Get the acquired streaming data.
+        Get the acquired streaming data still in the ring buffer (at most ring_size samples per channel),
+        as a dictionary channel -> int16 array in chronological order.
         """
-        if self._streamed_data:
-            return np.concatenate(self._streamed_data)
-        else:
-            return np.array([], dtype=np.int16)
+        if self._ring is None:
+            return {}
+        with self._stream_lock:
+            n = min(self._stream_written, self._ring_size)
+            pos = self._stream_written % self._ring_size
+            data = np.roll(self._ring, -pos, axis=1) if n == self._ring_size else np.array(self._ring[:, :n])
+        return {ch: data[i] for i, ch in enumerate(self._stream_channels)}
+        
+    def recording_header(self, sample_rate: float, record_samples: int = None) -> dict:
+        """
+        Build the header of a PicoRecorder recording with the current settings.
+        
+        Parameters
+        ----------
+        sample_rate : float
+            The sampling rate in Hz of the acquisition to record
+        record_samples : int, optional
+            Samples of each capture, for block and rapid block acquisitions (default: None)
+            
+        Returns
+        -------
+        dict
+            Enabled channels, their range index and offset, maxADC, dt, timebase and trigger settings
+            (dt is the sample interval of the timebase as reported by the driver, not 1 / sample_rate)
+        """
+        channels = [ch for ch, info in self.channel_info.items() if info['enabled']]
+        timebase = self.calculate_timebase(sample_rate)
+        
+        return {'channels': channels,
+                'range': {ch: int(self.channel_info[ch]['range']) for ch in channels},
+                'offset': {ch: self.channel_info[ch]['offset'] for ch in channels},
+                'coupling': {ch: self.channel_info[ch]['coupling'] for ch in channels},
+                'maxADC': self.max_adc(),
+                'dt': self.timebase_interval(timebase, record_samples or 1),
+                'timebase': timebase,
+                'trigger': self.trigger_info,
+                'record_samples': record_samples}
+
+    def set_awg_dc(self, voltage: float, waveform_samples: int = 4096):
+        """
+        Set the signal generator to a DC level (flat arbitrary waveform plus offset).
+        
+        The zero waveform and its phase increment are computed once per length and reused,
+        so stepping the level only costs one SetSigGenArbitrary call.
+        
+        Parameters
+        ----------
+        voltage : float
+            DC level in V
+        waveform_samples : int, optional
+            Length of the arbitrary waveform buffer (default: 4096)
+        """
+        if self._awg_buffer is None or len(self._awg_buffer) != waveform_samples:
+            self._awg_buffer = np.zeros(waveform_samples, dtype=np.int16)
+            self._awg_phase = ctypes.c_uint32()
+            self.status["sigGenFrequencyToPhase"] = ps.ps5000aSigGenFrequencyToPhase(self.chandle, 1.0, 0, waveform_samples, ctypes.byref(self._awg_phase))
+            assert_pico_ok(self.status["sigGenFrequencyToPhase"])
+        
+        self.status["setSigGenArbitrary"] = ps.ps5000aSetSigGenArbitrary(
+            self.chandle,
+            ctypes.c_int32(int(round(voltage * 1e6))),  # offset in uV
+            ctypes.c_uint32(0),                         # pk-pk = 0
+            self._awg_phase, self._awg_phase,
+            0, 0,
+            self._awg_buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_int16)),
+            waveform_samples,
+            0, 0, 0,
+            0, 0,
+            0, 0, 0
+        )
+        assert_pico_ok(self.status["setSigGenArbitrary"])
+
+    def sweep(self, values, sample_rate: float, n_samples: int, set_point=None, settle: float = 0.0, time_out: int = 3000, on_step=None) -> np.ndarray:
+        """
+        Step a parameter through values and capture one block per step.
+        
+        The steps are pipelined: as soon as the block of step k is read, the parameter is
+        set to the value of step k+1, and the statistics of step k are computed while the
+        new level settles. Each step costs about settle + capture time.
+        
+        Parameters
+        ----------
+        values : array-like
+            Values of the parameter, one per step
+        sample_rate : float
+            The desired sampling rate in Hz
+        n_samples : int
+            Number of samples of each capture
+        set_point : callable, optional
+            Function called with each value to set the parameter (default: set_awg_dc)
+        settle : float, optional
+            Time in seconds to wait after setting a value before the capture (default: 0)
+        time_out : int, optional
+            The timeout in milliseconds of each capture (default: 3000)
+        on_step : callable, optional
+            Called as on_step(k, row) after each step, e.g. for printing or live plots (default: None)
+            
+        Returns
+        -------
+        np.ndarray
+            Structured array with one row per step: 'value', 'mean_<ch>' and 'std_<ch>' (mV)
+            for each enabled channel, and 'overflow' (channel overflow bit flags)
+        """
+        values = np.asarray(values, dtype=float)
+        set_point = self.set_awg_dc if set_point is None else set_point
+        channels = [ch for ch, info in self.channel_info.items() if info['enabled']]
+        
+        fields = [('value', 'f8')]
+        for ch in channels:
+            fields += [(f'mean_{ch}', 'f8'), (f'std_{ch}', 'f8')]
+        fields += [('overflow', 'i2')]
+        results = np.zeros(len(values), dtype=fields)
+        for name, kind in fields[1:-1]:
+            results[name] = np.nan
+        if len(values) == 0:
+            return results
+        
+        set_point(values[0])
+        t_set = time.perf_counter()
+        for k, value in enumerate(values):
+            remaining = t_set + settle - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+            
+            self.start_block(sample_rate, n_samples)
+            self.wait_ready(time_out)
+            counts, n, overflow = self._read_block()
+            
+            # Next level right away: it settles while the statistics of this step are computed
+            if k + 1 < len(values):
+                set_point(values[k + 1])
+                t_set = time.perf_counter()
+            
+            row = results[k]
+            row['value'] = value
+            row['overflow'] = overflow
+            for ch in channels:
+                scale = ps.PICO_VOLTAGE_RANGE[self.channel_info[ch]['range']] * 1000 / self.max_adc()
+                c = counts[ch][:n]
+                row[f'mean_{ch}'] = c.mean(dtype=np.float64) * scale
+                row[f'std_{ch}'] = c.std(dtype=np.float64) * scale
+            if on_step is not None:
+                on_step(k, row)
         
+        return results
+
     def calculate_timebase(self, sampling_rate: float) -> int:
         """
         Calculate the oscilloscope timebase value for a given sampling rate.
@@ -277,12 +886,34 @@ class PicoScope(Instrument):
         # Timebase calculation for PS5000 series
         return int(np.round(1e9 / sampling_rate))
 
+    def timebase_interval(self, timebase: int, no_of_samples: int = 1) -> float:
+        """
+        Sample interval of a timebase, as reported by ps5000aGetTimebase2.
+        
+        Parameters
+        ----------
+        timebase : int
+            Timebase value (see calculate_timebase)
+        no_of_samples : int, optional
+            Samples of the capture, checked by the driver against the memory (default: 1)
+            
+        Returns
+        -------
+        float
+            Sample interval in s
+        """
+        time_interval_ns = ctypes.c_float()
+        returned_max_samples = ctypes.c_int32()
+        self.status["getTimebase2"] = ps.ps5000aGetTimebase2(self.chandle, timebase, no_of_samples, ctypes.byref(time_interval_ns), ctypes.byref(returned_max_samples), 0)
+        assert_pico_ok(self.status["getTimebase2"])
+        return time_interval_ns.value * 1e-9
+
     def initialize(self):
         """
         Initialize the connection to the device.
         """
         # Open the PicoScope device
-        self.status["openunit"] = ps.ps5000OpenUnit(ctypes.byref(self.chandle), None)
+        self.status["openunit"] = ps.ps5000aOpenUnit(ctypes.byref(self.chandle), None, self.resolution)
         assert_pico_ok(self.status["openunit"])
 
         # Disable all channels
@@ -300,11 +931,11 @@ class PicoScope(Instrument):
         Stop the oscilloscope and close the connection.
         """
         # Stop the scope
-        self.status["stop"] = ps.ps5000Stop(self.chandle)
+        self.status["stop"] = ps.ps5000aStop(self.chandle)
         assert_pico_ok(self.status["stop"])
 
         # Close the connection
-        self.status["close"] = ps.ps5000CloseUnit(self.chandle)
+        self.status["close"] = ps.ps5000aCloseUnit(self.chandle)
         assert_pico_ok(self.status["close"])
 
     def info(self):
@@ -313,11 +944,44 @@ class PicoScope(Instrument):
         """
         print(self.status)
 
+    def get_command_value(self, category: str, key: str) -> str:
+        """
+        Driver string of a setting from PicoStrings.json (e.g. 'RANGE', '5V' -> 'PS5000A_5V').
+        """
+        if self._commands is None:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "PicoStrings.json")) as f:
+                self._commands = json.load(f)
+        return self._commands[category][key.upper()]
+
+    def _activate(self):
+        """
+        Nothing to do: the PicoScope is controlled over USB, there is no remote mode.
+        """
+        pass
+
+    def reset(self):
+        """
+        Disable all the channels.
+        """
+        self.disable_all_channels()
+
+    def close_connection(self):
+        """
+        Stop the oscilloscope and close the connection.
+        """
+        self.kill()
+
+    def shutdown(self):
+        """
+        Stop the oscilloscope and close the connection.
+        """
+        self.kill()
+
     
     def __del__(self):
         """
         Destructor to ensure the connection is closed when the object is deleted.
         """
         # Ensure the connection is closed when the object is deleted
-        if self.status['close'] == None and self.status['stop'] == None :
+        if self.status.get('close') is None and self.status.get('stop') is None:
             self.close_connection()
\ No newline at end of file
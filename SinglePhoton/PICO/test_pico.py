@@ -11,6 +11,7 @@ import numpy as np
 from picosdk.ps5000a import ps5000a as ps
 import matplotlib.pyplot as plt
 from picosdk.functions import adc2mV, assert_pico_ok, mV2adc
+import time
 
 # Create chandle and status ready for use
 chandle = ctypes.c_int16()
@@ -116,6 +117,7 @@ ready = ctypes.c_int16(0)
 check = ctypes.c_int16(0)
 while ready.value == check.value:
     status["isReady"] = ps.ps5000aIsReady(chandle, ctypes.byref(ready))
+    time.sleep(0.001)
 
 
 # Create buffers ready for assigning pointers for data collection
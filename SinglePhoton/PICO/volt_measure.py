@@ -9,6 +9,7 @@ print("DLL loaded from:", dll_path)
 
 from picosdk.ps5000a import ps5000a as ps
 from picosdk.functions import adc2mV, assert_pico_ok, mV2adc
+import time
 
 # ----------------------------------------------------------------------
 # PARAMETRI CONFIGURABILI
@@ -85,50 +86,53 @@ while True:
         raise Exception("Nessun timebase valido trovato per il numero di punti richiesto")
 
 # ----------------------------------------------------------------------
-# ACQUISIZIONE MULTIPLA E MEDIA
+# ACQUISIZIONE MULTIPLA E MEDIA (rapid block: NUM_AVG segmenti, un solo RunBlock)
 # ----------------------------------------------------------------------
 
-avg_data = np.zeros(POSTTRIGGER, dtype=float)
-
-for i in range(NUM_AVG):
-    # Run block
-    status["runBlock"] = ps.ps5000aRunBlock(
-        chandle,
-        0, POSTTRIGGER,
-        timebase,
-        None, 0, None, None
-    )
-    assert_pico_ok(status["runBlock"])
+# La memoria viene divisa in NUM_AVG segmenti: lo strumento si riarma da solo dopo
+# ogni trigger e i blocchi vengono letti tutti insieme con GetValuesBulk
+maxSegmentSamples = ctypes.c_int32()
+status["memorySegments"] = ps.ps5000aMemorySegments(chandle, NUM_AVG, ctypes.byref(maxSegmentSamples))
+assert_pico_ok(status["memorySegments"])
+if POSTTRIGGER > maxSegmentSamples.value:
+    POSTTRIGGER = maxSegmentSamples.value
+    print(f"PostTrigger ridotto a {POSTTRIGGER} (memoria divisa in {NUM_AVG} segmenti)")
+
+status["setNoOfCaptures"] = ps.ps5000aSetNoOfCaptures(chandle, NUM_AVG)
+assert_pico_ok(status["setNoOfCaptures"])
+
+status["runBlock"] = ps.ps5000aRunBlock(
+    chandle,
+    0, POSTTRIGGER,
+    timebase,
+    None, 0, None, None
+)
+assert_pico_ok(status["runBlock"])
 
-    # Wait until ready
-    ready = ctypes.c_int16(0)
-    while ready.value == 0:
-        ps.ps5000aIsReady(chandle, ctypes.byref(ready))
+# Wait until ready (tutti i segmenti acquisiti)
+ready = ctypes.c_int16(0)
+while ready.value == 0:
+    ps.ps5000aIsReady(chandle, ctypes.byref(ready))
+    time.sleep(0.001)
 
-    # Setup buffer
-    bufferA = (ctypes.c_int16 * POSTTRIGGER)()
-    status["setBuffer"] = ps.ps5000aSetDataBuffers(
-        chandle, CHANNEL, bufferA, None, POSTTRIGGER, 0, 0
+# Un buffer per segmento, righe di un unico array (NUM_AVG, POSTTRIGGER)
+buffers = np.empty((NUM_AVG, POSTTRIGGER), dtype=np.int16)
+for i in range(NUM_AVG):
+    status["setBuffer"] = ps.ps5000aSetDataBuffer(
+        chandle, CHANNEL, buffers[i].ctypes.data_as(ctypes.POINTER(ctypes.c_int16)), POSTTRIGGER, i, 0
     )
     assert_pico_ok(status["setBuffer"])
 
-    # Get values
-    samples = ctypes.c_int32(POSTTRIGGER)
-    overflow = ctypes.c_int16()
-    status["getValues"] = ps.ps5000aGetValues(
-        chandle, 0, ctypes.byref(samples), 0, 0, 0, ctypes.byref(overflow)
-    )
-    assert_pico_ok(status["getValues"])
-
-    # Converti in mV
-    data_mV = adc2mV(bufferA, V_RANGE, maxADC)
-    data_mV = np.array(data_mV, dtype=float)
-
-    # Somma per la media
-    avg_data += data_mV
+# Get values di tutti i segmenti
+samples = ctypes.c_uint32(POSTTRIGGER)
+overflow = (ctypes.c_int16 * NUM_AVG)()
+status["getValuesBulk"] = ps.ps5000aGetValuesBulk(
+    chandle, ctypes.byref(samples), 0, NUM_AVG - 1, 1, 0, overflow
+)
+assert_pico_ok(status["getValuesBulk"])
 
-# Calcola media finale
-avg_data /= NUM_AVG
+# Media sui segmenti in conteggi ADC, poi conversione in mV (adc2mV e' lineare)
+avg_data = np.array(adc2mV(buffers.mean(axis=0), V_RANGE, maxADC), dtype=float)
 
 # Calcola media, std, errore standard
 mean_v = np.mean(avg_data)
@@ -136,7 +140,7 @@ std_v = np.std(avg_data)
 stderr_v = std_v / np.sqrt(len(avg_data))
 
 print("\n-------------------------------------")
-print("   RISULTATI MISURA DI VOLTAGGIO (media 10 blocchi)")
+print(f"   RISULTATI MISURA DI VOLTAGGIO (media {NUM_AVG} blocchi)")
 print("-------------------------------------")
 print(f"Numero di punti      : {len(avg_data)}")
 print(f"Media (mV)           : {mean_v:.6f}")
@@ -1,7 +1,6 @@
 import os
 import re
 import numpy as np
-import pandas as pd
 from scipy.constants import k
 
 from resonance_utils import ResonanceKid, GapFinder
@@ -23,41 +22,57 @@ def extract_peak_name(filename):
     return match.group(1) if match else None
 
 
-def convert_csv_to_clean_txt(csv_path):
-    """
-    Legge CSV con pandas e salva file temporaneo pulito
-    (solo colonne numeriche, separatore whitespace)
-    """
-    df = pd.read_csv(csv_path)
-
-    # prendiamo solo colonne utili
-    cols = ["frequency", "Re(S21)", "Im(S21)"]
-    df = df[cols]
-
-    clean_path = csv_path.replace(".csv", "_clean.txt")
-
-    np.savetxt(clean_path, df.values)
-
-    return clean_path
-
-
 # ======================
 # FIT RESONANCES
 # ======================
 
+def fit_peak(filepath, polgrad, fmin, fmax, phase=False, ini=None):
+    """
+    Fit di un singolo picco. Con ini (parametri del fit alla temperatura precedente)
+    parte da li' (warm start); se migrad non converge rifa' il fit da zero (cold start).
+    Restituisce (res, f0), f0 e' None per il warm start.
+    """
+    if ini is not None:
+        res = ResonanceKid(
+            filepath,
+            polyorder=polgrad,
+            fit_phase=phase,
+            init_parameters=ini
+        )
+        res.set_freq_cut(fmin, fmax)
+        res.min_obj = res.minuit_obj()
+        res.fit()
+        if res.fit_result.valid:
+            return res, None
+        print(f"Warm start failed for {filepath}, refitting from scratch")
+
+    res = ResonanceKid(filepath, polyorder=polgrad, fit_phase=phase)
+    res.f0_from_fit()
+    f0 = res.f0_fit
+    res.fit()
+
+    res.set_freq_cut(fmin, fmax)
+    res.min_obj = res.minuit_obj()
+    res.fit()
+    return res, f0
+
+
 def fit_all_resonances(basepath, polgrad, fmin, fmax, phase=False, plot=False):
 
     results = {}
 
-    for folder in os.listdir(basepath):
+    # le cartelle vanno in ordine di temperatura: ogni fit parte dal risultato
+    # della temperatura precedente, che deve essere vicina
+    folders = [f for f in os.listdir(basepath) if extract_temperature(f) is not None]
+    folders.sort(key=extract_temperature)
+
+    for folder in folders:
         folder_path = os.path.join(basepath, folder)
 
         if not os.path.isdir(folder_path):
             continue
 
         Tval = extract_temperature(folder)
-        if Tval is None:
-            continue
 
         for file in os.listdir(folder_path):
             if not file.endswith(".csv"):
@@ -70,9 +85,6 @@ def fit_all_resonances(basepath, polgrad, fmin, fmax, phase=False, plot=False):
             csv_path = os.path.join(folder_path, file)
 
             try:
-                # 🔥 FIX: conversione robusta
-                filepath = convert_csv_to_clean_txt(csv_path)
-
                 if peak not in results:
                     results[peak] = {
                         "T": [],
@@ -84,23 +96,9 @@ def fit_all_resonances(basepath, polgrad, fmin, fmax, phase=False, plot=False):
 
                 data = results[peak]
 
-                if data["ini"] is None:
-                    res = ResonanceKid(filepath, polyorder=polgrad, fit_phase=phase)
-                    res.f0_from_fit()
-                    data["f0"] = res.f0_fit
-                    res.fit()
-                    data["ini"] = np.asarray(res.fit_result.values)
-                else:
-                    res = ResonanceKid(
-                        filepath,
-                        polyorder=polgrad,
-                        fit_phase=phase,
-                        init_parameters=data["ini"]
-                    )
-
-                res.set_freq_cut(fmin, fmax)
-                res.min_obj = res.minuit_obj()
-                res.fit()
+                res, f0 = fit_peak(csv_path, polgrad, fmin, fmax, phase=phase, ini=data["ini"])
+                if data["f0"] is None:
+                    data["f0"] = f0
 
                 if plot:
                     res.plot_fit()
@@ -2,6 +2,17 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "common"))
+from calibration_cache import CalibrationCache
+from s21_loader import load_s21
+
+# Calibration cache used by fit_resonance when no calibration is passed (None: no cache).
+# The directory is relative to the working directory, like in 3DQubit/frequency_vs_temperature.py
+CALIBRATION_DIR = "calibration"
+CALIBRATION_RUN = "default"
+CALIBRATION_LINE = "default"
 
 # -------------------------------------------------------
 # Mathematical Models & Helpers
@@ -43,11 +54,54 @@ def fit_wrapper(f, a, alpha, Ql, Qc_mag, phi, fr, tau):
 # -------------------------------------------------------
 # Core Automated Pipeline
 # -------------------------------------------------------
-def fit_resonance(freq, S21_raw, show_diagnostics=False, show_intermediate_plots=False, provided_tau=None):
+def relative_residual(freq, S21_raw, popt):
+    """RMS of |S21_data - S21_fit| relative to the median |S21|."""
+    S21_fit = S21_probst(freq, *popt)
+    return np.sqrt(np.mean(np.abs(S21_raw - S21_fit)**2)) / np.median(np.abs(S21_raw))
+
+def fit_resonance(freq, S21_raw, show_diagnostics=False, show_intermediate_plots=False, provided_tau=None,
+                  fix_tau=False, init_params=None, max_residual=None, calibration=None):
     """
     Executes the full automated Probst fitting routine on raw S21 data.
-    If provided_tau is given, it skips the automated tail-fitting in Step 1.
+    If provided_tau is given, it skips the automated tail-fitting in Step 1;
+    with fix_tau=True it is also kept fixed in the global fit (shared cable delay).
+    If init_params (the results dict of a neighbouring fit) is given, Steps 1-4 are
+    skipped and the global fit is seeded from it. If that warm fit fails, or its
+    relative residual is above max_residual, the full cold routine is run instead.
+    The calibration cache (a CalibrationCache, by default the one in CALIBRATION_DIR) is
+    always looked up: its baseline is divided out and its tau is used as provided_tau; if it
+    has no tau for this band, the fitted one is stored in it.
+    """
+    if calibration is None and CALIBRATION_DIR is not None:
+        calibration = CalibrationCache(CALIBRATION_DIR, run=CALIBRATION_RUN, line=CALIBRATION_LINE)
+    if calibration is None:
+        return _fit_resonance(freq, S21_raw, show_diagnostics, show_intermediate_plots, provided_tau,
+                              fix_tau, init_params, max_residual)
+
+    baseline = calibration.baseline(freq)
+    if baseline is not None:
+        S21_raw = S21_raw / baseline
+    tau = provided_tau if provided_tau is not None else calibration.tau(freq)
+    results = _fit_resonance(freq, S21_raw, show_diagnostics, show_intermediate_plots, tau,
+                             fix_tau, init_params, max_residual)
+    if tau is None:
+        calibration.store(freq, results["tau"])
+    return results
+
+
+def _fit_resonance(freq, S21_raw, show_diagnostics=False, show_intermediate_plots=False, provided_tau=None,
+                   fix_tau=False, init_params=None, max_residual=None):
+    """
+    fit_resonance without the calibration cache.
     """
+    if init_params is not None:
+        results = _fit_resonance_warm(freq, S21_raw, init_params, provided_tau, fix_tau)
+        if results is not None and (max_residual is None or results["residual"] <= max_residual):
+            if show_diagnostics:
+                plot_fit_diagnostics(freq, S21_raw, results["popt"], results["fr"], results["Qi"])
+            return results
+        return _fit_resonance(freq, S21_raw, show_diagnostics, show_intermediate_plots, provided_tau, fix_tau)
+
     # --- Step 1: Automated Cable Delay (tau) ---
     fr_idx = np.argmin(np.abs(S21_raw))
     fr_guess = freq[fr_idx]
@@ -109,9 +163,16 @@ def fit_resonance(freq, S21_raw, show_diagnostics=False, show_intermediate_plots
     # Note: tau is still passed as a parameter to the global fit here. 
     # If the "small" file fit struggles to keep tau stable, you can remove tau from p0 
     # and fit a 6-parameter model here instead.
-    popt_global, pcov = curve_fit(
-        fit_wrapper, freq, S21_vec, p0=p0, maxfev=50000
-    )
+    if fix_tau and provided_tau is not None:
+        fixed_tau_wrapper = lambda f, a, alpha, Ql, Qc_mag, phi, fr: fit_wrapper(f, a, alpha, Ql, Qc_mag, phi, fr, tau0)
+        popt_global, pcov = curve_fit(
+            fixed_tau_wrapper, freq, S21_vec, p0=p0[:-1], maxfev=50000
+        )
+        popt_global = np.append(popt_global, tau0)
+    else:
+        popt_global, pcov = curve_fit(
+            fit_wrapper, freq, S21_vec, p0=p0, maxfev=50000
+        )
     
     a_fit, alpha_fit, Ql_fit, Qc_mag_fit, phi_fit, fr_fit, tau_fit = popt_global
     
@@ -129,7 +190,10 @@ def fit_resonance(freq, S21_raw, show_diagnostics=False, show_intermediate_plots
         "Ql": Ql_fit, "Ql_0": Ql0,
         "Qc_mag": Qc_mag_fit, "Qc_mag_0": Qc_mag0,
         "Qi": Qi_fit, "Qi_0": Qi0,
-        "phi": phi_fit, "phi_0": phi0
+        "phi": phi_fit, "phi_0": phi0,
+        "popt": popt_global,
+        "residual": relative_residual(freq, S21_raw, popt_global),
+        "warm": False
     }
     
     # -------------------------------------------------------
@@ -228,25 +292,115 @@ def fit_resonance(freq, S21_raw, show_diagnostics=False, show_intermediate_plots
     # Final Diagnostic Plot Block
     # -------------------------------------------------------
     if show_diagnostics:
-        S21_fit = S21_probst(freq, *popt_global)
-        residuals = np.abs(S21_raw - S21_fit)
-        
-        plt.figure(figsize=(10, 8))
-        plt.subplot(2, 1, 1)
-        plt.plot(S21_raw.real, S21_raw.imag, '.', ms=2, label="Raw Data", color='blue')
-        plt.plot(S21_fit.real, S21_fit.imag, '-', lw=2, label="Global Fit", color='red')
-        plt.title(f"S21 Complex Plane (Fr = {fr_fit/1e9:.4f} GHz, Qi = {Qi_fit:.0f})")
-        plt.grid(True); plt.axis("equal"); plt.legend()
-        
-        plt.subplot(2, 1, 2)
-        plt.plot(freq, residuals, '.k', ms=2)
-        plt.title("Fit Residuals |S21_data - S21_fit|")
-        plt.grid(True)
-        plt.tight_layout()
-        plt.show()
+        plot_fit_diagnostics(freq, S21_raw, popt_global, fr_fit, Qi_fit)
         
     return results
 
+def _fit_resonance_warm(freq, S21_raw, init_params, provided_tau=None, fix_tau=False, maxfev=2000):
+    """
+    Global 7-parameter fit seeded from a previous results dict. Returns None if it fails.
+    maxfev is kept low: from a good seed the fit converges in a few tens of calls,
+    if it does not the seed is bad and the cold routine is faster.
+    """
+    tau0 = init_params["tau"] if provided_tau is None else provided_tau
+    fr0 = min(max(init_params["fr"], freq[0]), freq[-1])
+    p0 = [init_params["a"], init_params["alpha"], init_params["Ql"], init_params["Qc_mag"], init_params["phi"], fr0, tau0]
+    S21_vec = np.concatenate([S21_raw.real, S21_raw.imag])
+
+    try:
+        if fix_tau and provided_tau is not None:
+            fixed_tau_wrapper = lambda f, a, alpha, Ql, Qc_mag, phi, fr: fit_wrapper(f, a, alpha, Ql, Qc_mag, phi, fr, tau0)
+            popt_global, pcov = curve_fit(fixed_tau_wrapper, freq, S21_vec, p0=p0[:-1], maxfev=maxfev)
+            popt_global = np.append(popt_global, tau0)
+        else:
+            popt_global, pcov = curve_fit(fit_wrapper, freq, S21_vec, p0=p0, maxfev=maxfev)
+    except RuntimeError:
+        return None
+
+    a_fit, alpha_fit, Ql_fit, Qc_mag_fit, phi_fit, fr_fit, tau_fit = popt_global
+    alpha_fit = alpha_fit % (2 * np.pi)
+    Qi_fit = (Qc_mag_fit * Ql_fit) / (Qc_mag_fit - Ql_fit)
+
+    # "_0" keys hold the seed values, as the cold routine stores its initial estimates there
+    return {
+        "a": a_fit, "a_0": p0[0],
+        "alpha": alpha_fit, "alpha_0": p0[1],
+        "tau": tau_fit, "tau_0": tau0,
+        "fr": fr_fit, "fr_0": fr0,
+        "Ql": Ql_fit, "Ql_0": p0[2],
+        "Qc_mag": Qc_mag_fit, "Qc_mag_0": p0[3],
+        "Qi": Qi_fit, "Qi_0": init_params["Qi"],
+        "phi": phi_fit, "phi_0": p0[4],
+        "popt": popt_global,
+        "residual": relative_residual(freq, S21_raw, popt_global),
+        "warm": True
+    }
+
+def plot_fit_diagnostics(freq, S21_raw, popt_global, fr_fit, Qi_fit):
+    """Final diagnostic plot: complex plane and residuals."""
+    S21_fit = S21_probst(freq, *popt_global)
+    residuals = np.abs(S21_raw - S21_fit)
+    
+    plt.figure(figsize=(10, 8))
+    plt.subplot(2, 1, 1)
+    plt.plot(S21_raw.real, S21_raw.imag, '.', ms=2, label="Raw Data", color='blue')
+    plt.plot(S21_fit.real, S21_fit.imag, '-', lw=2, label="Global Fit", color='red')
+    plt.title(f"S21 Complex Plane (Fr = {fr_fit/1e9:.4f} GHz, Qi = {Qi_fit:.0f})")
+    plt.grid(True); plt.axis("equal"); plt.legend()
+    
+    plt.subplot(2, 1, 2)
+    plt.plot(freq, residuals, '.k', ms=2)
+    plt.title("Fit Residuals |S21_data - S21_fit|")
+    plt.grid(True)
+    plt.tight_layout()
+    plt.show()
+
+# -------------------------------------------------------
+# Temperature / Power Sweeps
+# -------------------------------------------------------
+def fit_sweep(sweep, warm_start=True, shared_tau=False, residual_factor=3.0, calibration=None):
+    """
+    Fits a list of (label, freq, S21_raw) traces in sweep order (e.g. increasing temperature).
+    warm_start:  each trace is seeded from the last successful fit; the cold routine is used
+                 only for the first trace or when the warm fit fails the residual check
+                 (residual > residual_factor * previous residual).
+    shared_tau:  the cable delay from the first cold fit is passed as provided_tau and kept
+                 fixed for every other trace.
+    calibration: CalibrationCache passed on to fit_resonance (tau looked up instead of fitted;
+    default: the one in CALIBRATION_DIR).
+    Returns a list of results dicts (None where even the cold fit failed).
+    """
+    all_results = []
+    previous = None
+    tau = None
+    for label, freq, S21_raw in sweep:
+        try:
+            if warm_start and previous is not None:
+                results = fit_resonance(freq, S21_raw, provided_tau=tau, fix_tau=shared_tau,
+                                        init_params=previous, max_residual=residual_factor * previous["residual"],
+                                        calibration=calibration)
+            else:
+                results = fit_resonance(freq, S21_raw, provided_tau=tau, fix_tau=shared_tau, calibration=calibration)
+        except RuntimeError as e:
+            print(f"Fit failed for {label}: {e}")
+            results = None
+
+        if results is not None:
+            previous = results
+            if shared_tau and tau is None:
+                tau = results["tau"]
+        all_results.append(results)
+    return all_results
+
+def load_sweep(peak, folders, basepath="."):
+    """Loads '<folder>/<peak>_big_new<folder>.csv' for every temperature folder (e.g. '10mk')."""
+    sweep = []
+    for folder in folders:
+        # comma or tab separated (s21_loader detects it); cached as .npy after the first read
+        freq, S21 = load_s21(f"{basepath}/{folder}/{peak}_big_new{folder}.csv")
+        sweep.append((folder, freq, S21))
+    return sweep
+
 # -------------------------------------------------------
 # Execution Block
 # -------------------------------------------------------
@@ -267,17 +421,20 @@ if __name__ == "__main__":
         S21_big, 
         show_diagnostics=False,       # Turn to True if you want plots for the big file
         show_intermediate_plots=False,
-        provided_tau=None             # None means it WILL calculate tau from the tails
+        provided_tau=None             # tau from the calibration cache or, the first time, from the tails
     )
     
     extracted_tau = params_big['tau']
     print(f"Extracted tau from big file global fit: {extracted_tau*1e9:.4f} ns")
 
+    # fit_resonance stored it in CALIBRATION_DIR for the whole band of the big file: the fits
+    # on the same run and line (like the small one below) pick it up without refitting the delay
+
 
     # ---------------------------------------------------
     # PART B: Run fit on the "SMALL" file using extracted tau
     # ---------------------------------------------------
-    print("\n=== Processing SMALL file using fixed tau ===")
+    print("\n=== Processing SMALL file using the cached tau ===")
     data_small = pd.read_csv("10mk/picco2_big_new10mk.csv") # Replace with actual small file name
     mask = (data_small["frequency"] >= 7.40e9)
     data_small = data_big[mask]
@@ -288,8 +445,7 @@ if __name__ == "__main__":
         freq_small, 
         S21_small, 
         show_diagnostics=True, 
-        show_intermediate_plots=True,
-        provided_tau=extracted_tau    # Pass the tau extracted from the big file
+        show_intermediate_plots=True  # tau looked up in CALIBRATION_DIR (stored by the big file fit)
     )
     
     # Print clean results for the small file
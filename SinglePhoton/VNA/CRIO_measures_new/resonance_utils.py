@@ -4,6 +4,11 @@ from iminuit import cost, Minuit
 from scipy.constants import k, hbar
 from scipy.special import kv, iv
 
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "common"))
+from s21_loader import load_s21, load_columns
+
 from matplotlib import pyplot as plt
 import matplotlib
 matplotlib.rcParams.update({'font.size': 14})
@@ -49,25 +54,10 @@ class ResonanceKid():
         self.min_obj = self.minuit_obj()
 
 
+    # Any format known to s21_loader (txt, csv, npz); after the first read it comes from the .npy cache
     def readfile(self, filename):
-        self.freqs = []
-        self.amp_i = []
-        self.amp_q = []
-        freqs = []
-        amp_i = []
-        amp_q = []
-        with open(filename, encoding = 'utf-8') as file:
-            for idx, line in enumerate(file):
-                if idx == 0:
-                    continue
-                line = line.replace(',', '')
-                line = line.replace('\n', '')
-
-                splitted = [float(x) for x in line.split('\t')]
-                freqs.append(splitted[0])
-                amp_i.append(splitted[1])
-                amp_q.append(splitted[2])
-        self.load_data(np.array([freqs, amp_i, amp_q])) 
+        freqs, S21 = load_s21(filename)
+        self.load_data(np.array([freqs, S21.real, S21.imag]))
 
 
     def load_data(self, data): 
@@ -381,16 +371,8 @@ class GapFinder():
         self.mask = self._temps<max
 
     def _readfile(self, filename):
-        temps = []
-        q_inv = []
-        err_q_inv = []
-
-        with open(filename, encoding = 'utf-8') as file:
-            for line in file:
-                splitted = [float(x) for x in line.split(' ')]
-                temps.append(splitted[0])
-                q_inv.append(splitted[1])
-                err_q_inv.append(splitted[2])
+        # T, 1/Qi, err: a few lines, not worth a cache file
+        temps, q_inv, err_q_inv = load_columns(filename, cache=False)[:3]
 
         self._temps = np.array(temps, dtype = 'float64')
         self._q_inv = np.array(q_inv, dtype = 'float64')
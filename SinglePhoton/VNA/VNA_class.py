@@ -1,9 +1,39 @@
 import numpy as np
 import pyvisa as pv
-import math
+import warnings
 from ethernetdevice import EthernetDevice
 
 
+class SegmentedSweepUnsupported(Exception):
+    """The analyzer rejected the segment table (error reported by SYST:ERR?)."""
+
+
+def segment_table(windows):
+    """
+    Segment table for SENS:SEGM:DATA: format 5, center/span stimulus, per-segment IFBW,
+    then center, span, points, IFBW of every window (sorted by frequency).
+    """
+    windows = sorted(windows, key=lambda w: w[0] - w[1] / 2)
+    values = [5, 1, 1, 0, 0, 0, len(windows)]
+    for center, span, points, ifbw in windows:
+        values += [center, span, int(points), ifbw]
+    return ",".join(str(v) for v in values)
+
+
+def stitch_sweeps(freqs, data):
+    """
+    Merge several traces into one frequency-sorted trace.
+    Where windows overlap only one point per frequency is kept.
+    """
+    freqs = np.concatenate(freqs)
+    S = np.concatenate(data)
+    order = np.argsort(freqs, kind="stable")
+    freqs = freqs[order]
+    S = S[order]
+    keep = np.r_[True, np.diff(freqs) > 0]
+    return freqs[keep], S[keep]
+
+
 class VNA(EthernetDevice):
     """
     Vector Network Analyzer (VNA)
@@ -19,6 +49,7 @@ class VNA(EthernetDevice):
     Metodi:
     - read_frequency_data
     - read_data
+    - read_segmented_data
     """
 
     __min_freq = 0
@@ -27,21 +58,25 @@ class VNA(EthernetDevice):
     __bandwidth = 0
     __avg_count = 0
     __power = 0
+    segmented_supported = True
 
     def on_init(self, ip_address_string=None):
-        self.write_expect("*CLS")                      # Pulisci le impostazioni
-        self.write_expect("INST:SEL 'NA'")             # Seleziona modalità Network Analyzer
-        self.write_expect("SENS:AVER:MODE SWEEP")      # Media su sweep
-        self.write_expect("DISP:WIND:TRAC1:Y:AUTO")    # Autoscale asse Y
-
-        # Impostazioni iniziali
         self.timeout = 600e3
-        self.min_freq = 8.6356e9 
-        self.max_freq = 8.6452e9
-        self.point_count = 1000
-        self.bandwidth = 1000      # Hz
-        self.avg_count = 10
-        self.power = -1            # dBm
+
+        # Tutta la configurazione iniziale con un solo *OPC? alla fine
+        with self.batch():
+            self.write_expect("*CLS")                      # Pulisci le impostazioni
+            self.write_expect("INST:SEL 'NA'")             # Seleziona modalità Network Analyzer
+            self.write_expect("SENS:AVER:MODE SWEEP")      # Media su sweep
+            self.write_expect("DISP:WIND:TRAC1:Y:AUTO")    # Autoscale asse Y
+
+            # Impostazioni iniziali
+            self.min_freq = 8.6356e9
+            self.max_freq = 8.6452e9
+            self.point_count = 1000
+            self.bandwidth = 1000      # Hz
+            self.avg_count = 10
+            self.power = -1            # dBm
 
         # Per vedere bene la risonanza:
         # self.min_freq = 4.84e9
@@ -59,9 +94,7 @@ class VNA(EthernetDevice):
         self.write_expect(f"SENS:FREQ:START {f}")
         self.__min_freq = f
 
-        ans = float(self.query("SENS:FREQ:START?").strip())
-        if not math.isclose(ans, float(f), rel_tol=1e-6, abs_tol=0.0):
-            raise Exception(f"Could not set 'min_freq' to {f}. Instrument returned {ans}.")
+        self.check_setting("SENS:FREQ:START?", f, "min_freq")
 
     # ---------- MAX_FREQ ----------
 
@@ -75,9 +108,7 @@ class VNA(EthernetDevice):
         self.write_expect(f"SENS:FREQ:STOP {f}")
         self.__max_freq = f
 
-        ans = float(self.query("SENS:FREQ:STOP?").strip())
-        if not math.isclose(ans, float(f), rel_tol=1e-6, abs_tol=0.0):
-            raise Exception(f"Could not set 'max_freq' to {f}. Instrument returned {ans}.")
+        self.check_setting("SENS:FREQ:STOP?", f, "max_freq")
 
     # ---------- POINT_COUNT ----------
 
@@ -91,8 +122,7 @@ class VNA(EthernetDevice):
         self.write_expect(f"SENS:SWE:POIN {n}")
         self.__point_count = n
 
-        if int(self.query("SENS:SWE:POIN?")) != n:
-            raise Exception(f"Could not set 'point_count' to {n}.")
+        self.check_setting("SENS:SWE:POIN?", n, "point_count", cast=int)
 
     # ---------- BANDWIDTH ----------
 
@@ -106,8 +136,7 @@ class VNA(EthernetDevice):
         self.write_expect(f"SENS:BWID {bw}")
         self.__bandwidth = bw
 
-        if int(self.query("SENS:BWID?")) != bw:
-            raise Exception(f"Could not set 'bandwidth' to {bw}.")
+        self.check_setting("SENS:BWID?", bw, "bandwidth")
 
     # ---------- AVERAGE COUNT ----------
 
@@ -121,8 +150,7 @@ class VNA(EthernetDevice):
         self.write_expect(f"AVER:COUN {n}")
         self.__avg_count = n
 
-        if int(self.query("AVER:COUN?")) != n:
-            raise Exception(f"Could not set 'avg_count' to {n}.")
+        self.check_setting("AVER:COUN?", n, "avg_count", cast=int)
 
     # ---------- POWER ----------
 
@@ -136,8 +164,14 @@ class VNA(EthernetDevice):
         self.write_expect(f"SOUR:POW {value}")
         self.__power = value
 
-        if float(self.query("SOUR:POW?").strip()) != float(value):
-            raise Exception(f"Could not set 'power' to {value}.")
+        self.check_setting("SOUR:POW?", value, "power")
+
+    # ---------- SWEEP TIME ----------
+
+    def sweep_timeout(self, margin=2.0):
+        """Upper bound (s) of a triggered acquisition: sweep time x averages x margin + 10 s"""
+        sweep_time = float(self.query("SENS:SWE:TIME?").strip())
+        return sweep_time * max(self.avg_count, 1) * margin + 10
 
     # ---------- FREQUENCY SPECTRUM ----------
 
@@ -151,14 +185,20 @@ class VNA(EthernetDevice):
     def read_data(self, Sij):
         """Read complex S-parameter data. Sij is 'S11', 'S12', 'S21' or 'S22'."""
         # Imposta il parametro
-        self.write_expect("INIT:CONT 0")          # no continuous sweep
-        self.write_expect(f"CALC:PAR:DEF {Sij}")  # scegli S-parameter
-
-        # Fai le medie
-        for i in range(self.avg_count):
+        with self.batch(verify=False):
+            self.write_expect("INIT:CONT 0")          # no continuous sweep
+            self.write_expect(f"CALC:PAR:DEF {Sij}")  # scegli S-parameter
+            self.write_expect("SENS:AVER:CLE")        # medie da zero
+
+        # Fai le medie: senza sweep continuo un solo trigger fa tutte le avg_count medie
+        # e *OPC? risponde quando l'analizzatore ha finito
+        timeout = self.timeout
+        self.timeout = self.sweep_timeout() * 1e3
+        try:
             self.write_expect("INIT:IMMediate")
-            if (i + 1) % 10 == 0 or i == 0 or i == self.avg_count - 1:
-                print(f"[INIT:IMMediate] 1  ← media {i+1}/{self.avg_count}")
+        finally:
+            self.timeout = timeout
+        print(f"[INIT:IMMediate] 1  ← {self.avg_count} medie")
 
         # Leggi i dati complessi
         resp = self.query_expect("CALC:DATA:SDATA?", "Data readout failed.")
@@ -167,3 +207,55 @@ class VNA(EthernetDevice):
         data_imag = data[1::2]   # 1,3,5,...
 
         return {"real": data_real, "imag": data_imag}
+
+    # ---------- SEGMENTED SWEEP ----------
+
+    def read_segmented_data(self, windows, Sij):
+        """
+        Read S-parameter data only on the given windows, stitched into one trace.
+
+        windows: list of (center, span, points, IFBW) in Hz.
+        The windows are programmed as one segmented sweep when the analyzer supports it,
+        otherwise they are swept one at a time. Returns {"freq": ..., "S": ...} with S
+        complex, sorted by frequency.
+        Segmented sweeps are disabled only when the analyzer rejects the segment table;
+        any other error (e.g. a timeout) is raised to the caller.
+        """
+        if self.segmented_supported:
+            try:
+                freqs, S = self.__read_segmented_hw(windows, Sij)
+                return {"freq": freqs, "S": S}
+            except SegmentedSweepUnsupported as e:
+                warnings.warn(f"Segmented sweep not supported ({e}), sweeping window by window.", stacklevel=2)
+                self.segmented_supported = False
+
+        freqs = []
+        data = []
+        for center, span, points, ifbw in windows:
+            with self.batch():
+                self.min_freq = center - span / 2
+                self.max_freq = center + span / 2
+                self.point_count = int(points)
+                self.bandwidth = ifbw
+            d = self.read_data(Sij)
+            freqs.append(self.read_frequency_data())
+            data.append(d["real"] + 1j * d["imag"])
+
+        freqs, S = stitch_sweeps(freqs, data)
+        return {"freq": freqs, "S": S}
+
+    def __read_segmented_hw(self, windows, Sij):
+        self.write_expect("SENS:SEGM:DATA " + segment_table(windows))
+        self.write_expect("SENS:SWE:TYPE SEGM")
+        err = self.query("SYST:ERR?").strip()
+        if not err.startswith(("+0", "0")):
+            self.write_expect("SENS:SWE:TYPE LIN")
+            raise SegmentedSweepUnsupported(err)
+
+        try:
+            d = self.read_data(Sij)
+            freqs = self.read_frequency_data()
+        finally:
+            self.write_expect("SENS:SWE:TYPE LIN")
+
+        return stitch_sweeps([freqs], [d["real"] + 1j * d["imag"]])
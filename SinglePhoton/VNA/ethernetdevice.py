@@ -1,6 +1,9 @@
-import pyvisa
+import math
 import sys
 import time
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from visa_sessions import open_session, close_session
 
 class EthernetDevice:
     """
@@ -20,13 +23,12 @@ class EthernetDevice:
     _ip = ""
     __timeout = 0
     __res = None
-    __res_manager = None
-    debug = True
+    debug = False  # print every command (slow); for timings use visa_sessions.tracer
     debug_prefix = ""
 
     def __init__(self, ip_address_string):
-        self.__res_manager = pyvisa.ResourceManager()
-        self.__res = self.__res_manager.open_resource(f"tcpip0::{ip_address_string}::INSTR")
+        # Shared session: a new object for the same address reuses the open connection
+        self.__res = open_session(f"tcpip0::{ip_address_string}::INSTR")
 
         self._ip = ip_address_string
         self._name = self.query_expect("*IDN?")
@@ -36,12 +38,11 @@ class EthernetDevice:
         if self.on_init:
             self.on_init(ip_address_string)
     
-    def __del__(self):
-        self.close()
-
     def close(self):
+        """Close the session of this device (the other sessions stay open)"""
         if self.debug: print("[CLOSE]")
-        self.__res_manager.close()
+        close_session(f"tcpip0::{self._ip}::INSTR")
+        self.__res = None
     
     def write(self, command):
         self.__res.write(command)
@@ -53,10 +54,31 @@ class EthernetDevice:
         """Send binary values to device"""
         return self.__res.write_binary_values(command, data, datatype=datatype, is_big_endian=is_big_endian, header_fmt=header_fmt)
 
+    def batch(self, check_errors=True, verify=True, **kwargs):
+        """
+        Context that collects the settings and sends them on exit with a single *OPC? round trip.
+
+            with vna.batch():
+                vna.min_freq = 4e9
+                vna.max_freq = 5e9
+                vna.point_count = 2001
+
+        Inside the batch write_expect only queues the command and check_setting defers the
+        readback to the end of the batch (skipped with verify=False); errors are checked
+        once with SYST:ERR? (check_errors).
+        """
+        if self.__res is None: raise Exception("No connection.")
+        return self.__res.batch(check_errors=check_errors, verify=verify, **kwargs)
+
     def write_expect(self, command, error_msg = None):
         """Send write command to device and check for operation complete"""
         if self.__res is None: raise Exception("No connection.")
 
+        if self.__res.in_batch():
+            if self.debug: print(f"{self.debug_prefix}[{command}] (batch)")
+            self.write(command)
+            return
+
         result = self.query(f"{command}; *OPC?")
 
         if self.debug: 
@@ -90,6 +112,21 @@ class EthernetDevice:
         
         return data
     
+    def check_setting(self, query, expected, name, cast=float):
+        """
+        Read a setting back and raise if it differs from the expected value.
+        Inside a batch the readback is sent together with the final *OPC?.
+        """
+        if self.__res is None: raise Exception("No connection.")
+
+        if self.__res.in_batch():
+            self.__res.batch().verify(query, expected, cast=cast, name=name)
+            return
+
+        ans = cast(self.query(query).strip())
+        if not math.isclose(ans, cast(expected), rel_tol=1e-6, abs_tol=0.0):
+            raise Exception(f"Could not set '{name}' to {expected}. Instrument returned {ans}.")
+
     def write_binary_values_expect(self, command, data, datatype='h', error_msg = None):
         """
         Send binary values to device
@@ -0,0 +1,139 @@
+"""
+Cache su disco delle calibrazioni della linea: delay del cavo (tau) ed eventuale baseline
+di ampiezza/fase, indicizzate per (run, linea, banda di frequenza).
+
+    calibration/
+        index.json                              lista delle voci {run, line, fmin, fmax, tau, baseline}
+        baseline_<run>_<line>_<fmin>_<fmax>.npz freq e S21 di fondo (solo se salvata)
+
+Una voce vale per una traccia se il centro della traccia cade nella sua banda; se ce n'e'
+piu' d'una si usa la banda piu' stretta. I fitter (CircleFitter di 3DQubit, CircleEstimator
+di CircleFit, fit_resonance di CRIO_measures_new) guardano qui prima di rifittare il delay
+e ci salvano il tau quando devono calcolarlo.
+
+Uso:
+    cal = CalibrationCache("calibration", run="cooldown_2025_11", line="feedline_1")
+    cal.store(freqs, tau)              # es. da un file largo (cable_delay.py)
+    tau = cal.tau(freqs_risonanza)     # None se non c'e' niente per quella banda
+"""
+
+import contextlib
+import json
+import os
+import time
+import numpy as np
+
+# un lock piu' vecchio di cosi' (s) e' rimasto da un processo morto e viene tolto
+LOCK_STALE = 30.0
+
+
+class CalibrationCache:
+
+    def __init__(self, directory="calibration", run="default", line="default"):
+        self.directory = directory
+        self.run = run
+        self.line = line
+        self._index_path = os.path.join(directory, "index.json")
+        self._index = []
+        self._mtime = None
+
+    def _load(self, force=False):
+        # l'indice si rilegge solo se e' cambiato su disco (altri script o processi)
+        try:
+            mtime = os.path.getmtime(self._index_path)
+        except FileNotFoundError:
+            self._index, self._mtime = [], None
+            return self._index
+        if force or mtime != self._mtime:
+            with open(self._index_path) as f:
+                self._index = json.load(f)
+            self._mtime = mtime
+        return self._index
+
+    def _save(self, index):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{self._index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(index, f, indent=1)
+        # rename atomico: chi legge in parallelo vede o il vecchio indice o il nuovo
+        os.replace(tmp, self._index_path)
+        self._index, self._mtime = index, os.path.getmtime(self._index_path)
+
+    @contextlib.contextmanager
+    def _locked(self, timeout=60.0):
+        # lock su file (index.json.lock, creato in modo esclusivo) attorno a lettura, modifica e
+        # scrittura dell'indice: senza, due processi che salvano insieme perdono o duplicano voci
+        os.makedirs(self.directory, exist_ok=True)
+        lock_path = self._index_path + ".lock"
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > LOCK_STALE:
+                        os.remove(lock_path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Calibration index locked: {lock_path}")
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            os.remove(lock_path)
+
+    def lookup(self, freqs, run=None, line=None):
+        """Voce dell'indice per la traccia freqs (None se non c'e')."""
+        run = self.run if run is None else run
+        line = self.line if line is None else line
+        f_center = 0.5 * (np.min(freqs) + np.max(freqs))
+        best = None
+        for entry in self._load():
+            if entry["run"] != run or entry["line"] != line:
+                continue
+            if not entry["fmin"] <= f_center <= entry["fmax"]:
+                continue
+            if best is None or entry["fmax"] - entry["fmin"] < best["fmax"] - best["fmin"]:
+                best = entry
+        return best
+
+    def tau(self, freqs, run=None, line=None):
+        entry = self.lookup(freqs, run, line)
+        return None if entry is None else entry["tau"]
+
+    def baseline(self, freqs, run=None, line=None):
+        """Baseline complessa interpolata (ampiezza e fase) sulle freqs, None se non c'e'."""
+        entry = self.lookup(freqs, run, line)
+        if entry is None or entry["baseline"] is None:
+            return None
+        data = np.load(os.path.join(self.directory, entry["baseline"]))
+        f, S = data["freq"], data["S21"]
+        amplitude = np.interp(freqs, f, np.abs(S))
+        phase = np.interp(freqs, f, np.unwrap(np.angle(S)))
+        return amplitude * np.exp(1j * phase)
+
+    def store(self, freqs, tau, baseline=None, run=None, line=None, band=None):
+        """
+        Salva tau per la banda (di default quella coperta da freqs); baseline e' l'S21 di fondo
+        sulle stesse freqs. Una voce con stessi run, linea e banda viene sovrascritta.
+        """
+        run = self.run if run is None else run
+        line = self.line if line is None else line
+        fmin, fmax = band if band is not None else (np.min(freqs), np.max(freqs))
+        fmin, fmax = float(fmin), float(fmax)
+
+        entry = {"run": run, "line": line, "fmin": fmin, "fmax": fmax, "tau": float(tau), "baseline": None}
+        if baseline is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            entry["baseline"] = f"baseline_{run}_{line}_{fmin:.0f}_{fmax:.0f}.npz"
+            np.savez(os.path.join(self.directory, entry["baseline"]), freq=np.asarray(freqs), S21=np.asarray(baseline))
+
+        with self._locked():
+            index = [e for e in self._load(force=True) if (e["run"], e["line"], e["fmin"], e["fmax"]) != (run, line, fmin, fmax)]
+            index.append(entry)
+            self._save(index)
+        return entry
@@ -0,0 +1,241 @@
+"""
+Raw recording of PicoScope captures to disk.
+
+PicoRecorder writes the ADC counts (int16) as they come, from a dedicated writer thread,
+so the acquisition never waits for the disk. A recording is a JSON header plus a series
+of binary chunk files:
+
+    <name>.json           header: channels, range, offset, maxADC, dt, timebase, trigger, chunks
+    <name>_00000.bin      int16 samples, shape (n_samples, n_channels) (channels interleaved)
+    <name>_00001.bin      ...
+
+PicoRecording memory-maps the chunks back and converts to volts only the part that is asked for.
+
+    with PicoRecorder("../data", "gaus_env", scope.recording_header(sample_rate)) as rec:
+        data = scope.acq_block(sample_rate, 400, recorder=rec)
+
+    recording = PicoRecording("../data/gaus_env.json")
+    t, v = recording.time(), recording.volts('A')
+"""
+
+import json
+import os
+import queue
+import threading
+import numpy as np
+
+# Full scale of the PS5000A_RANGE values (10MV ... 200V), in mV
+CHANNEL_RANGES_MV = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000]
+
+
+class PicoRecorder:
+    """
+    Background writer of raw PicoScope data.
+
+    Parameters
+    ----------
+    directory : str
+        Folder of the recording (created if missing)
+    name : str
+        Base name of the header and chunk files
+    header : dict
+        Acquisition settings, at least 'channels' (list of channel names), 'range'
+        (channel -> PS5000A_RANGE index), 'maxADC' and 'dt' (s); see PICO.recording_header
+        (3DQubit) or PicoScope.recording_header (SinglePhoton)
+    chunk_samples : int, optional
+        Samples per channel in each chunk file (default: 2**24)
+    queue_size : int, optional
+        Maximum number of blocks waiting to be written (default: 256); write blocks when full
+    """
+
+    def __init__(self, directory: str, name: str, header: dict, chunk_samples: int = 2**24, queue_size: int = 256):
+        missing = [key for key in ('channels', 'range', 'maxADC', 'dt') if key not in header]
+        if missing:
+            raise ValueError(f"Missing keys in the recording header: {missing}")
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        self.header = dict(header, dtype='int16', layout='samples x channels', chunks=[])
+        self.channels = list(header['channels'])
+        self.chunk_samples = chunk_samples
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._file = None
+        self._written = 0
+        self._closed = False
+        self._write_header()
+
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def header_path(self):
+        return os.path.join(self.directory, f"{self.name}.json")
+
+    def write(self, block, copy: bool = True):
+        """
+        Queue a block of ADC counts for writing.
+
+        Parameters
+        ----------
+        block : dict or np.ndarray
+            Either channel -> int16 array (all of the same length), or an int16 array of
+            shape (n_channels, n_samples) with the rows in the order of header['channels']
+        copy : bool, optional
+            Copy the data before queueing (default: True); pass False only if the
+            buffers are not reused by the acquisition
+        """
+        if self._closed:
+            raise RuntimeError("Recorder already closed.")
+        if self._error is not None:
+            raise self._error
+
+        if isinstance(block, dict):
+            block = np.stack([np.asarray(block[ch]) for ch in self.channels])
+        block = np.asarray(block, dtype=np.int16)
+        if block.ndim == 1:
+            block = block[np.newaxis]
+        if block.shape[0] != len(self.channels):
+            raise ValueError(f"Expected {len(self.channels)} channels, got {block.shape[0]}.")
+        # Interleaved on disk: with more than one channel the transpose is already a copy
+        block = block.T.copy() if copy else np.ascontiguousarray(block.T)
+        self._queue.put(block)
+
+    def close(self):
+        """
+        Wait for the queued blocks to be written and complete the header.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._write_header()
+        if self._error is not None:
+            raise self._error
+
+    def _writer(self):
+        while True:
+            block = self._queue.get()
+            if block is None:
+                break
+            if self._error is not None:
+                continue
+            try:
+                self._write_block(block)
+            except OSError as e:
+                # Reported to the acquisition at the next write or at close
+                self._error = e
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write_block(self, block):
+        while len(block):
+            if self._file is None or self.header['chunks'][-1]['samples'] >= self.chunk_samples:
+                self._next_chunk()
+            chunk = self.header['chunks'][-1]
+            n = min(len(block), self.chunk_samples - chunk['samples'])
+            block[:n].tofile(self._file)
+            chunk['samples'] += n
+            self._written += n
+            block = block[n:]
+
+    def _next_chunk(self):
+        if self._file is not None:
+            self._file.close()
+            self._write_header()
+        file_name = f"{self.name}_{len(self.header['chunks']):05d}.bin"
+        self._file = open(os.path.join(self.directory, file_name), 'wb')
+        self.header['chunks'].append({'file': file_name, 'samples': 0})
+
+    def _write_header(self):
+        self.header['samples'] = self._written
+        tmp = f"{self.header_path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.header, f, indent=1)
+        os.replace(tmp, self.header_path)
+
+
+class PicoRecording:
+    """
+    Reader of a recording written by PicoRecorder.
+
+    The chunk files are memory-mapped: counts() returns views on the disk data and
+    volts() converts to float only the requested samples.
+
+    Parameters
+    ----------
+    path : str
+        Path of the JSON header
+    """
+
+    def __init__(self, path: str):
+        with open(path) as f:
+            self.header = json.load(f)
+        self.channels = list(self.header['channels'])
+        directory = os.path.dirname(path)
+
+        self._chunks = []
+        for chunk in self.header['chunks']:
+            if chunk['samples'] == 0:
+                continue
+            self._chunks.append(np.memmap(os.path.join(directory, chunk['file']), dtype=np.int16, mode='r',
+                                          shape=(chunk['samples'], len(self.channels))))
+        self._starts = np.cumsum([0] + [len(c) for c in self._chunks])
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    @property
+    def dt(self):
+        return self.header['dt']
+
+    def counts(self, channel: str, start: int = 0, stop: int = None):
+        """
+        ADC counts of a channel between the samples start and stop (a view if they are in a single chunk).
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        col = self.channels.index(channel)
+        parts = []
+        for chunk, first in zip(self._chunks, self._starts[:-1]):
+            lo, hi = max(start - first, 0), min(stop - first, len(chunk))
+            if lo < hi:
+                parts.append(chunk[lo:hi, col])
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.array([], dtype=np.int16)
+
+    def volts(self, channel: str, start: int = 0, stop: int = None):
+        """
+        Voltage (V) of a channel between the samples start and stop, converted on the fly.
+        """
+        range_mV = CHANNEL_RANGES_MV[self.header['range'][channel]]
+        offset = self.header.get('offset', {}).get(channel, 0)
+        scale = np.float32(range_mV / 1000 / self.header['maxADC'])
+        return self.counts(channel, start, stop) * scale - np.float32(offset)
+
+    def time(self, start: int = 0, stop: int = None):
+        """
+        Time axis (s) of the samples start ... stop, from the first recorded sample.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        return np.arange(start, stop) * self.dt
+
+    def records(self, channel: str, volts: bool = True):
+        """
+        The recording split in captures of header['record_samples'] samples, shape (n_records, record_samples).
+        """
+        n = self.header.get('record_samples')
+        if not n:
+            raise ValueError("The recording has no fixed record length ('record_samples' in the header).")
+        data = self.volts(channel) if volts else self.counts(channel)
+        return data[:len(data) // n * n].reshape(-1, n)
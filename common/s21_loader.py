@@ -0,0 +1,159 @@
+"""
+Caricamento unico dei dati S21, qualunque sia il formato del file:
+
+    .txt / .dat   colonne freq, Re, Im (tab, spazi o virgole; righe di header saltate).
+                  Con polar=True le colonne sono freq, ampiezza, fase (i file 'real', vedi README)
+    .csv          header con frequency, Re(S21), Im(S21), ... (separatore virgola o tab)
+    .npz          array strutturato sotto la chiave '0' (save_vna_data2) oppure
+                  chiavi piatte freq / signal / phase (save_vna_data)
+
+Alla prima lettura le colonne [freq, Re, Im] vengono salvate accanto al file in un
+<file>.s21.npy; le letture successive lo aprono in memory-map, senza riparsare il testo.
+La cache viene rifatta se il file originale e' piu' recente.
+
+    freqs, S21 = load_s21("T_dep/2_MKID_resonance_10mK.txt")
+"""
+
+import io
+import os
+import numpy as np
+
+CACHE_SUFFIX = ".s21.npy"
+COLUMNS_SUFFIX = ".cols.npy"
+
+# nomi dei campi accettati negli .npz
+FREQ_NAMES = ("freq", "frequency", "f", "frequencies")
+SIGNAL_NAMES = ("signal", "s21", "S21", "mag")
+PHASE_NAMES = ("phase", "arg", "angle")
+
+
+def _is_data_line(line):
+    tokens = line.replace(",", " ").split()
+    if not tokens:
+        return False
+    try:
+        float(tokens[0])
+        return True
+    except ValueError:
+        return False
+
+
+def load_columns(path, cache=True):
+    """
+    Tabella numerica di testo come array (n_colonne, n_righe), una colonna contigua per riga.
+    Salta le righe di header e riconosce tab, virgole o spazi; con cache=True usa la cache .npy.
+    """
+    return _cached(path, COLUMNS_SUFFIX, _parse_text, cache)
+
+
+def _parse_text(path):
+    # le righe di header sono quelle iniziali che non iniziano con un numero
+    skip = 0
+    first = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if _is_data_line(line):
+                first = line
+                break
+            skip += 1
+    if first is None:
+        raise ValueError(f"Nessun dato numerico in {path}")
+
+    source = path
+    if "\t" in first:
+        delimiter = "\t"
+        # alcuni file hanno virgole spurie tra i valori (vedi ResonanceKid.readfile)
+        if "," in first:
+            with open(path, encoding="utf-8") as f:
+                source = io.StringIO(f.read().replace(",", ""))
+    elif "," in first:
+        delimiter = ","
+    else:
+        delimiter = None
+    data = np.loadtxt(source, delimiter=delimiter, skiprows=skip, ndmin=2)
+    return np.ascontiguousarray(data.T)
+
+
+def _field(names, candidates):
+    for name in candidates:
+        if name in names:
+            return name
+    return None
+
+
+def _parse_npz(path, key="0"):
+    # freq, signal, phase da un .npz: strutturato sotto key ('0'), piatto, oggetto o 2D
+    arr = np.load(path, allow_pickle=True)
+    names = arr.files
+    if _field(names, FREQ_NAMES) and _field(names, SIGNAL_NAMES) and _field(names, PHASE_NAMES):
+        data = {name: arr[name] for name in names}
+    else:
+        data = arr[key if key in names else names[0]]
+        if isinstance(data, np.ndarray) and data.dtype == object and data.size == 1:
+            data = data.flat[0]
+
+    if isinstance(data, dict) or getattr(getattr(data, "dtype", None), "names", None):
+        fields = data.keys() if isinstance(data, dict) else data.dtype.names
+        f_name, s_name, p_name = _field(fields, FREQ_NAMES), _field(fields, SIGNAL_NAMES), _field(fields, PHASE_NAMES)
+        if f_name and s_name and p_name:
+            return np.asarray(data[f_name], float), np.asarray(data[s_name], float), np.asarray(data[p_name], float)
+    elif isinstance(data, np.ndarray) and data.ndim == 2 and data.shape[1] >= 3:
+        return data[:, 0].astype(float), data[:, 1].astype(float), data[:, 2].astype(float)
+
+    raise ValueError(f"Formato .npz non riconosciuto: {path} (chiavi {names})")
+
+
+def _cached(path, suffix, parse, cache):
+    # legge path con parse(path), passando dalla cache .npy se e' aggiornata
+    cache_path = path + suffix
+    if cache:
+        try:
+            if os.path.getmtime(cache_path) >= os.path.getmtime(path):
+                return np.load(cache_path, mmap_mode="r")
+        except FileNotFoundError:
+            pass
+
+    data = parse(path)
+
+    if cache:
+        tmp = f"{cache_path}.{os.getpid()}.tmp.npy"
+        try:
+            np.save(tmp, data)
+            # rename atomico: un altro processo non legge mai una cache scritta a meta'
+            os.replace(tmp, cache_path)
+        except OSError:
+            # cartella in sola lettura: si lavora senza cache
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return data
+
+
+def _parse_s21(path, polar, key):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npz":
+        freqs, signal, phase = _parse_npz(path, key)
+        S21 = signal * np.exp(1j * phase)
+        return np.stack([freqs, S21.real, S21.imag])
+
+    columns = _parse_text(path)
+    if columns.shape[0] < 3:
+        raise ValueError(f"{path}: servono almeno 3 colonne (freq, Re, Im), trovate {columns.shape[0]}")
+    freqs, c1, c2 = columns[:3]
+    if polar:
+        S21 = c1 * np.exp(1j * c2)
+        c1, c2 = S21.real, S21.imag
+    return np.stack([freqs, c1, c2])
+
+
+def load_s21(path, polar=False, key="0", cache=True):
+    """
+    Restituisce (freqs, S21 complesso) dal file path (.txt, .dat, .csv o .npz).
+    polar: per i file di testo con colonne freq, ampiezza, fase invece di freq, Re, Im.
+    key:   chiave dell'array strutturato negli .npz di save_vna_data2.
+    freqs e' una vista in sola lettura sulla cache in memory-map (copiarla se va modificata).
+    """
+    # file diversi per le diverse letture dello stesso file
+    suffix = (".polar" if polar else "") + (f".{key}" if key != "0" else "") + CACHE_SUFFIX
+    columns = _cached(path, suffix, lambda p: _parse_s21(p, polar, key), cache)
+    # asarray: ndarray semplici (una np.memmap si porta dietro il file anche nei pickle)
+    return np.asarray(columns[0]), columns[1] + 1j * columns[2]
@@ -0,0 +1,520 @@
+"""
+Registro delle sessioni VISA condiviso da tutte le classi degli strumenti.
+
+Un solo pyvisa.ResourceManager per processo e una sessione aperta per indirizzo:
+riaprire lo stesso strumento (es. SDG('193.206.156.10') ad ogni shot in acquire_singleshot)
+restituisce la sessione gia' aperta invece di rifare il setup TCP/VXI-11 o GPIB.
+
+    from visa_sessions import open_session
+    sdg = open_session("TCPIP0::193.206.156.10::inst0::INSTR")
+    sdg.write("C1:OUTP ON")
+
+La sessione si usa come una resource di pyvisa (write, query, read_raw, timeout, ...).
+Se la connessione cade (sessione chiusa, errore di I/O o connessione persa) viene riaperta
+e il comando viene ripetuto una volta; i timeout invece vengono rilanciati cosi' come sono,
+perche' ripetere un comando gia' arrivato allo strumento non e' sicuro.
+Tutte le sessioni vengono chiuse all'uscita del processo.
+
+Con tracer.enable() ogni operazione di I/O (write, query, trasferimenti binari) viene
+cronometrata: gli eventi finiscono in un buffer circolare in memoria e i tempi in un
+istogramma per strumento e comando, da cui tracer.report() stampa p50/p99.
+
+    tracer.enable()
+    ...                                 # il loop di misura
+    tracer.report()
+    tracer.dump("trace.json")           # da aprire con https://ui.perfetto.dev (o .csv)
+
+Disabilitato (il default) costa solo il controllo di tracer.enabled.
+"""
+
+import atexit
+import collections
+import csv
+import json
+import math
+import threading
+import time
+import pyvisa
+from pyvisa import constants, errors
+
+# codici VISA per cui la sessione si considera persa e va riaperta
+RECONNECT_CODES = {
+    constants.StatusCode.error_connection_lost,
+    constants.StatusCode.error_invalid_object,
+    constants.StatusCode.error_io,
+    constants.StatusCode.error_no_listeners,
+    constants.StatusCode.error_resource_not_found,
+}
+
+# metodi della resource che vengono ripetuti dopo una riconnessione
+_RETRY_METHODS = {
+    "write", "read", "query", "write_raw", "read_raw", "read_bytes",
+    "write_ascii_values", "write_binary_values", "read_ascii_values", "read_binary_values",
+    "query_ascii_values", "query_binary_values", "clear", "assert_trigger",
+}
+
+# lunghezza massima di un messaggio SCPI (buffer di ingresso dello strumento) nei batch
+MAX_COMMAND_LENGTH = 1000
+
+_rm = None
+_sessions = {}
+_redirects = {}
+_lock = threading.Lock()
+
+
+def resource_manager():
+    """Il ResourceManager del processo (creato alla prima chiamata)."""
+    global _rm
+    if _rm is None:
+        _rm = pyvisa.ResourceManager()
+    return _rm
+
+
+def _key(address):
+    # "tcpip0::1.2.3.4::INSTR" e "TCPIP0::1.2.3.4::inst0::INSTR" sono lo stesso strumento
+    parts = address.upper().split("::")
+    if parts[0].startswith("TCPIP") and len(parts) == 3 and parts[2] == "INSTR":
+        parts.insert(2, "INST0")
+    return "::".join(parts)
+
+
+class VisaSession:
+    """
+    Resource VISA condivisa: inoltra metodi e attributi alla resource di pyvisa e la
+    riapre se la connessione cade. Gli attributi impostati (timeout, terminazioni, ...)
+    vengono riapplicati alla nuova resource.
+    """
+
+    def __init__(self, address, **attrs):
+        object.__setattr__(self, "_address", address)
+        object.__setattr__(self, "name", address)
+        object.__setattr__(self, "_attrs", dict(attrs))
+        object.__setattr__(self, "_io_lock", threading.RLock())
+        object.__setattr__(self, "_resource", None)
+        object.__setattr__(self, "n_reconnects", 0)
+        object.__setattr__(self, "_batch", None)
+        self._open()
+
+    def _open(self):
+        resource = resource_manager().open_resource(self._address)
+        for name, value in self._attrs.items():
+            setattr(resource, name, value)
+        object.__setattr__(self, "_resource", resource)
+
+    def reconnect(self):
+        """Chiude (se possibile) e riapre la resource."""
+        with self._io_lock:
+            try:
+                self._resource.close()
+            except (errors.Error, AttributeError):
+                pass
+            self._open()
+            object.__setattr__(self, "n_reconnects", self.n_reconnects + 1)
+
+    def is_alive(self, ping=False):
+        """
+        True se la sessione e' ancora valida. Con ping=True manda anche *OPC? (un giro
+        sullo strumento) per accorgersi di un cavo staccato o di uno strumento spento.
+        """
+        try:
+            self._resource.session
+            if ping:
+                with self._io_lock:
+                    self._resource.query("*OPC?")
+            return True
+        except (errors.Error, AttributeError):
+            return False
+
+    def close(self):
+        """Chiude la sessione e la toglie dal registro."""
+        with _lock:
+            keys = [key for key, session in _sessions.items() if session is self]
+        for key in keys:
+            close_session(key)
+
+    def batch(self, max_length=MAX_COMMAND_LENGTH, check_errors=True, verify=True, root=True):
+        """
+        Context per mandare piu' impostazioni con un solo giro *OPC?:
+
+            with vna.batch() as b:
+                vna.write("SENS:FREQ:START 4e9")
+                vna.write("SENS:FREQ:STOP 5e9")
+                b.verify("SENS:FREQ:START?", 4e9)
+
+        I write dentro il with vengono accumulati e mandati all'uscita (vedi CommandBatch).
+        Un batch aperto dentro un altro si unisce a quello esterno. Con root=False i comandi
+        non vengono preceduti da ':' (per strumenti con comandi non SCPI, es. i Siglent).
+        """
+        if self._batch is not None:
+            return self._batch
+        return CommandBatch(self, max_length, check_errors, verify, root)
+
+    def in_batch(self):
+        """True se un batch e' aperto da questo thread."""
+        return self._batch is not None and self._batch._owner == threading.get_ident()
+
+    def _call(self, name, *args, **kwargs):
+        if self.in_batch():
+            # un query dentro il batch deve trovare applicati i comandi precedenti
+            batch = self._batch
+            object.__setattr__(self, "_batch", None)
+            try:
+                batch.send_pending()
+            finally:
+                object.__setattr__(self, "_batch", batch)
+        if not tracer.enabled:
+            return self._retry(name, args, kwargs)
+        start, result, ok = time.perf_counter(), None, False
+        try:
+            result = self._retry(name, args, kwargs)
+            ok = True
+            return result
+        finally:
+            tracer.record(self.name, name, args[0] if args else None, start, result, ok)
+
+    def _retry(self, name, args, kwargs):
+        with self._io_lock:
+            try:
+                return getattr(self._resource, name)(*args, **kwargs)
+            except errors.InvalidSession:
+                pass
+            except errors.VisaIOError as e:
+                if e.error_code not in RECONNECT_CODES:
+                    raise
+            self.reconnect()
+            return getattr(self._resource, name)(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name == "write" and self.in_batch():
+            return self._batch.write
+        if name in _RETRY_METHODS:
+            return lambda *args, **kwargs: self._call(name, *args, **kwargs)
+        return getattr(self._resource, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resource, name, value)
+        self._attrs[name] = value
+
+    def __repr__(self):
+        return f"<VisaSession {self._address}>"
+
+
+class CommandBatch:
+    """
+    Comandi SCPI accumulati e mandati tutti insieme (vedi VisaSession.batch).
+
+    I write vengono uniti con ';' in messaggi lunghi al massimo max_length caratteri;
+    l'ultimo messaggio finisce con *OPC?, le eventuali rilette (verify) e SYST:ERR?,
+    quindi tutto il batch costa un solo giro di query. Un query() dentro il batch
+    manda prima i comandi accumulati.
+    """
+
+    def __init__(self, session, max_length=MAX_COMMAND_LENGTH, check_errors=True, verify=True, root=True):
+        self.session = session
+        self.max_length = max_length
+        self.check_errors = check_errors
+        self.verify_enabled = verify
+        self.root = root
+        self.commands = []
+        self.readbacks = []
+        self.opc = None
+        self._depth = 0
+        self._owner = None
+
+    def __enter__(self):
+        if self._depth == 0:
+            self._owner = threading.get_ident()
+            object.__setattr__(self.session, "_batch", self)
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth > 0:
+            return False
+        object.__setattr__(self.session, "_batch", None)
+        if exc_type is None:
+            self.flush()
+        return False
+
+    def write(self, command):
+        self.commands.append(command.strip())
+
+    def verify(self, query, expected, cast=float, rel_tol=1e-6, name=None):
+        """
+        Rilettura di un'impostazione fatta alla fine del batch (nello stesso messaggio di *OPC?).
+        Ignorata se il batch e' stato aperto con verify=False.
+        """
+        if self.verify_enabled:
+            self.readbacks.append((query, expected, cast, rel_tol, name or query))
+
+    def _messages(self, commands):
+        # i comandi dopo il primo iniziano con ':' per ripartire dalla radice dell'albero SCPI
+        messages, current = [], ""
+        for command in commands:
+            if self.root and current and not command.startswith(("*", ":")):
+                command = ":" + command
+            if current and len(current) + 1 + len(command) > self.max_length:
+                messages.append(current)
+                current = command.lstrip(":")
+            else:
+                current = f"{current};{command}" if current else command
+        if current:
+            messages.append(current)
+        return messages
+
+    def send_pending(self):
+        """Manda i comandi accumulati senza aspettare (prima di un query dentro il batch)."""
+        for message in self._messages(self.commands):
+            self.session._call("write", message)
+        self.commands = []
+
+    def flush(self):
+        """Manda i comandi accumulati, aspetta *OPC? e controlla rilette ed errori."""
+        queries = ["*OPC?"] + [r[0] for r in self.readbacks] + (["SYST:ERR?"] if self.check_errors else [])
+        messages = self._messages(self.commands + queries)
+        for message in messages[:-1]:
+            self.session._call("write", message)
+        response = self.session._call("query", messages[-1]).strip()
+        self.commands = []
+
+        # le risposte di un messaggio con piu' query sono separate da ';'
+        values = response.split(";", len(queries) - 1)
+        self.opc = values[0]
+        failed = []
+        for (query, expected, cast, rel_tol, name), value in zip(self.readbacks, values[1:]):
+            try:
+                ans = cast(value.strip())
+                ok = math.isclose(ans, cast(expected), rel_tol=rel_tol) if isinstance(ans, (int, float)) else ans == cast(expected)
+            except ValueError:
+                ans, ok = value, False
+            if not ok:
+                failed.append(f"'{name}' = {ans} (atteso {expected})")
+        self.readbacks = []
+
+        if self.check_errors:
+            err = values[-1].strip()
+            if not err.startswith(("+0", "0")):
+                raise Exception(f"Errore SCPI nel batch: {err}")
+        if failed:
+            raise Exception("Impostazioni non applicate: " + ", ".join(failed))
+        return self.opc
+
+
+class Tracer:
+    """
+    Tempi delle operazioni di I/O verso gli strumenti (vedi tracer in fondo al modulo).
+
+    Ogni operazione diventa un evento (inizio, durata, strumento, metodo, comando, byte
+    della risposta, ok) in un buffer circolare di size eventi; la durata finisce anche
+    nell'istogramma di (strumento, comando), con bins_per_decade bin logaritmici per
+    decade a partire da 1 us, che tiene conto di tutte le operazioni e non solo delle
+    ultime size. Il comando e' l'intestazione SCPI: "SENS:FREQ:START 4e9" -> "SENS:FREQ:START".
+    """
+
+    def __init__(self, size=100000, bins_per_decade=20):
+        self.enabled = False
+        self.bins_per_decade = bins_per_decade
+        self._events = collections.deque(maxlen=size)
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+    def enable(self, size=None):
+        """Inizia a registrare (size cambia la lunghezza del buffer e lo svuota)."""
+        if size is not None and size != self._events.maxlen:
+            with self._lock:
+                self._events = collections.deque(maxlen=size)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        """Svuota buffer e istogrammi."""
+        with self._lock:
+            self._events.clear()
+            self._histograms.clear()
+            self._t0 = time.perf_counter()
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.disable()
+        return False
+
+    @staticmethod
+    def header(command, method=None):
+        """Intestazione del comando ("C1:BSWV FRQ,10" -> "C1:BSWV"); piu' comandi uniti con ';' -> "SENS:FREQ:START;..."."""
+        if command is None:
+            return method
+        if isinstance(command, (bytes, bytearray)):
+            command = bytes(command[:64]).decode("latin-1")
+        first, _, rest = command.strip().partition(";")
+        first = first.split(None, 1)[0] if first.strip() else method
+        return f"{first};..." if rest else first
+
+    def record(self, instrument, method, command, start, result=None, ok=True):
+        """Registra un'operazione iniziata a start (time.perf_counter()) e finita adesso."""
+        duration = time.perf_counter() - start
+        header = self.header(command, method)
+        if isinstance(result, (str, bytes, bytearray)):
+            nbytes = len(result)
+        elif hasattr(result, "nbytes"):
+            nbytes = result.nbytes
+        elif isinstance(result, (list, tuple)):
+            nbytes = len(result)
+        else:
+            nbytes = 0
+        if isinstance(command, (bytes, bytearray)):
+            command = bytes(command[:200]).decode("latin-1")
+        elif isinstance(command, str) and len(command) > 200:
+            command = command[:200] + "..."
+        b = int(math.log10(max(duration, 1e-6) / 1e-6) * self.bins_per_decade)
+        with self._lock:
+            self._events.append((start - self._t0, duration, instrument, method, header, command, nbytes, ok))
+            hist = self._histograms.get((instrument, header))
+            if hist is None:
+                hist = self._histograms[(instrument, header)] = dict(n=0, total=0.0, max=0.0, bins=collections.Counter())
+            hist["n"] += 1
+            hist["total"] += duration
+            hist["max"] = max(hist["max"], duration)
+            hist["bins"][b] += 1
+
+    def events(self):
+        """Eventi nel buffer: (t [s dall'ultimo clear], durata [s], strumento, metodo, comando, testo, byte, ok)."""
+        with self._lock:
+            return list(self._events)
+
+    def _percentile(self, hist, q):
+        # bordo superiore del bin che contiene il quantile q (errore < 1 bin, ~12% con 20 bin/decade)
+        target = q * hist["n"]
+        count = 0
+        for b in sorted(hist["bins"]):
+            count += hist["bins"][b]
+            if count >= target:
+                return min(1e-6 * 10 ** ((b + 1) / self.bins_per_decade), hist["max"])
+        return hist["max"]
+
+    def stats(self):
+        """
+        Statistiche per (strumento, comando): n, total, mean, p50, p99, max (tempi in s),
+        ordinate per tempo totale decrescente.
+        """
+        with self._lock:
+            histograms = {key: dict(hist, bins=collections.Counter(hist["bins"])) for key, hist in self._histograms.items()}
+        result = {}
+        for key, hist in sorted(histograms.items(), key=lambda item: -item[1]["total"]):
+            result[key] = dict(n=hist["n"], total=hist["total"], mean=hist["total"] / hist["n"],
+                               p50=self._percentile(hist, 0.5), p99=self._percentile(hist, 0.99), max=hist["max"])
+        return result
+
+    def report(self, top=30):
+        """Stampa le top righe di stats()."""
+        stats = self.stats()
+        total = sum(s["total"] for s in stats.values())
+        print(f"{'strumento':<36}{'comando':<28}{'n':>8}{'totale [ms]':>13}{'%':>6}{'p50 [ms]':>10}{'p99 [ms]':>10}{'max [ms]':>10}")
+        for (instrument, header), s in list(stats.items())[:top]:
+            print(f"{instrument[-36:]:<36}{str(header)[:27]:<28}{s['n']:>8}{1e3 * s['total']:>13.2f}"
+                  f"{100 * s['total'] / total if total else 0:>6.1f}{1e3 * s['p50']:>10.3f}{1e3 * s['p99']:>10.3f}{1e3 * s['max']:>10.3f}")
+
+    def dump(self, path):
+        """
+        Scrive gli eventi del buffer su file: .json nel formato Trace Event (Perfetto,
+        chrome://tracing, una riga per strumento), altrimenti CSV.
+        """
+        events = self.events()
+        if path.endswith(".json"):
+            instruments = {}
+            trace = []
+            for t, duration, instrument, method, header, command, nbytes, ok in events:
+                if instrument not in instruments:
+                    instruments[instrument] = len(instruments) + 1
+                    trace.append(dict(name="thread_name", ph="M", pid=1, tid=instruments[instrument], args=dict(name=instrument)))
+                trace.append(dict(name=header, cat=method, ph="X", pid=1, tid=instruments[instrument], ts=1e6 * t, dur=1e6 * duration,
+                                  args=dict(command=command, bytes=nbytes, ok=ok)))
+            with open(path, "w") as f:
+                json.dump(dict(traceEvents=trace, displayTimeUnit="ms"), f)
+        else:
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["t", "duration", "instrument", "method", "header", "command", "bytes", "ok"])
+                writer.writerows(events)
+
+
+# registro globale usato da VisaSession e dalle classi che non passano da VISA (LO)
+tracer = Tracer()
+
+
+def open_session(address, ping=False, **attrs):
+    """
+    Sessione per l'indirizzo VISA address: quella gia' aperta se c'e' ed e' valida,
+    altrimenti una nuova. ping=True verifica la sessione esistente con un *OPC?.
+    Gli attributi extra (es. timeout=10000) vengono impostati sulla resource.
+    """
+    key = _key(address)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            target, target_attrs = _redirects.get(key, (address, {}))
+            session = _sessions[key] = VisaSession(target, **dict(target_attrs, **attrs))
+            object.__setattr__(session, "name", address)
+            return session
+    if not session.is_alive(ping):
+        session.reconnect()
+    for name, value in attrs.items():
+        setattr(session, name, value)
+    return session
+
+
+def redirect(address, target, **attrs):
+    """
+    Le sessioni aperte in seguito per address useranno target (es. il simulatore
+    "TCPIP0::127.0.0.1::5025::SOCKET" di scpi_simulator) con gli attributi attrs:
+    cosi' le classi con l'indirizzo scritto nel codice si provano senza lo strumento.
+    """
+    with _lock:
+        _redirects[_key(address)] = (target, attrs)
+
+
+def clear_redirects():
+    """Toglie tutti i reindirizzamenti."""
+    with _lock:
+        _redirects.clear()
+
+
+def close_session(address):
+    """Chiude la sessione di address (se aperta) e la toglie dal registro."""
+    with _lock:
+        session = _sessions.pop(_key(address), None)
+    if session is not None:
+        try:
+            session._resource.close()
+        except (errors.Error, AttributeError):
+            pass
+
+
+def close_all():
+    """Chiude tutte le sessioni e il ResourceManager."""
+    global _rm
+    with _lock:
+        addresses = list(_sessions)
+    for address in addresses:
+        close_session(address)
+    if _rm is not None:
+        try:
+            _rm.close()
+        except errors.Error:
+            pass
+        _rm = None
+
+
+def sessions():
+    """Indirizzi delle sessioni aperte."""
+    with _lock:
+        return [s._address for s in _sessions.values()]
+
+
+atexit.register(close_all)